@@ -0,0 +1,78 @@
+"""Script for generating the resized variants of existing event images.
+
+Images uploaded before resized variants existed are only available in their
+original size. This script writes their thumbnail, display sizes and WebP
+encodings (see usctimeline/images.py) and records them in the database.
+SVG images are left as they are.
+
+How to execute this script:
+`python backfillimages.py`
+
+Add `--force` to regenerate the variants of every image, e.g. after
+changing the image quality settings.
+"""
+
+import os
+import argparse
+from sqlalchemy import or_
+from usctimeline import create_app, db
+from usctimeline.models import Image
+from usctimeline.images import RASTER_FORMATS, process_image
+
+
+def backfill(force=False):
+    """Generates the variants of the images which have none.
+
+    The size of each image is recorded as well (see images.py
+    process_image()). SVG images never have variants and are skipped, and
+    unreadable files are reported and skipped. Each image is committed on
+    its own, so an interrupted run can simply be started again.
+
+    Args:
+        force: If True, the variants of every image are regenerated.
+
+    Returns:
+        Tuple of (number of images processed, number of variants written).
+    """
+    query = db.session.query(Image.id, Image.filename).order_by(Image.id)
+    if not force:
+        query = query.filter(or_(~Image.variants.any(), Image.width.is_(None)))
+    image_ids = [
+        image_id for image_id, filename in query
+        if os.path.splitext(filename)[1].lower() in RASTER_FORMATS
+    ]
+    written = 0
+    for image_id in image_ids:
+        image = Image.query.get(image_id)
+        try:
+            process_image(image)
+        except OSError as e:
+            db.session.rollback()
+            print(f"Skipped image '{image.filename}': {e}")
+            continue
+        written += len(image.variants)
+        db.session.commit()
+    return len(image_ids), written
+
+
+def main():
+    """Parses the command line arguments, then backfills image variants.
+
+    Returns:
+        None
+    """
+    parser = argparse.ArgumentParser(description='Generate resized event images.')
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Regenerate the variants of every image.'
+    )
+    args = parser.parse_args()
+    images, variants = backfill(args.force)
+    print(f'Wrote {variants} variant(s) of {images} image(s).')
+
+
+if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        main()
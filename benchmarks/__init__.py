@@ -0,0 +1,105 @@
+"""Helpers shared by the benchmark scripts.
+
+Benchmarks run against a throwaway SQLite database filled with synthetic
+events, never against the database configured in `etc/config.json`. Run them
+from the `USC_Timeline` directory, e.g. `python -m benchmarks.search`.
+"""
+
+import os
+import time
+import random
+import tempfile
+from datetime import date, timedelta
+from usctimeline import create_app, db, engine_profile, timeline_cache
+from usctimeline.models import Category, Event, Tag, event_tags
+
+WORDS = [
+    'USC', 'council', 'election', 'students', 'campus', 'concert', 'budget',
+    'referendum', 'orientation', 'homecoming', 'protest', 'library', 'radio',
+    'gazette', 'athletics', 'charity', 'festival', 'lecture', 'strike', 'award'
+]
+
+
+def create_benchmark_app(database_path=None, profile='sqlite', reset=True):
+    """Creates an app bound to a SQLite database.
+
+    Args:
+        database_path: Path of the SQLite file. A temporary file is used if
+            None.
+        profile: Engine profile (see usctimeline/engine.py).
+        reset: If True, the schema is dropped and created empty.
+
+    Returns:
+        An instance of Flask app.
+    """
+    if database_path is None:
+        fd, database_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+    app = create_app()
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{database_path}'
+    app.config['DATABASE_PROFILE'] = profile
+    app.config['TIMELINE_CACHE_BACKEND'] = None
+    engine_profile.init_app(app)
+    timeline_cache.init_app(app)
+    if reset:
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+    return app
+
+
+def seed_events(count, tag_count=200, seed=1965, chunk_size=5000):
+    """Fills the current app's database with synthetic events.
+
+    Must be called inside an app context.
+
+    Args:
+        count: Number of events to insert.
+        tag_count: Number of tags to create.
+        seed: Seed of the random generator, for reproducible datasets.
+        chunk_size: Number of events inserted per statement batch.
+
+    Returns:
+        None
+    """
+    rng = random.Random(seed)
+    db.session.execute(Category.__table__.insert(), [
+        {'id': 1, 'name': 'USC'},
+        {'id': 2, 'name': 'Statistics'},
+        {'id': 3, 'name': 'Culture'},
+    ])
+    db.session.execute(Tag.__table__.insert(), [
+        {'id': tag_id, 'name': f'Tag {tag_id}'}
+        for tag_id in range(1, tag_count + 1)
+    ])
+    first_day = date(1965, 1, 1)
+    days = (date(2020, 12, 31) - first_day).days
+    for start in range(0, count, chunk_size):
+        events = []
+        tags = []
+        for event_id in range(start + 1, min(start + chunk_size, count) + 1):
+            events.append({
+                'id': event_id,
+                'title': ' '.join(rng.sample(WORDS, 3)) + f' {event_id}',
+                'date': first_day + timedelta(days=rng.randrange(days)),
+                'description': ' '.join(rng.choices(WORDS, k=80)),
+                'external_url': None,
+                'category_id': rng.randint(1, 3),
+            })
+            for tag_id in rng.sample(range(1, tag_count + 1), rng.randint(0, 3)):
+                tags.append({'event_id': event_id, 'tag_id': tag_id})
+        db.session.execute(Event.__table__.insert(), events)
+        if tags:
+            db.session.execute(event_tags.insert(), tags)
+    db.session.commit()
+
+
+def timed(function, *args, repeat=5):
+    """Calls <function> <repeat> times and returns the best time in ms."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
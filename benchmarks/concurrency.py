@@ -0,0 +1,139 @@
+"""Benchmark of reader throughput while events are being imported.
+
+Reader processes page through the events of random years, as the timeline
+and search do, while a writer process inserts events through the ORM in
+batches, as import.py does. Each engine profile runs against its own SQLite
+file, since WAL mode persists in the database file once enabled.
+
+How to execute this script:
+`python -m benchmarks.concurrency [event_count] [readers] [seconds]`
+(defaults to 20000 events, 4 readers and 5 seconds per profile)
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+import multiprocessing
+from datetime import date, timedelta
+from sqlalchemy.exc import OperationalError
+from benchmarks import WORDS, create_benchmark_app, seed_events
+from usctimeline import db
+from usctimeline.models import Event
+
+PROFILES = ['default', 'sqlite']
+WRITE_BATCH_SIZE = 200
+
+
+def read_events(database_path, profile, seconds, results):
+    """Reader process: queries a page of a random year until time is up."""
+    app = create_benchmark_app(database_path, profile, reset=False)
+    rng = random.Random(os.getpid())
+    latencies = []
+    errors = 0
+    with app.app_context():
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            year = rng.randint(1965, 2020)
+            start = time.perf_counter()
+            try:
+                db.session.query(Event.id, Event.title, Event.date).filter(
+                    Event.date.between(date(year, 1, 1), date(year, 12, 31))
+                ).order_by(Event.date).limit(50).all()
+                db.session.rollback()
+            except OperationalError:
+                db.session.rollback()
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+    results.put(('reader', latencies, errors))
+
+
+def write_events(database_path, profile, seconds, results):
+    """Writer process: adds events through the ORM in committed batches."""
+    app = create_benchmark_app(database_path, profile, reset=False)
+    rng = random.Random(1965)
+    written = 0
+    errors = 0
+    with app.app_context():
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            for _ in range(WRITE_BATCH_SIZE):
+                db.session.add(Event(
+                    title=' '.join(rng.sample(WORDS, 3)),
+                    date=date(1965, 1, 1) + timedelta(days=rng.randrange(20000)),
+                    description=' '.join(rng.choices(WORDS, k=80)),
+                    category_id=rng.randint(1, 3)
+                ))
+            try:
+                db.session.commit()
+                written += WRITE_BATCH_SIZE
+            except OperationalError:
+                db.session.rollback()
+                errors += 1
+    results.put(('writer', written, errors))
+
+
+def run_profile(profile, count, readers, seconds):
+    """Seeds a database for <profile>, then runs readers and one writer."""
+    fd, database_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    app = create_benchmark_app(database_path, profile)
+    with app.app_context():
+        seed_events(count)
+        db.session.remove()
+        db.engine.dispose()
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [
+        context.Process(target=read_events, args=(database_path, profile, seconds, results))
+        for _ in range(readers)
+    ]
+    processes.append(context.Process(
+        target=write_events, args=(database_path, profile, seconds, results)
+    ))
+    for process in processes:
+        process.start()
+    latencies = []
+    read_errors = 0
+    written = write_errors = 0
+    for _ in processes:
+        kind, value, errors = results.get()
+        if kind == 'reader':
+            latencies.extend(value)
+            read_errors += errors
+        else:
+            written, write_errors = value, errors
+    for process in processes:
+        process.join()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(database_path + suffix):
+            os.remove(database_path + suffix)
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0.0
+    return {
+        'reads_per_sec': len(latencies) / seconds,
+        'p95_ms': p95,
+        'read_errors': read_errors,
+        'writes_per_sec': written / seconds,
+        'write_errors': write_errors,
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    readers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+    print(f'{count} events, {readers} readers, 1 writer, {seconds:g}s per profile')
+    print(f"{'profile':<10}{'reads/s':>10}{'p95 ms':>9}{'read errors':>13}"
+          f"{'rows/s written':>16}{'write errors':>14}")
+    for profile in PROFILES:
+        stats = run_profile(profile, count, readers, seconds)
+        print(f"{profile:<10}{stats['reads_per_sec']:>10.0f}{stats['p95_ms']:>9.1f}"
+              f"{stats['read_errors']:>13}{stats['writes_per_sec']:>16.0f}"
+              f"{stats['write_errors']:>14}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Benchmark of the parallel parse/validate pipeline of bulk imports.
+
+Writes a synthetic NDJSON import file, then for each number of parse worker
+processes (see usctimeline/importer.py parsed_chunks()) measures:
+
+- parse: records parsed and validated per second, without writing.
+- import: records imported per second by bulk_import(), into an empty
+  database, with the parsing overlapped with the writes.
+
+How to execute this script:
+`python -m benchmarks.pipeline [record_count] [chunk_size]` (defaults to
+100000 records in chunks of 1000)
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+from datetime import date, timedelta
+from benchmarks import WORDS, create_benchmark_app, seed_events
+from usctimeline import db
+from usctimeline.importer import bulk_import, load_lookups, parsed_chunks, stream_records
+
+CATEGORIES = ['USC', 'Statistics', 'Culture']
+TAG_COUNT = 200
+
+
+def write_records(path, count, seed=1965):
+    """Writes <count> synthetic import records to an NDJSON file."""
+    rng = random.Random(seed)
+    first_day = date(1965, 1, 1)
+    with open(path, 'w') as file:
+        for number in range(count):
+            day = first_day + timedelta(days=rng.randrange(20000))
+            tags = rng.sample(range(1, TAG_COUNT + 1), rng.randint(0, 3))
+            file.write(json.dumps({
+                'Title': ' '.join(rng.sample(WORDS, 3)) + f' {number}',
+                'Date': day.isoformat(),
+                'Description': ' '.join(rng.choices(WORDS, k=80)),
+                'URL': '',
+                'Category': rng.choice(CATEGORIES),
+                'Tag': ','.join(f'Tag {tag_id}' for tag_id in tags),
+            }) + '\n')
+
+
+def parse_rate(path, chunk_size, workers):
+    """Returns the records parsed per second by parsed_chunks()."""
+    categories, tags = load_lookups()
+    start = time.perf_counter()
+    with open(path, 'rb') as file:
+        parsed = sum(
+            chunk.size for chunk in parsed_chunks(
+                stream_records(file), chunk_size, categories, tags, workers
+            )
+        )
+    return parsed / (time.perf_counter() - start)
+
+
+def import_rate(path, chunk_size, workers):
+    """Returns the records imported per second by bulk_import()."""
+    with open(path, 'rb') as file:
+        result = bulk_import(stream_records(file), chunk_size, workers=workers)
+    return result.rows_per_second
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    fd, path = tempfile.mkstemp(suffix='.ndjson')
+    os.close(fd)
+    write_records(path, count)
+    cpus = os.cpu_count() or 1
+    worker_counts = [n for n in sorted({0, 1, 2, 4, 8, cpus}) if n <= max(cpus, 1)]
+    print(f'{count} records, chunks of {chunk_size}, {cpus} CPUs')
+    print(f"{'workers':<9}{'parse rec/s':>13}{'import rec/s':>14}")
+    for workers in worker_counts:
+        app = create_benchmark_app()
+        with app.app_context():
+            seed_events(0, tag_count=TAG_COUNT)
+            parsed = parse_rate(path, chunk_size, workers)
+            imported = import_rate(path, chunk_size, workers)
+            db.session.remove()
+            db.drop_all()
+        print(f'{workers:<9}{parsed:>13.0f}{imported:>14.0f}')
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
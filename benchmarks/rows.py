@@ -0,0 +1,87 @@
+"""Benchmark of event list loading with full entities against projected rows.
+
+Loads every event, as the manage events page does, and the events of a
+result page, as search does: once as Event entities with their tags and
+once as EventRow tuples (usctimeline/events/rows.py). Reports the best
+latency and the peak memory allocated while loading, measured with
+tracemalloc in a separate run.
+
+How to execute this script:
+`python -m benchmarks.rows [event_count ...]` (defaults to 10000 and 100000
+events)
+"""
+
+import sys
+import tracemalloc
+from sqlalchemy.orm import joinedload, selectinload
+from benchmarks import create_benchmark_app, seed_events, timed
+from usctimeline import db
+from usctimeline.models import Event
+from usctimeline.events.rows import all_event_rows, event_rows
+
+PAGE_SIZE = 25
+
+
+def all_entities():
+    """Loads every event with its tags as ORM entities."""
+    return Event.query.options(
+        selectinload(Event.tags)
+    ).order_by(Event.id).all()
+
+
+def page_entities(event_ids):
+    """Loads the events of <event_ids> with their tags as ORM entities."""
+    return Event.query.options(
+        joinedload(Event.tags)
+    ).filter(Event.id.in_(event_ids)).all()
+
+
+def fresh(function, *args):
+    """Calls <function> with an empty identity map, as a new request would."""
+    db.session.expunge_all()
+    return function(*args)
+
+
+def peak_memory(function, *args):
+    """Returns the peak memory in MB allocated by one call of <function>."""
+    db.session.expunge_all()
+    tracemalloc.start()
+    result = function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak / 1024 / 1024
+
+
+def run(count):
+    """Seeds <count> events and prints the timings of every case."""
+    app = create_benchmark_app()
+    with app.app_context(), app.test_request_context():
+        seed_events(count)
+        page_ids = list(range(count // 2, count // 2 + PAGE_SIZE))
+        cases = [
+            ('all events', (all_entities,), (all_event_rows,)),
+            (f'page of {PAGE_SIZE}', (page_entities, page_ids),
+             (event_rows, page_ids)),
+        ]
+        for name, entities, rows in cases:
+            entity_ms = timed(fresh, *entities, repeat=3)
+            row_ms = timed(fresh, *rows, repeat=3)
+            entity_mb = peak_memory(*entities)
+            row_mb = peak_memory(*rows)
+            print(f'{count:<9}{name:<14}{entity_ms:>12.1f}{row_ms:>10.1f}'
+                  f'{entity_mb:>13.1f}{row_mb:>11.1f}')
+        db.session.remove()
+        db.drop_all()
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+    print(f"{'events':<9}{'case':<14}{'entity ms':>12}{'row ms':>10}"
+          f"{'entity MB':>13}{'row MB':>11}")
+    for count in counts:
+        run(count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Benchmark of event search over a synthetic dataset.
+
+Compares the first result page of the search (usctimeline/events/search.py
+search_page()), uncached and served from search_cache, against the previous
+pipeline of one query per criterion, Python set intersections and one
+Event.query.get() per result.
+
+How to execute this script:
+`python -m benchmarks.search [event_count]` (defaults to 100000 events)
+"""
+
+import sys
+from datetime import date
+from sqlalchemy import and_, event
+from benchmarks import create_benchmark_app, seed_events, timed
+from usctimeline import db, search_cache
+from usctimeline.models import Event, Tag
+from usctimeline.events.search import (SearchCriteria, cached_search_page,
+                                       keyset_search_page)
+
+PAGE_SIZE = 25
+
+CASES = {
+    'title': SearchCriteria('council', None, None, None, None, ()),
+    'decade': SearchCriteria(
+        None, None, date(1970, 1, 1), date(1979, 12, 31), None, ()
+    ),
+    'category + 2 tags': SearchCriteria(None, None, None, None, 1, (1, 2)),
+    'title + decade + tag': SearchCriteria(
+        'USC', None, date(1990, 1, 1), date(1999, 12, 31), None, (7,)
+    ),
+}
+
+
+def legacy_search(criteria):
+    """Previous search implementation, kept for comparison."""
+    event_ids = {e.id for e in Event.query.all()}
+    if criteria.title:
+        result = Event.query.filter(Event.title.like(f'%{criteria.title}%'))
+        event_ids &= {e.id for e in result}
+    if criteria.exact_date:
+        result = Event.query.filter(Event.date == criteria.exact_date)
+        event_ids &= {e.id for e in result}
+    if criteria.from_date and criteria.to_date:
+        result = Event.query.filter(and_(
+            criteria.from_date <= Event.date, Event.date <= criteria.to_date
+        ))
+        event_ids &= {e.id for e in result}
+    if criteria.category_id:
+        result = Event.query.filter_by(category_id=criteria.category_id)
+        event_ids &= {e.id for e in result}
+    for tag_id in criteria.tag_ids:
+        tag = Tag.query.get(tag_id)
+        event_ids &= {e.id for e in tag.events}
+    events = [Event.query.get(event_id) for event_id in event_ids]
+    for e in events:
+        e.category, e.tags
+    return events
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    app = create_benchmark_app()
+    with app.app_context():
+        print(f'Seeding {count} events...')
+        seed_events(count)
+        statements = [0]
+        event.listen(
+            db.engine, 'before_cursor_execute',
+            lambda *args: statements.__setitem__(0, statements[0] + 1)
+        )
+        print(f"{'case':<22}{'results':>9}{'legacy ms':>12}{'queries':>9}"
+              f"{'page ms':>10}{'queries':>9}{'cached ms':>12}{'queries':>9}")
+        for name, criteria in CASES.items():
+            statements[0] = 0
+            results = keyset_search_page(criteria, None, PAGE_SIZE).total
+            page_queries = statements[0]
+            search_cache.clear()
+            cached_search_page(criteria, None, PAGE_SIZE)
+            statements[0] = 0
+            cached_search_page(criteria, None, PAGE_SIZE)
+            cached_queries = statements[0]
+            statements[0] = 0
+            legacy_search(criteria)
+            legacy_queries = statements[0]
+            db.session.expunge_all()
+            legacy_ms = timed(legacy_search, criteria, repeat=1)
+            db.session.expunge_all()
+            page_ms = timed(keyset_search_page, criteria, None, PAGE_SIZE)
+            cached_ms = timed(cached_search_page, criteria, None, PAGE_SIZE)
+            db.session.expunge_all()
+            print(f'{name:<22}{results:>9}{legacy_ms:>12.1f}'
+                  f'{legacy_queries:>9}{page_ms:>10.1f}{page_queries:>9}'
+                  f'{cached_ms:>12.1f}{cached_queries:>9}')
+
+
+if __name__ == '__main__':
+    main()
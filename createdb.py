@@ -1,5 +1,6 @@
-from usctimeline import create_app, db
+from usctimeline import create_app
+from usctimeline.migrations import create_schema
 
 app = create_app()
 with app.app_context():
-    db.create_all()
+    create_schema()
@@ -0,0 +1,269 @@
+"""Script for exporting the public timeline as static HTML files.
+
+Prerenders the timeline and every event page into a directory which can be
+served directly by nginx, and copies the static files and event images they
+reference. A manifest of the data versions (see usctimeline/versions.py)
+used for each page is stored alongside the pages, so that later runs only
+rewrite the pages whose Event, Tag, Category or Image rows changed.
+
+How to execute this script:
+`python export.py path/to/output_dir`
+
+Add `--full` to rewrite every page regardless of the manifest.
+
+The exported pages are laid out as `index.html` and `event/<id>/index.html`.
+nginx should look them up with `try_files $uri $uri/index.html @flask;` and
+proxy every other route (search, login, ...) to the Flask application.
+Event images are copied to `images/event/`, where the pages link them (see
+the event_image route). They are named after their content (see
+usctimeline/images.py), so nginx may serve them with
+`add_header Cache-Control "public, max-age=31536000, immutable";`.
+"""
+
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from usctimeline import create_app, db
+from usctimeline.models import DataVersion, Event, Image, ImageVariant, event_images
+from usctimeline.versions import ALL, REFERENCE, event_key, get_versions
+
+MANIFEST_FILENAME = '.export-manifest.json'
+EVENT_IMAGES_DIRECTORY = os.path.join('images', 'event')
+
+# Exported pages link event images under the URL of the event_image route
+EXPORTED_IMAGES_DIRECTORY = 'images/event'
+
+
+def load_manifest(output_dir):
+    """Returns the manifest of the previous export, or an empty one."""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILENAME)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {'all': None, 'reference': None, 'events': {}, 'images': []}
+
+
+def write_file(path, content):
+    """Writes <content> to <path> atomically through a temporary file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as file:
+        file.write(content)
+    os.replace(tmp_path, path)
+
+
+def copy_if_changed(source, destination):
+    """Copies <source> to <destination> unless an identical copy exists.
+
+    Returns:
+        True if the file was copied.
+    """
+    try:
+        src_stat = os.stat(source)
+        dst_stat = os.stat(destination)
+        if (src_stat.st_size == dst_stat.st_size
+                and int(src_stat.st_mtime) == int(dst_stat.st_mtime)):
+            return False
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    shutil.copy2(source, destination)
+    return True
+
+
+def event_versions():
+    """Returns a dictionary mapping every event id to its data version."""
+    versions = {event_id: 0 for event_id, in db.session.query(Event.id)}
+    rows = db.session.query(DataVersion.key, DataVersion.version).filter(
+        DataVersion.key.like(event_key('%'))
+    )
+    prefix_length = len(event_key(''))
+    for key, version in rows:
+        event_id = int(key[prefix_length:])
+        if event_id in versions:
+            versions[event_id] = version
+    return versions
+
+
+def render_page(client, path, referrer=None):
+    """Renders a public page through the application.
+
+    Raises:
+        RuntimeError: The page did not render successfully.
+    """
+    headers = {'Referer': referrer} if referrer else {}
+    response = client.get(path, headers=headers)
+    if response.status_code != 200:
+        raise RuntimeError(f"Rendering '{path}' returned {response.status_code}.")
+    return response.data
+
+
+def export_static_files(app, output_dir):
+    """Copies static files, except event images, into <output_dir>/static."""
+    copied = 0
+    for root, dirs, files in os.walk(app.static_folder):
+        relative_root = os.path.relpath(root, app.static_folder)
+        if relative_root == EVENT_IMAGES_DIRECTORY:
+            # Including the subdirectories of content-addressed images
+            dirs[:] = []
+            continue
+        for filename in files:
+            copied += copy_if_changed(
+                os.path.join(root, filename),
+                os.path.join(output_dir, 'static', relative_root, filename)
+            )
+    return copied
+
+
+def export_images(app, output_dir, previous_images):
+    """Copies images referenced by events and removes unreferenced ones.
+
+    The resized variants of the images (see usctimeline/images.py) are
+    copied along with them.
+
+    Returns:
+        Tuple of (sorted list of exported filenames, number of files copied).
+    """
+    referenced = db.session.query(Image.id).join(
+        event_images, event_images.c.image_id == Image.id
+    )
+    originals = db.session.query(Image.filename).filter(Image.id.in_(referenced))
+    variants = db.session.query(ImageVariant.filename).filter(
+        ImageVariant.image_id.in_(referenced)
+    )
+    filenames = sorted(
+        filename for filename, in originals.union(variants)
+    )
+    source_dir = os.path.join(app.static_folder, EVENT_IMAGES_DIRECTORY)
+    destination_dir = os.path.join(output_dir, EXPORTED_IMAGES_DIRECTORY)
+    copied = 0
+    for filename in filenames:
+        source = os.path.join(source_dir, filename)
+        if os.path.isfile(source):
+            copied += copy_if_changed(
+                source, os.path.join(destination_dir, filename)
+            )
+    for filename in set(previous_images) - set(filenames):
+        path = os.path.join(destination_dir, filename)
+        if os.path.isfile(path):
+            os.remove(path)
+    return filenames, copied
+
+
+def export(app, output_dir, full=False):
+    """Exports the timeline and event pages into <output_dir>.
+
+    Args:
+        app: Flask app to render pages with.
+        output_dir: Directory receiving the exported site.
+        full: If True, every page is rewritten regardless of the manifest.
+
+    Returns:
+        Dictionary of counters describing the export.
+    """
+    manifest = {'all': None, 'reference': None, 'events': {}, 'images': []}
+    if not full:
+        manifest = load_manifest(output_dir)
+    # Exports made before images were served by the event_image route have
+    # pages linking /static/images/event/, so every page is rewritten
+    legacy_images = manifest.get('image_directory') != EXPORTED_IMAGES_DIRECTORY
+    if legacy_images:
+        manifest = {'all': None, 'reference': None, 'events': {}, 'images': []}
+    versions = get_versions(ALL, REFERENCE)
+    current_all = versions[ALL][0]
+    current_reference = versions[REFERENCE][0]
+    current_events = event_versions()
+    previous_events = {
+        int(event_id): version
+        for event_id, version in manifest['events'].items()
+    }
+    reference_changed = manifest['reference'] != current_reference
+
+    client = app.test_client()
+    start = time.perf_counter()
+    pages = 0
+    if manifest['all'] != current_all:
+        write_file(
+            os.path.join(output_dir, 'index.html'),
+            render_page(client, '/')
+        )
+        pages += 1
+    for event_id, version in current_events.items():
+        if not reference_changed and previous_events.get(event_id) == version:
+            continue
+        write_file(
+            os.path.join(output_dir, 'event', str(event_id), 'index.html'),
+            render_page(client, f'/event/{event_id}', referrer='/')
+        )
+        pages += 1
+    for event_id in set(previous_events) - set(current_events):
+        shutil.rmtree(
+            os.path.join(output_dir, 'event', str(event_id)),
+            ignore_errors=True
+        )
+    elapsed = time.perf_counter() - start
+
+    static_files = export_static_files(app, output_dir)
+    images, copied_images = export_images(app, output_dir, manifest['images'])
+    if legacy_images:
+        shutil.rmtree(
+            os.path.join(output_dir, 'static', EVENT_IMAGES_DIRECTORY),
+            ignore_errors=True
+        )
+    write_file(
+        os.path.join(output_dir, MANIFEST_FILENAME),
+        json.dumps({
+            'all': current_all,
+            'reference': current_reference,
+            'events': {str(k): v for k, v in current_events.items()},
+            'images': images,
+            'image_directory': EXPORTED_IMAGES_DIRECTORY,
+        }).encode('utf-8')
+    )
+    return {
+        'pages': pages,
+        'skipped': len(current_events) + 1 - pages,
+        'removed': len(set(previous_events) - set(current_events)),
+        'static_files': static_files,
+        'images': copied_images,
+        'seconds': elapsed,
+    }
+
+
+def main():
+    """Parses the command line arguments, then calls export().
+
+    Returns:
+        None
+    """
+    parser = argparse.ArgumentParser(
+        description='Export the public timeline as static HTML files.'
+    )
+    parser.add_argument('output_dir', help='Directory receiving the site.')
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help='Rewrite every page regardless of the previous export.'
+    )
+    args = parser.parse_args()
+    app = create_app()
+    app.config['TIMELINE_WINDOW_YEARS'] = 0
+    with app.app_context():
+        stats = export(app, args.output_dir, full=args.full)
+    rate = stats['pages'] / stats['seconds'] if stats['seconds'] else 0.0
+    print(
+        f"Exported {stats['pages']} page(s) in {stats['seconds']:.2f}s "
+        f"({rate:.1f} pages/sec), skipped {stats['skipped']} unchanged, "
+        f"removed {stats['removed']}."
+    )
+    print(
+        f"Copied {stats['static_files']} static file(s) and "
+        f"{stats['images']} event image(s)."
+    )
+
+
+if __name__ == '__main__':
+    main()
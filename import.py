@@ -10,13 +10,32 @@ How to execute this script:
 
 (Where filename.json is `USC_Timeline/data/filename.json` and stores the event
 data.)
+
+Add `--bulk` to import large files quickly: the file is read as a stream and
+events are inserted with Core executemany in chunks of `--chunk-size`
+records, each committed on its own, and invalid records are reported with
+their line numbers and skipped. Add `--atomic` to commit nothing if any
+record is invalid. In bulk mode the file may also hold newline-delimited
+JSON (one event per line), and an interrupted import can be resumed with
+`--resume-offset` or `--resume-record`, using the values printed after
+each chunk. Add `--workers N` to parse and validate records in N processes
+while the chunks are written.
+
+Add `--sync` instead to bring the events in line with an updated file:
+records are matched to existing events by their 'ID', or by title and date,
+unchanged records are skipped, changed ones update their event and new ones
+are inserted, so the same file can be imported any number of times. Add
+`--delete-missing` to also delete the previously imported events which are
+no longer in the file.
 """
 
 import sys
 import json
+import argparse
 from datetime import datetime
 from usctimeline import create_app, db
 from usctimeline.models import Event, Tag, Category
+from usctimeline.importer import DEFAULT_CHUNK_SIZE, bulk_import, stream_records, sync_import
 
 
 def create_categories():
@@ -64,32 +83,196 @@ def add_events(events):
     return True
 
 
+def positive_int(value):
+    """Parses a command line argument which must be an integer of at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1, not {number}')
+    return number
+
+
+def non_negative_int(value):
+    """Parses a command line argument which must be an integer of at least 0."""
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f'must be at least 0, not {number}')
+    return number
+
+
+def print_progress(result, skip):
+    """Prints the import rate and where to resume the import from."""
+    print(f'{result.imported} events imported '
+          f'({result.rows_per_second:.0f} rows/sec), resume with '
+          f'--resume-offset {result.resume_offset} or '
+          f'--resume-record {skip + result.records_read}')
+
+
+def import_bulk(file, chunk_size, atomic, offset, skip, workers):
+    """Imports the events of a JSON or NDJSON file with bulk_import().
+
+    Args:
+        file: Import file opened in binary mode.
+        chunk_size: Number of records written per transaction.
+        atomic: Whether to commit nothing if any record is invalid.
+        offset: Byte offset to resume from.
+        skip: Number of records to skip.
+        workers: Number of processes parsing records.
+
+    Returns:
+        True if every record was imported.
+    """
+    checkpoint = []
+
+    def progress(result):
+        checkpoint[:] = [result]
+        if not atomic:
+            print_progress(result, skip)
+
+    try:
+        result = bulk_import(
+            stream_records(file, offset, skip), chunk_size, atomic, progress,
+            workers
+        )
+    except (ValueError, KeyboardInterrupt) as e:
+        print(f'Error: {e}' if isinstance(e, ValueError) else 'Interrupted.')
+        if checkpoint and not atomic:
+            print_progress(checkpoint[0], skip)
+        return False
+    for error in result.errors:
+        print(f'Line {error.line}: {error.message}')
+    if result.errors and atomic:
+        print(f'{len(result.errors)} invalid records, no events imported.')
+    elif result.errors:
+        print(f'{len(result.errors)} invalid records skipped.')
+    print(f'{result.imported} events imported in {result.seconds:.1f}s '
+          f'({result.rows_per_second:.0f} rows/sec).')
+    return not result.errors
+
+
+def import_sync(file, chunk_size, delete_missing, workers):
+    """Synchronizes the events with a JSON or NDJSON file (see sync_import).
+
+    Args:
+        file: Import file opened in binary mode.
+        chunk_size: Number of records processed per transaction.
+        delete_missing: Whether to delete imported events missing from the
+            file.
+        workers: Number of processes parsing records.
+
+    Returns:
+        True if every record was valid.
+    """
+    try:
+        result = sync_import(
+            stream_records(file), chunk_size, delete_missing, workers=workers
+        )
+    except ValueError as e:
+        print(f'Error: {e}')
+        return False
+    for error in result.errors:
+        print(f'Line {error.line}: {error.message}')
+    if result.errors and delete_missing:
+        print('Missing events were not deleted because of invalid records.')
+    print(f'{result.imported} inserted, {result.updated} updated, '
+          f'{result.unchanged} unchanged, {result.deleted} deleted, '
+          f'{len(result.errors)} invalid in {result.seconds:.1f}s.')
+    return not result.errors
+
+
 def main():
     """Opens file passed in as arg and converts data to dictionary of events.
 
     Returns:
         None
     """
+    parser = argparse.ArgumentParser(description='Import events from a JSON file.')
+    parser.add_argument('filename', help='JSON file holding event data.')
+    parser.add_argument(
+        '--bulk',
+        action='store_true',
+        help='Insert events in chunks with Core executemany.'
+    )
+    parser.add_argument(
+        '--chunk-size',
+        type=positive_int,
+        default=DEFAULT_CHUNK_SIZE,
+        help=f'Records committed per transaction with --bulk or --sync '
+             f'(default {DEFAULT_CHUNK_SIZE}).'
+    )
+    parser.add_argument(
+        '--atomic',
+        action='store_true',
+        help='With --bulk, import nothing if any record is invalid.'
+    )
+    parser.add_argument(
+        '--workers',
+        type=non_negative_int,
+        default=0,
+        help='With --bulk or --sync, number of processes parsing and '
+             'validating records while chunks are written (default 0: '
+             'parse in the writing process).'
+    )
+    parser.add_argument(
+        '--sync',
+        action='store_true',
+        help='Insert new events, update changed ones and skip unchanged ones.'
+    )
+    parser.add_argument(
+        '--delete-missing',
+        action='store_true',
+        help='With --sync, delete imported events missing from the file.'
+    )
+    resume = parser.add_mutually_exclusive_group()
+    resume.add_argument(
+        '--resume-offset',
+        type=non_negative_int,
+        default=0,
+        help='With --bulk, start reading at this byte offset.'
+    )
+    resume.add_argument(
+        '--resume-record',
+        type=non_negative_int,
+        default=0,
+        help='With --bulk, skip this number of records.'
+    )
+    args = parser.parse_args()
+    if not args.bulk and (args.atomic or args.resume_offset or args.resume_record):
+        parser.error('--atomic and --resume-* require --bulk')
+    if args.workers and not (args.bulk or args.sync):
+        parser.error('--workers requires --bulk or --sync')
+    if args.delete_missing and not args.sync:
+        parser.error('--delete-missing requires --sync')
+    if args.sync and args.bulk:
+        parser.error('--sync and --bulk are exclusive')
     try:
-        with open(sys.argv[1]) as file:
+        if args.sync:
+            with open(args.filename, 'rb') as file:
+                if Category.query.count() != 3:
+                    create_categories()
+                synced = import_sync(
+                    file, args.chunk_size, args.delete_missing, args.workers
+                )
+            if not synced:
+                sys.exit(1)
+            return
+        if args.bulk:
+            with open(args.filename, 'rb') as file:
+                if Category.query.count() != 3:
+                    create_categories()
+                imported = import_bulk(
+                    file, args.chunk_size, args.atomic,
+                    args.resume_offset, args.resume_record, args.workers
+                )
+            if not imported:
+                sys.exit(1)
+            return
+        with open(args.filename) as file:
             events = json.load(file)
         if Category.query.count() != 3:
             create_categories()
         isUploaded = add_events(events)
         if isUploaded:
             print('Events uploaded successfully.')
-    except IndexError as e:
-        print(
-            f'''
-    IndexError: {e}
-
-    This script requires a JSON file holding event data. 
-    (JSON file needs to be stored inside `USC_Timeline/data`)
-        `python import.py filename.json`
-
-    (The above command will upload events stored in `USC_Timeline/data/filename.json`)
-'''
-        )
     except FileNotFoundError as e:
         print("Error: File not found.")
 
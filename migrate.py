@@ -0,0 +1,48 @@
+"""Script for upgrading the database schema.
+
+Applies the pending schema migrations (see usctimeline/migrations.py) to the
+configured database. Databases created before migrations existed are adopted
+as they are and brought up to date. Migrations only take short locks, so
+they can be applied while the application is running.
+
+How to execute this script:
+`python migrate.py`
+
+Add `--status` to list the migrations without applying them.
+"""
+
+import argparse
+from usctimeline import create_app
+from usctimeline.migrations import MIGRATIONS, pending_migrations, upgrade
+
+
+def main():
+    """Parses the command line arguments, then applies pending migrations.
+
+    Returns:
+        None
+    """
+    parser = argparse.ArgumentParser(description='Upgrade the database schema.')
+    parser.add_argument(
+        '--status',
+        action='store_true',
+        help='List applied and pending migrations without applying them.'
+    )
+    args = parser.parse_args()
+    app = create_app()
+    with app.app_context():
+        if args.status:
+            pending = {migration.version for migration in pending_migrations()}
+            for migration in MIGRATIONS:
+                state = 'pending' if migration.version in pending else 'applied'
+                print(f'{migration.version:4d} {migration.name:40s} {state}')
+            return
+        applied = upgrade()
+    for migration in applied:
+        print(f'Applied migration {migration.version}: {migration.name}')
+    if not applied:
+        print('Database schema is up to date.')
+
+
+if __name__ == '__main__':
+    main()
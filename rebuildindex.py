@@ -0,0 +1,45 @@
+"""Script for rebuilding the full-text search index of events.
+
+Creates the full-text index over event titles and descriptions if the
+database does not have one yet (e.g. databases created before full-text
+search was added), then reindexes every event. On Postgres (12 or later)
+both are done concurrently, without blocking writes.
+
+How to execute this script:
+`python rebuildindex.py`
+"""
+
+from usctimeline import create_app, db
+from usctimeline.events.fulltext import rebuild_fulltext_index
+
+
+def main():
+    """Rebuilds the full-text index.
+
+    On Postgres the index is rebuilt concurrently in autocommit mode, so
+    writes are not blocked; elsewhere within a single transaction.
+
+    Returns:
+        None
+    """
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.connect() as connection:
+            supported = rebuild_fulltext_index(
+                connection.execution_options(isolation_level='AUTOCOMMIT')
+            )
+    else:
+        with db.engine.begin() as connection:
+            supported = rebuild_fulltext_index(connection)
+    if supported:
+        print('Full-text index rebuilt successfully.')
+    else:
+        print(
+            f"Error: Full-text search is not supported on "
+            f"'{db.engine.dialect.name}' databases."
+        )
+
+
+if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        main()
@@ -1,6 +1,7 @@
 from usctimeline import create_app, db
+from usctimeline.migrations import create_schema
 
 app = create_app()
 with app.app_context():
     db.drop_all()
-    db.create_all()
+    create_schema()
@@ -0,0 +1,117 @@
+"""Tests of the database engine profiles (see usctimeline/engine.py).
+
+Run them from the `USC_Timeline` directory, which holds `etc/config.json`:
+`python -m pytest tests`.
+"""
+
+import pytest
+from flask import session
+from sqlalchemy.pool import QueuePool, StaticPool
+from usctimeline import create_app, db, engine_profile
+from usctimeline.engine import REPLICA_BIND, engine_options, is_memory_database
+from usctimeline.models import Category
+from benchmarks import create_benchmark_app
+
+
+def create_memory_app(uri='sqlite://'):
+    """Creates an app bound to an in-memory database with the 'auto' profile."""
+    app = create_app()
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['DATABASE_PROFILE'] = 'auto'
+    engine_profile.init_app(app)
+    return app
+
+
+def test_is_memory_database():
+    assert is_memory_database('sqlite://')
+    assert is_memory_database('sqlite:///:memory:')
+    assert is_memory_database('sqlite:///file:timeline?mode=memory&uri=true')
+    assert not is_memory_database('sqlite:////tmp/timeline.db')
+    assert not is_memory_database('postgresql://localhost/timeline')
+
+
+def test_sqlite_profile_pools_file_databases():
+    options = engine_options(
+        'sqlite', {'SQLALCHEMY_DATABASE_URI': 'sqlite:////tmp/timeline.db'}
+    )
+    assert options['poolclass'] is QueuePool
+
+
+def test_memory_database_is_shared_by_every_connection():
+    app = create_memory_app()
+    with app.app_context():
+        assert engine_profile.pragmas == []
+        db.create_all()
+        first = db.engine.connect()
+        second = db.engine.connect()
+        try:
+            assert isinstance(db.engine.pool, StaticPool)
+            count = 'SELECT count(*) FROM sqlite_master'
+            assert first.execute(count).scalar() > 0
+            assert second.execute(count).scalar() == first.execute(count).scalar()
+        finally:
+            first.close()
+            second.close()
+
+
+@pytest.fixture
+def replica_app(tmp_path):
+    """App whose primary and replica are two SQLite files told apart by data.
+
+    The primary holds the category 'Primary' and the replica 'Replica', so a
+    query shows which database answered it.
+    """
+    app = create_benchmark_app(str(tmp_path / 'primary.db'))
+    app.config['SQLALCHEMY_REPLICA_URI'] = f'sqlite:///{tmp_path / "replica.db"}'
+    engine_profile.init_app(app)
+    with app.app_context():
+        db.session.add(Category(id=1, name='Primary'))
+        db.session.commit()
+        replica = db.get_engine(app, bind=REPLICA_BIND)
+        Category.__table__.create(replica)
+        replica.execute(Category.__table__.insert(), {'id': 1, 'name': 'Replica'})
+    return app
+
+
+def answered_by(app, path='/', method='GET', logged_in=False):
+    """Returns the name of the category read within a request to <path>."""
+    with app.test_request_context(path, method=method):
+        if logged_in:
+            session['_user_id'] = '1'
+        try:
+            return Category.query.get(1).name
+        finally:
+            db.session.remove()
+
+
+def test_anonymous_get_reads_from_replica(replica_app):
+    assert answered_by(replica_app) == 'Replica'
+    assert answered_by(replica_app, method='HEAD') == 'Replica'
+
+
+def test_writes_and_logged_in_users_read_from_primary(replica_app):
+    assert answered_by(replica_app, method='POST') == 'Primary'
+    assert answered_by(replica_app, logged_in=True) == 'Primary'
+    with replica_app.app_context():
+        assert Category.query.get(1).name == 'Primary'
+        db.session.remove()
+
+
+def test_reads_after_a_write_stay_on_primary(replica_app):
+    with replica_app.test_request_context('/'):
+        assert Category.query.get(1).name == 'Replica'
+        db.session.add(Category(id=2, name='New'))
+        db.session.flush()
+        # The replica has not seen the write, the primary has
+        assert Category.query.get(2).name == 'New'
+        assert db.session.query(Category.name).filter_by(id=1).scalar() == 'Primary'
+        db.session.rollback()
+        db.session.remove()
+
+
+def test_without_replica_every_read_uses_primary(tmp_path):
+    app = create_benchmark_app(str(tmp_path / 'primary.db'))
+    with app.app_context():
+        db.session.add(Category(id=1, name='Primary'))
+        db.session.commit()
+    assert answered_by(app) == 'Primary'
@@ -0,0 +1,167 @@
+"""Tests of event image variants and delivery (see usctimeline/images.py).
+
+Run them from the `USC_Timeline` directory, which holds `etc/config.json`:
+`python -m pytest tests`.
+"""
+
+import io
+import os
+import mimetypes
+import pytest
+from PIL import Image as PILImage
+from usctimeline import db, images
+from usctimeline.images import (IMMUTABLE_CACHE_CONTROL, content_filename,
+                                file_digest, image_path, process_image)
+from usctimeline.models import Image
+from benchmarks import create_benchmark_app
+
+
+def picture_bytes(size, image_format='JPEG', orientation=None):
+    """Returns the content of a plain image file of <size>."""
+    picture = PILImage.new('RGB', size, (20, 100, 10))
+    options = {}
+    if orientation is not None:
+        exif = PILImage.Exif()
+        exif[0x0112] = orientation
+        options['exif'] = exif.tobytes()
+    file = io.BytesIO()
+    picture.save(file, format=image_format, **options)
+    return file.getvalue()
+
+
+def store_image(filename, content):
+    """Writes an event image file and adds its Image row to the session."""
+    path = image_path(filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(content)
+    image = Image(filename=filename)
+    db.session.add(image)
+    return image
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """App context of a temporary database storing images in <tmp_path>."""
+    monkeypatch.setattr(images, 'IMAGE_DIRECTORY', str(tmp_path / 'images'))
+    app = create_benchmark_app()
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+
+def test_large_image_gets_every_width_in_both_formats(app):
+    image = store_image('large.jpg', picture_bytes((2000, 1000)))
+    process_image(image)
+    db.session.commit()
+    assert (image.width, image.height) == (2000, 1000)
+    variants = {(v.name, v.format): v for v in image.variants}
+    assert sorted(variants) == [
+        ('large', 'jpeg'), ('large', 'webp'), ('medium', 'jpeg'),
+        ('medium', 'webp'), ('thumb', 'jpeg'), ('thumb', 'webp'),
+    ]
+    for (name, variant_format), variant in variants.items():
+        with PILImage.open(image_path(variant.filename)) as picture:
+            assert picture.format == variant_format.upper()
+            assert picture.size == (variant.width, variant.height)
+    assert (variants['thumb', 'webp'].width, variants['thumb', 'webp'].height) \
+        == (320, 160)
+
+
+def test_small_image_is_not_enlarged(app):
+    image = store_image('small.png', picture_bytes((300, 200), 'PNG'))
+    process_image(image)
+    assert sorted((v.name, v.format, v.width) for v in image.variants) == [
+        ('thumb', 'png', 300), ('thumb', 'webp', 300),
+    ]
+
+
+def test_exif_orientation_is_applied(app):
+    image = store_image('rotated.jpg', picture_bytes((400, 200), orientation=6))
+    process_image(image)
+    assert (image.width, image.height) == (200, 400)
+    assert {(v.width, v.height) for v in image.variants} == {(200, 400)}
+
+
+def test_svg_images_get_no_variants(app):
+    image = store_image('drawing.svg', b'<svg xmlns="http://www.w3.org/2000/svg"/>')
+    process_image(image)
+    assert (image.width, image.height) == (None, None)
+    assert image.variants == []
+
+
+def test_processing_again_replaces_the_variants(app):
+    image = store_image('again.jpg', picture_bytes((1000, 500)))
+    process_image(image)
+    db.session.commit()
+    filenames = sorted(v.filename for v in image.variants)
+    process_image(image)
+    db.session.commit()
+    assert sorted(v.filename for v in image.variants) == filenames
+    assert all(os.path.isfile(image_path(filename)) for filename in filenames)
+
+
+@pytest.fixture
+def stored(app):
+    """Content and filename of a processed, content-addressed JPEG."""
+    content = picture_bytes((1000, 500))
+    filename = content_filename(file_digest(io.BytesIO(content)), '.jpg')
+    process_image(store_image(filename, content))
+    db.session.commit()
+    return content, filename
+
+
+def test_image_is_sent_with_validators(app, stored):
+    content, filename = stored
+    response = app.test_client().get(f'/images/event/{filename}')
+    assert response.status_code == 200
+    assert response.data == content
+    assert response.headers['Content-Type'] == 'image/jpeg'
+    assert response.headers['ETag'] == f'"{file_digest(io.BytesIO(content))}"'
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['Cache-Control'] == IMMUTABLE_CACHE_CONTROL
+
+
+def test_webp_variants_have_their_content_type(app, stored, monkeypatch):
+    # As on systems without mime.types, which alone maps .webp
+    monkeypatch.setattr(mimetypes, 'guess_type', mimetypes.MimeTypes().guess_type)
+    variant = next(
+        v.filename for v in Image.query.one().variants if v.format == 'webp'
+    )
+    response = app.test_client().get(f'/images/event/{variant}')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'image/webp'
+
+
+def test_range_head_and_conditional_requests(app, stored):
+    content, filename = stored
+    client = app.test_client()
+    url = f'/images/event/{filename}'
+    response = client.get(url, headers={'Range': 'bytes=0-99'})
+    assert response.status_code == 206
+    assert response.data == content[:100]
+    assert response.headers['Content-Range'] == f'bytes 0-99/{len(content)}'
+    response = client.head(url)
+    assert response.status_code == 200
+    assert response.headers['Content-Length'] == str(len(content))
+    assert response.data == b''
+    etag = client.get(url).headers['ETag']
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_proxy_sends_the_file(app, stored):
+    _, filename = stored
+    app.config['IMAGE_SENDFILE'] = 'x-accel-redirect'
+    response = app.test_client().get(f'/images/event/{filename}')
+    assert response.headers['X-Accel-Redirect'] == f'/protected/images/event/{filename}'
+    assert response.headers['Content-Type'] == 'image/jpeg'
+    assert response.data == b''
+
+
+def test_only_stored_images_are_sent(app, stored):
+    client = app.test_client()
+    directory = image_path('')
+    with open(os.path.join(directory, 'tmpupload'), 'wb') as file:
+        file.write(b'partial')
+    for filename in ('tmpupload', '../../etc/config.json', 'missing.jpg'):
+        assert client.get(f'/images/event/{filename}').status_code == 404
@@ -0,0 +1,51 @@
+"""Tests of the bulk and sync imports (see usctimeline/importer.py).
+
+Run them from the `USC_Timeline` directory, which holds `etc/config.json`:
+`python -m pytest tests`.
+"""
+
+import io
+import json
+import pytest
+from usctimeline import db
+from usctimeline.importer import bulk_import, stream_records, sync_import
+from usctimeline.models import Category, Event
+from benchmarks import create_benchmark_app
+
+
+@pytest.fixture
+def app():
+    """App context of a temporary database with the 'USC' category."""
+    app = create_benchmark_app()
+    with app.app_context():
+        db.session.add(Category(id=1, name='USC'))
+        db.session.commit()
+        yield app
+        db.session.remove()
+
+
+def records(count):
+    """Returns the records of an NDJSON file holding <count> events."""
+    lines = [
+        json.dumps({'ID': f'event-{number}', 'Title': f'Event {number}',
+                    'Date': '1965-03-01', 'Description': 'Imported',
+                    'Category': 'USC'})
+        for number in range(count)
+    ]
+    return stream_records(io.BytesIO('\n'.join(lines).encode('utf-8')))
+
+
+@pytest.mark.parametrize('chunk_size, workers', [(0, 0), (-1, 0), (10, -1)])
+def test_invalid_chunking_is_rejected(app, chunk_size, workers):
+    for import_function in (bulk_import, sync_import):
+        with pytest.raises(ValueError):
+            import_function(records(3), chunk_size, workers=workers)
+    assert Event.query.count() == 0
+
+
+def test_chunks_of_one_record(app):
+    result = bulk_import(records(3), 1)
+    assert (result.imported, result.errors) == (3, [])
+    assert Event.query.count() == 3
+    result = sync_import(records(4), 1)
+    assert (result.imported, result.unchanged) == (1, 3)
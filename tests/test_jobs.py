@@ -0,0 +1,104 @@
+"""Tests of the background job queue (see usctimeline/jobs.py).
+
+Run them from the `USC_Timeline` directory, which holds `etc/config.json`:
+`python -m pytest tests`.
+"""
+
+import io
+import os
+import threading
+from datetime import timedelta
+import pytest
+from PIL import Image as PILImage
+from usctimeline import db, images, jobs
+from usctimeline.images import image_path
+from usctimeline.jobs import (DONE, FAILED, PENDING, PROCESS_IMAGE, RUNNING,
+                              claim_job, enqueue, run_worker, utcnow)
+from usctimeline.models import Image, Job
+from benchmarks import create_benchmark_app
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """App context of a temporary database storing images in <tmp_path>."""
+    monkeypatch.setattr(images, 'IMAGE_DIRECTORY', str(tmp_path / 'images'))
+    app = create_benchmark_app()
+    app.config['JOB_MAX_ATTEMPTS'] = 2
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+
+def queue_image(filename='queued.jpg'):
+    """Stores a 1000x500 JPEG and commits its Image with a PROCESS_IMAGE job."""
+    path = image_path(filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    file = io.BytesIO()
+    PILImage.new('RGB', (1000, 500)).save(file, format='JPEG')
+    with open(path, 'wb') as image_file:
+        image_file.write(file.getvalue())
+    image = Image(filename=filename)
+    job = enqueue(PROCESS_IMAGE, image)
+    db.session.commit()
+    return image.id, job.id
+
+
+def work():
+    """Runs the queued jobs until the queue is empty."""
+    return run_worker(threading.Event(), once=True)
+
+
+def test_worker_processes_queued_images(app):
+    image_id, job_id = queue_image()
+    assert work() == 1
+    job = Job.query.get(job_id)
+    assert (job.status, job.attempts, job.error) == (DONE, 1, None)
+    image = Image.query.get(image_id)
+    assert (image.width, image.height) == (1000, 500)
+    assert len(image.variants) == 6
+    assert work() == 0
+
+
+def test_failed_job_is_retried_then_marked_failed(app, monkeypatch):
+    def fail(job):
+        raise OSError('cannot identify image file')
+
+    monkeypatch.setitem(jobs.JOB_HANDLERS, PROCESS_IMAGE, fail)
+    image_id, job_id = queue_image()
+    # The failed attempt is queued again and retried in the same run
+    assert work() == 2
+    job = Job.query.get(job_id)
+    assert (job.status, job.attempts) == (FAILED, 2)
+    assert job.error == 'cannot identify image file'
+    assert job.finished is not None
+    assert Image.query.get(image_id).variants == []
+
+
+def test_running_job_is_claimed_again_after_timeout(app):
+    _, job_id = queue_image()
+    job = Job.query.get(job_id)
+    job.status = RUNNING
+    job.started = utcnow()
+    db.session.commit()
+    assert claim_job() is None
+    job = Job.query.get(job_id)
+    job.started = utcnow() - timedelta(seconds=app.config['JOB_TIMEOUT'] + 1)
+    db.session.commit()
+    assert claim_job().id == job_id
+
+
+def test_job_of_deleted_image_completes(app):
+    image_id, job_id = queue_image()
+    Job.query.get(job_id).image_id = None
+    db.session.delete(Image.query.get(image_id))
+    db.session.commit()
+    assert work() == 1
+    assert Job.query.get(job_id).status == DONE
+
+
+def test_jobs_are_pending_until_committed(app):
+    image = Image(filename='uncommitted.jpg')
+    enqueue(PROCESS_IMAGE, image)
+    assert db.session.query(Job.status).scalar() == PENDING
+    db.session.rollback()
+    assert work() == 0
@@ -0,0 +1,186 @@
+"""Tests of the schema migrations (see usctimeline/migrations.py).
+
+Run them from the `USC_Timeline` directory, which holds `etc/config.json`:
+`python -m pytest tests`.
+"""
+
+import os
+import pytest
+from sqlalchemy import inspect, text
+from sqlalchemy.dialects import postgresql
+from usctimeline import db
+from usctimeline.events.fulltext import rebuild_fulltext_index
+from usctimeline.images import IMAGE_DIRECTORY, is_content_filename
+from usctimeline.migrations import (MIGRATIONS, add_fulltext_index,
+                                    pending_migrations, upgrade)
+from usctimeline.models import Image
+from benchmarks import create_benchmark_app
+
+# Schema of databases created by createdb.py before migrations existed
+ORIGINAL_SCHEMA = [
+    """CREATE TABLE user (
+        id INTEGER NOT NULL PRIMARY KEY,
+        username VARCHAR(20) NOT NULL UNIQUE,
+        email VARCHAR(120) NOT NULL UNIQUE,
+        password VARCHAR(60) NOT NULL
+    )""",
+    """CREATE TABLE category (
+        id INTEGER NOT NULL PRIMARY KEY, name VARCHAR(120) NOT NULL UNIQUE
+    )""",
+    """CREATE TABLE tag (
+        id INTEGER NOT NULL PRIMARY KEY, name VARCHAR(120) NOT NULL UNIQUE
+    )""",
+    """CREATE TABLE image (
+        id INTEGER NOT NULL PRIMARY KEY, filename VARCHAR(120) NOT NULL UNIQUE
+    )""",
+    """CREATE TABLE event (
+        id INTEGER NOT NULL PRIMARY KEY,
+        title VARCHAR(120) NOT NULL,
+        date DATE NOT NULL,
+        description TEXT NOT NULL,
+        external_url TEXT,
+        category_id INTEGER NOT NULL REFERENCES category (id)
+    )""",
+    """CREATE TABLE event_tags (
+        event_id INTEGER REFERENCES event (id), tag_id INTEGER REFERENCES tag (id)
+    )""",
+    """CREATE TABLE event_images (
+        event_id INTEGER REFERENCES event (id),
+        image_id INTEGER REFERENCES image (id)
+    )""",
+]
+
+ORIGINAL_ROWS = [
+    "INSERT INTO category (id, name) VALUES (1, 'USC')",
+    "INSERT INTO tag (id, name) VALUES (1, 'Council'), (2, 'Radio')",
+    "INSERT INTO event (id, title, date, description, category_id) VALUES "
+    "(1, 'Council election', '1965-03-01', 'First vote', 1), "
+    "(2, 'Radio launch', '1970-09-15', 'On air', 1)",
+    # Duplicate and half-empty rows, which the original tables allowed
+    "INSERT INTO event_tags (event_id, tag_id) VALUES "
+    "(1, 1), (1, 1), (1, 2), (2, 2), (2, NULL)",
+    "INSERT INTO image (id, filename) VALUES (1, 'first.jpg'), (2, 'copy.jpg')",
+    "INSERT INTO event_images (event_id, image_id) VALUES (1, 1), (2, 2)",
+]
+
+
+@pytest.fixture
+def app(tmp_path):
+    """App bound to a database with the original schema and a few rows.
+
+    Its images live in <tmp_path>: 'first.jpg' and 'copy.jpg' have the same
+    content.
+    """
+    app = create_benchmark_app(str(tmp_path / 'original.db'), reset=False)
+    app.root_path = str(tmp_path)
+    directory = os.path.join(app.root_path, IMAGE_DIRECTORY)
+    os.makedirs(directory)
+    for filename in ('first.jpg', 'copy.jpg'):
+        with open(os.path.join(directory, filename), 'wb') as file:
+            file.write(b'same image content')
+    with app.app_context():
+        with db.engine.begin() as connection:
+            for statement in ORIGINAL_SCHEMA + ORIGINAL_ROWS:
+                connection.execute(text(statement))
+        yield app
+        db.session.remove()
+
+
+class PostgresConnection:
+    """Stands in for a Postgres connection, recording the statements run.
+
+    Queries return <scalar> as their only value.
+    """
+
+    def __init__(self, scalar=None):
+        self.dialect = postgresql.dialect()
+        self.scalar_value = scalar
+        self.statements = []
+
+    def execute(self, statement, **params):
+        self.statements.append(str(statement))
+        return self
+
+    def scalar(self):
+        return self.scalar_value
+
+
+def schema(engine):
+    """Returns {table: ({column}, [primary key columns], {index name})}."""
+    inspector = inspect(engine)
+    return {
+        table: (
+            {column['name'] for column in inspector.get_columns(table)},
+            sorted(inspector.get_pk_constraint(table)['constrained_columns']),
+            {index['name'] for index in inspector.get_indexes(table)},
+        )
+        for table in db.metadata.tables
+    }
+
+
+def test_upgrade_brings_original_database_up_to_date(app, tmp_path):
+    applied = upgrade()
+    assert [m.version for m in applied] == [m.version for m in MIGRATIONS]
+    assert pending_migrations() == []
+    assert upgrade() == []
+
+    # Same tables, columns, keys and indexes as a database created today
+    fresh = create_benchmark_app(str(tmp_path / 'fresh.db'))
+    with fresh.app_context():
+        expected = schema(db.engine)
+    with app.app_context():
+        assert schema(db.engine) == expected
+
+
+def test_upgrade_keeps_the_data(app):
+    upgrade()
+    tags = db.engine.execute(text(
+        'SELECT event_id, tag_id FROM event_tags ORDER BY event_id, tag_id'
+    )).fetchall()
+    assert [tuple(row) for row in tags] == [(1, 1), (1, 2), (2, 2)]
+    titles = db.engine.execute(text('SELECT title FROM event ORDER BY id'))
+    assert [title for title, in titles] == ['Council election', 'Radio launch']
+    # Events written before the full-text index was created are indexed
+    matches = db.engine.execute(text(
+        "SELECT rowid FROM event_fts WHERE event_fts MATCH 'radio'"
+    ))
+    assert [event_id for event_id, in matches] == [2]
+
+
+def test_upgrade_merges_images_with_the_same_content(app):
+    upgrade()
+    images = Image.query.all()
+    assert len(images) == 1
+    image = images[0]
+    assert is_content_filename(image.filename)
+    assert sorted(event.id for event in image.events) == [1, 2]
+    directory = os.path.join(app.root_path, IMAGE_DIRECTORY)
+    assert os.path.isfile(os.path.join(directory, image.filename))
+    assert not os.path.exists(os.path.join(directory, 'first.jpg'))
+    assert not os.path.exists(os.path.join(directory, 'copy.jpg'))
+
+
+def test_postgres_fulltext_index_is_built_concurrently():
+    migration = next(m for m in MIGRATIONS if m.upgrade is add_fulltext_index)
+    # Runs in autocommit mode, as CONCURRENTLY requires
+    assert not migration.transactional
+    connection = PostgresConnection()
+    add_fulltext_index(connection)
+    assert connection.statements[-1] == (
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS event_fulltext_idx ON event "
+        "USING gin (to_tsvector('english', title || ' ' || description))"
+    )
+    # An invalid index left by an interrupted build is built again
+    connection = PostgresConnection(scalar=False)
+    add_fulltext_index(connection)
+    assert connection.statements[1] == 'DROP INDEX CONCURRENTLY event_fulltext_idx'
+
+
+def test_postgres_fulltext_index_is_rebuilt_concurrently():
+    connection = PostgresConnection()
+    assert rebuild_fulltext_index(connection)
+    assert connection.statements == [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS event_fulltext_idx ON event "
+        "USING GIN (to_tsvector('english', title || ' ' || description))",
+        'REINDEX INDEX CONCURRENTLY event_fulltext_idx',
+    ]
@@ -0,0 +1,42 @@
+"""Tests of the monitoring routes exposing cache and index counters.
+
+Run them from the `USC_Timeline` directory, which holds `etc/config.json`:
+`python -m pytest tests`.
+"""
+
+import pytest
+from usctimeline import db
+from usctimeline.models import User
+from benchmarks import create_benchmark_app
+
+STATS_URLS = [
+    '/timeline/cache/stats',
+    '/event/search/cache/stats',
+    '/event/search/index/stats',
+    '/event/suggest/index/stats',
+]
+
+
+@pytest.fixture
+def app():
+    """App of a temporary database with an admin."""
+    app = create_benchmark_app()
+    with app.app_context():
+        db.session.add(User(id=1, username='admin', email='admin@example.com',
+                            password='not a hash'))
+        db.session.commit()
+    return app
+
+
+@pytest.mark.parametrize('url', STATS_URLS)
+def test_stats_require_login(app, url):
+    client = app.test_client()
+    response = client.get(url)
+    assert response.status_code == 302
+    assert '/login' in response.headers['Location']
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+        session['_fresh'] = True
+    response = client.get(url)
+    assert response.status_code == 200
+    assert isinstance(response.get_json(), dict)
@@ -0,0 +1,62 @@
+"""Tests of the reference data cache (see usctimeline/reference.py).
+
+Run them from the `USC_Timeline` directory, which holds `etc/config.json`:
+`python -m pytest tests`.
+"""
+
+import pytest
+from usctimeline import db
+from usctimeline.models import Tag
+from usctimeline.reference import reference_cache
+from usctimeline.versions import ALL, bump_versions
+from benchmarks import create_benchmark_app, seed_events
+
+
+@pytest.fixture
+def app():
+    """App bound to a temporary database holding 100 events and 5 tags."""
+    app = create_benchmark_app()
+    with app.app_context():
+        seed_events(100, tag_count=5)
+        db.session.commit()
+    reference_cache.invalidate()
+    return app
+
+
+def reference(app):
+    """Returns the snapshot seen by a new request."""
+    with app.app_context():
+        return reference_cache.get()
+
+
+def test_snapshot_counts_events(app):
+    data = reference(app)
+    assert [c.name for c in data.categories] == ['USC', 'Statistics', 'Culture']
+    assert sum(c.event_count for c in data.categories) == 100
+    assert data.tag_named('Tag 3') is data.tag(3)
+    assert data.category(4) is None
+
+
+def test_snapshot_is_reused_until_data_changes(app):
+    data = reference(app)
+    assert reference(app) is data
+    with app.app_context():
+        db.session.add(Tag(name='New tag'))
+        db.session.flush()
+        db.session.rollback()
+    assert reference(app) is data
+    with app.app_context():
+        db.session.add(Tag(name='New tag'))
+        db.session.commit()
+    assert reference(app).tag_named('New tag') is not None
+
+
+def test_writes_of_other_processes_are_detected(app):
+    data = reference(app)
+    # As import.py does: Core statements, then a bump of the 'all' counter
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.execute(Tag.__table__.insert(), {'name': 'Imported'})
+            bump_versions(connection, [ALL])
+    assert reference(app) is not data
+    assert reference(app).tag_named('Imported') is not None
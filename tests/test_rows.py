@@ -0,0 +1,51 @@
+"""Tests of the projected event rows (see usctimeline/events/rows.py).
+
+Run them from the `USC_Timeline` directory, which holds `etc/config.json`:
+`python -m pytest tests`.
+"""
+
+import pytest
+from sqlalchemy.orm import selectinload
+from usctimeline import db
+from usctimeline.events import rows
+from usctimeline.events.rows import SUMMARY_LENGTH, all_event_rows, event_rows
+from usctimeline.models import Event
+from usctimeline.reference import reference_cache
+from benchmarks import create_benchmark_app, seed_events
+
+
+@pytest.fixture
+def app():
+    """App context of a temporary database holding 300 events."""
+    app = create_benchmark_app()
+    with app.app_context():
+        seed_events(300, tag_count=20)
+        reference_cache.invalidate()
+        yield app
+        db.session.remove()
+
+
+def entity_values(event):
+    """Returns the EventRow fields of an Event entity, without the summary."""
+    return (event.id, event.title, event.date, event.category_id,
+            tuple(tag.name for tag in sorted(event.tags, key=lambda t: t.id)))
+
+
+def test_all_event_rows_match_entities(app):
+    events = Event.query.options(selectinload(Event.tags)).order_by(Event.id)
+    expected = [entity_values(event) for event in events]
+    found = all_event_rows()
+    assert [row[:4] + row[5:] for row in found] == expected
+    assert all(row.summary is None for row in found)
+
+
+def test_event_rows_keep_the_order_of_ids(app, monkeypatch):
+    # Chunks of 7 ids, so that the rows are read by several queries
+    monkeypatch.setattr(rows, 'ROW_CHUNK_SIZE', 7)
+    event_ids = [250, 3, 999, 42] + list(range(100, 120))
+    found = event_rows(event_ids)
+    assert [row.id for row in found] == [i for i in event_ids if i != 999]
+    for row in found:
+        event = Event.query.get(row.id)
+        assert row[:4] + row[5:] == entity_values(event)
+        assert row.summary == event.description[:SUMMARY_LENGTH]
@@ -0,0 +1,109 @@
+"""Tests of event search (see usctimeline/events/search.py).
+
+Run them from the `USC_Timeline` directory, which holds `etc/config.json`:
+`python -m pytest tests`.
+"""
+
+from datetime import date
+import pytest
+from usctimeline import db, search_cache
+from usctimeline.events import search
+from usctimeline.events.bitmap import bitmap_index
+from usctimeline.events.search import (SearchCriteria, cached_search_page,
+                                       decode_cursor, encode_cursor,
+                                       keyset_search_page)
+from usctimeline.models import Event
+from usctimeline.reference import reference_cache
+from benchmarks import create_benchmark_app, seed_events
+
+
+def criteria(**values):
+    """Returns SearchCriteria with <values> and every other criterion unused."""
+    fields = dict.fromkeys(SearchCriteria._fields)
+    fields['tag_ids'] = ()
+    fields.update(values)
+    return SearchCriteria(**fields)
+
+
+@pytest.fixture
+def app():
+    """App bound to a temporary database holding 300 events."""
+    app = create_benchmark_app()
+    with app.app_context():
+        seed_events(300, tag_count=20)
+        # Process-wide indexes only check the DataVersion counters, which
+        # start over in every new database
+        bitmap_index.clear()
+        reference_cache.invalidate()
+        yield app
+
+
+def all_pages(page_function, search_criteria, page_size=7):
+    """Pages through a search and returns the (event ids, cursor) of every page."""
+    pages = []
+    cursor = None
+    while True:
+        page = page_function(search_criteria, cursor, page_size)
+        pages.append(([row.id for row in page.events], page.next_cursor))
+        if page.next_cursor is None:
+            return pages
+        cursor = page.next_cursor
+
+
+def test_facets_are_counted_once_per_result(app, monkeypatch):
+    calls = []
+    facet_counts = search.facet_counts
+    monkeypatch.setattr(
+        search, 'facet_counts',
+        lambda c: calls.append(c) or facet_counts(c)
+    )
+    pages = all_pages(keyset_search_page, criteria(category_id=1))
+    assert len(pages) > 1
+    assert len(calls) == 1
+    Event.query.get(1).title = 'Renamed event'
+    db.session.commit()
+    keyset_search_page(criteria(category_id=1), pages[0][1], 7)
+    assert len(calls) == 2
+
+
+def test_cursor_round_trip():
+    values = (-0.0607927, date(1999, 12, 31), 42)
+    assert decode_cursor(encode_cursor(values), ranked=True) == values
+    assert decode_cursor(encode_cursor(values[1:]), ranked=False) == values[1:]
+    assert decode_cursor('1999-12-31_42', ranked=True) is None
+    assert decode_cursor('42', ranked=False) is None
+    assert decode_cursor('not-a-date_42', ranked=False) is None
+    assert decode_cursor(None, ranked=False) is None
+
+
+@pytest.mark.parametrize('bitmap', [False, True])
+@pytest.mark.parametrize('search_criteria', [
+    criteria(),
+    criteria(category_id=2),
+    criteria(tag_ids=(3,)),
+    criteria(from_date=date(1970, 1, 1), to_date=date(1990, 12, 31)),
+    criteria(title='USC'),
+])
+def test_cached_pages_match_keyset_pages(app, bitmap, search_criteria):
+    app.config['SEARCH_BITMAP_INDEX'] = bitmap
+    search_cache.clear()
+    cached = all_pages(cached_search_page, search_criteria)
+    assert cached == all_pages(keyset_search_page, search_criteria)
+    event_ids = [event_id for ids, _ in cached for event_id in ids]
+    assert len(event_ids) == len(set(event_ids))
+    # Cursors are interchangeable between the cached and keyset paths
+    if len(cached) > 1:
+        cursor = cached[0][1]
+        search_cache.clear()
+        page = cached_search_page(search_criteria, cursor, 7)
+        assert [row.id for row in page.events] == cached[1][0]
+
+
+def test_cached_page_with_unknown_cursor_uses_keyset_query(app):
+    search_cache.clear()
+    cached_search_page(criteria(), None, 7)
+    cursor = encode_cursor((date(1990, 6, 15), 999999))
+    cached = cached_search_page(criteria(), cursor, 7)
+    keyset = keyset_search_page(criteria(), cursor, 7)
+    assert [row.id for row in cached.events] == [row.id for row in keyset.events]
+    assert cached.next_cursor == keyset.next_cursor
@@ -0,0 +1,69 @@
+"""Tests of the search suggestions index (see usctimeline/events/suggest.py).
+
+Run them from the `USC_Timeline` directory, which holds `etc/config.json`:
+`python -m pytest tests`.
+"""
+
+import threading
+from datetime import date
+import pytest
+from usctimeline import db
+from usctimeline.events.suggest import suggest_index
+from usctimeline.models import Event
+from benchmarks import create_benchmark_app, seed_events
+
+
+@pytest.fixture
+def app():
+    """App bound to a temporary database holding 100 events."""
+    app = create_benchmark_app()
+    with app.app_context():
+        seed_events(100, tag_count=20)
+        suggest_index.clear()
+        yield app
+        suggest_index.clear()
+
+
+def titles(text):
+    """Returns the titles of the events suggested for <text>."""
+    events, _ = suggest_index.suggest(text, 10)
+    return [title for _, title in events]
+
+
+def test_stale_index_is_rebuilt_in_the_background(app, monkeypatch):
+    suggest_index.ensure_loaded()
+    assert titles('zebra') == []
+    # An event written by another process, which this one is not told about
+    db.session.execute(Event.__table__.insert().values(
+        title='Zebra crossing', date=date(2000, 1, 1),
+        description='d', category_id=1
+    ))
+    db.session.commit()
+    started = threading.Event()
+    release = threading.Event()
+    read = suggest_index.read
+
+    def blocked_read():
+        indexes = read()
+        started.set()
+        release.wait(5)
+        return indexes
+
+    monkeypatch.setattr(suggest_index, 'read', blocked_read)
+    suggest_index.loaded_at -= 3600
+    suggest_index.ensure_loaded(max_age=60)
+    assert started.wait(5)
+    # Lookups are answered by the previous index during the rebuild, and
+    # commits meanwhile are replayed onto the new one
+    assert titles('zebra') == []
+    db.session.add(Event(
+        title='Yak shaving', date=date(2001, 1, 1),
+        description='d', category_id=1
+    ))
+    db.session.commit()
+    assert titles('yak') == ['Yak shaving']
+    release.set()
+    suggest_index.refresh_thread.join(5)
+    assert titles('zebra') == ['Zebra crossing']
+    assert titles('yak') == ['Yak shaving']
+    assert suggest_index.stats()['refreshing'] is False
@@ -0,0 +1,76 @@
+"""Tests of the timeline page (see usctimeline/main/timeline.py).
+
+Like the benchmarks, run them from the `USC_Timeline` directory, which holds
+`etc/config.json`: `python -m pytest tests`.
+"""
+
+from contextlib import contextmanager
+from datetime import date
+from sqlalchemy import event
+from usctimeline import db, timeline_cache
+from usctimeline.models import Event
+from benchmarks import create_benchmark_app, seed_events
+
+
+@contextmanager
+def count_statements(engine):
+    """Counts the statements executed by <engine> within the block.
+
+    Yields:
+        List whose only item is the number of statements so far.
+    """
+    count = [0]
+
+    def before_cursor_execute(*args):
+        count[0] += 1
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield count
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def index_statements(event_count):
+    """Returns the number of statements run to render `/` with <event_count> events.
+
+    The timeline cache is disabled (see create_benchmark_app), so every year
+    is rendered from the database.
+    """
+    app = create_benchmark_app()
+    with app.app_context():
+        seed_events(event_count, tag_count=20)
+        engine = db.engine
+    client = app.test_client()
+    # Process-wide caches (reference data) are filled by the first request
+    assert client.get('/').status_code == 200
+    with count_statements(engine) as count:
+        response = client.get('/')
+    assert response.status_code == 200
+    return count[0]
+
+
+def test_index_statements_do_not_grow_with_events():
+    assert index_statements(20) == index_statements(2000)
+
+
+def test_event_edit_only_rebuilds_its_years():
+    app = create_benchmark_app()
+    app.config['TIMELINE_CACHE_BACKEND'] = 'lru'
+    timeline_cache.init_app(app)
+    with app.app_context():
+        seed_events(500, tag_count=20)
+    client = app.test_client()
+    client.get('/')
+    entries = timeline_cache.stats()['entries']
+    with app.app_context():
+        edited = Event.query.get(1)
+        edited.title = 'Edited event'
+        edited.date = date(1966, 6, 6)
+        db.session.commit()
+    misses = timeline_cache.stats()['misses']
+    body = client.get('/').get_data(as_text=True)
+    # The list of years, and the previous and new year of the event
+    assert timeline_cache.stats()['misses'] - misses == 3
+    assert timeline_cache.stats()['entries'] == entries
+    assert 'Edited event' in body
@@ -0,0 +1,157 @@
+"""Tests of event image uploads (see usctimeline/uploads.py).
+
+Run them from the `USC_Timeline` directory, which holds `etc/config.json`:
+`python -m pytest tests`.
+"""
+
+import io
+import os
+import errno
+import pytest
+from PIL import Image as PILImage
+from usctimeline import db, images
+from usctimeline.images import image_path
+from usctimeline.models import Category, Event, Image, Job, User
+from usctimeline.reference import reference_cache
+from usctimeline.uploads import UploadStream, move_file, upload_directory
+from benchmarks import create_benchmark_app
+
+
+def jpeg_bytes(color=(20, 100, 10)):
+    """Returns the content of a small JPEG file."""
+    file = io.BytesIO()
+    PILImage.new('RGB', (64, 48), color).save(file, format='JPEG')
+    return file.getvalue()
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """App of a temporary database storing images and uploads in <tmp_path>."""
+    monkeypatch.setattr(images, 'IMAGE_DIRECTORY', str(tmp_path / 'images'))
+    app = create_benchmark_app()
+    app.config['UPLOAD_TEMP_DIR'] = str(tmp_path / 'uploads')
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        db.session.add(Category(id=1, name='USC'))
+        db.session.add(User(id=1, username='admin', email='admin@example.com',
+                            password='not a hash'))
+        db.session.commit()
+        reference_cache.invalidate()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    """Test client logged in as an admin."""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+        session['_fresh'] = True
+    return client
+
+
+def post_event(client, title, files):
+    """Creates an event with the images <files>, as (content, filename)."""
+    return client.post('/event/new', data={
+        'title': title,
+        'date': '1965-03-01',
+        'description': 'Uploaded',
+        'external_url': '',
+        'category': '1',
+        'images': [(io.BytesIO(content), name) for content, name in files],
+    }, content_type='multipart/form-data')
+
+
+def directory_files(directory):
+    """Returns the paths of the files in <directory>, relative to it."""
+    return sorted(
+        os.path.relpath(os.path.join(root, name), directory)
+        for root, _, names in os.walk(directory) for name in names
+    )
+
+
+def stored_files(app):
+    """Returns the files of the image directory, checking no upload is left."""
+    assert directory_files(app.config['UPLOAD_TEMP_DIR']) == []
+    return directory_files(os.path.join(app.root_path, images.IMAGE_DIRECTORY))
+
+
+def test_same_content_is_stored_once(app, client):
+    content = jpeg_bytes()
+    assert post_event(client, 'First', [(content, 'photo.jpg')]).status_code == 302
+    assert post_event(client, 'Second', [(content, 'copy.JPEG')]).status_code == 302
+    with app.app_context():
+        image = Image.query.one()
+        assert sorted(event.title for event in image.events) == ['First', 'Second']
+        assert Job.query.count() == 1
+        assert stored_files(app) == [image.filename]
+        with open(image_path(image.filename), 'rb') as file:
+            assert file.read() == content
+
+
+def test_different_content_is_stored_apart(app, client):
+    files = [(jpeg_bytes(), 'a.jpg'), (jpeg_bytes((200, 0, 0)), 'b.jpg')]
+    assert post_event(client, 'Two images', files).status_code == 302
+    with app.app_context():
+        event = Event.query.one()
+        assert len(event.images) == 2
+        assert stored_files(app) == sorted(image.filename for image in event.images)
+
+
+def test_uploads_are_received_outside_of_static_files(app):
+    with app.test_request_context():
+        stream = UploadStream(upload_directory(), 1024 * 1024)
+        try:
+            assert os.path.dirname(stream.path) == app.config['UPLOAD_TEMP_DIR']
+            assert not stream.path.startswith(app.static_folder)
+            stream.write(jpeg_bytes())
+            stream.seek(0)
+            filename = stream.store()
+        finally:
+            stream.close()
+        assert stored_files(app) == [filename]
+
+
+def test_uploads_are_copied_across_filesystems(tmp_path, monkeypatch):
+    replace = os.replace
+
+    def rename(source, destination):
+        if os.path.dirname(source) == str(tmp_path / 'uploads'):
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+        return replace(source, destination)
+
+    monkeypatch.setattr(os, 'replace', rename)
+    (tmp_path / 'uploads').mkdir()
+    (tmp_path / 'images').mkdir()
+    (tmp_path / 'uploads' / 'upload').write_bytes(b'content')
+    move_file(str(tmp_path / 'uploads' / 'upload'), str(tmp_path / 'images' / 'image'))
+    assert directory_files(str(tmp_path / 'uploads')) == []
+    assert directory_files(str(tmp_path / 'images')) == ['image']
+    assert (tmp_path / 'images' / 'image').read_bytes() == b'content'
+
+
+def test_default_upload_directory_is_in_the_instance_folder(app):
+    app.config['UPLOAD_TEMP_DIR'] = None
+    with app.app_context():
+        assert upload_directory() == os.path.join(app.instance_path, 'uploads', 'tmp')
+
+
+def test_files_larger_than_the_limit_are_rejected(app, client):
+    content = jpeg_bytes()
+    app.config['IMAGE_MAX_SIZE'] = len(content) - 1
+    assert post_event(client, 'Too large', [(content, 'photo.jpg')]).status_code == 413
+    app.config['IMAGE_MAX_SIZE'] = len(content)
+    assert post_event(client, 'Fits', [(content, 'photo.jpg')]).status_code == 302
+    with app.app_context():
+        assert [event.title for event in Event.query] == ['Fits']
+        assert len(stored_files(app)) == 1
+
+
+def test_files_which_are_not_images_are_rejected(app, client):
+    response = post_event(client, 'Not an image', [(b'MZ' * 5000, 'photo.jpg')])
+    assert response.status_code == 200
+    assert b'File is not an approved image type' in response.data
+    with app.app_context():
+        assert Event.query.count() == 0
+        assert Image.query.count() == 0
+        assert stored_files(app) == []
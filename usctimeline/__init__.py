@@ -1,24 +1,31 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 from flask_mail import Mail
 from usctimeline.config import Config
+from usctimeline.cache import Cache
+from usctimeline.engine import EngineProfile, RoutingSQLAlchemy
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
+engine_profile = EngineProfile()
 bcrypt = Bcrypt()
 login_manager = LoginManager()
 login_manager.login_view = 'users.login'
 login_manager.login_message_category = 'info'
 mail = Mail()
+timeline_cache = Cache('TIMELINE_CACHE')
+search_cache = Cache('SEARCH_CACHE')
+facet_cache = Cache('FACET_CACHE')
 
 
 def create_app(config_class=Config):
     """Initializes a new Flask app.
 
     Initializes a new Flask app with provided configurations. Initializes
-    database, bcrypt, login_manager and mail. Registers users, events, tags,
-    main, and errors modules (blueprints).
+    database (tuned by engine_profile), bcrypt, login_manager, mail,
+    timeline_cache, search_cache and facet_cache. Registers users, events,
+    tags, main, and errors modules (blueprints), the cache headers of event
+    images and the streaming of uploads (see uploads.py).
 
     Args:
         config_class:
@@ -31,20 +38,30 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(Config)
 
+    engine_profile.init_app(app)
     db.init_app(app)
     bcrypt.init_app(app)
     login_manager.init_app(app)
     mail.init_app(app)
+    timeline_cache.init_app(app)
+    search_cache.init_app(app)
+    facet_cache.init_app(app)
 
     from usctimeline.users.routes import users
     from usctimeline.events.routes import events
     from usctimeline.tags.routes import tags
     from usctimeline.main.routes import main
     from usctimeline.errors.handlers import errors
+    from usctimeline.reference import reference_cache
+    from usctimeline.images import add_immutable_cache_headers
+    from usctimeline.uploads import UploadRequest
     app.register_blueprint(users)
     app.register_blueprint(events)
     app.register_blueprint(tags)
     app.register_blueprint(main)
     app.register_blueprint(errors)
+    reference_cache.init_app(app)
+    app.after_request(add_immutable_cache_headers)
+    app.request_class = UploadRequest
 
     return app
@@ -0,0 +1,302 @@
+import os
+import sys
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def deep_sizeof(value):
+    """Returns the approximate memory footprint of <value> in bytes.
+
+    Follows the items of tuples, lists, sets and dictionaries; every other
+    object (strings, numbers, arrays, ...) is measured with sys.getsizeof.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_sizeof(k) + deep_sizeof(v) for k, v in value.items())
+    elif isinstance(value, (tuple, list, set, frozenset)):
+        size += sum(deep_sizeof(item) for item in value)
+    return size
+
+
+class BaseCache:
+    """Base class for cache backends.
+
+    Backends store string keys mapped to values and keep hit/miss counters
+    so that cache effectiveness can be monitored.
+
+    Attributes:
+        hits:
+            Number of lookups that found a value.
+        misses:
+            Number of lookups that did not find a value.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version=None):
+        """Returns the value stored under <key>, or None if absent.
+
+        Args:
+            key: Key of the entry.
+            version: Version the entry must have been stored with (see
+                Cache.set()), or None for unversioned entries. Entries of
+                another version count as absent.
+        """
+        value = self._get(key)
+        if value is not None and version is not None:
+            stored, _, value = value.partition(':')
+            if stored != str(version):
+                value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def stats(self):
+        """Returns a dictionary of counters describing this cache."""
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self),
+            'bytes': self.size_in_bytes(),
+        }
+
+    def size_in_bytes(self):
+        """Returns the approximate memory or disk footprint of the entries."""
+        return 0
+
+
+class NullCache(BaseCache):
+    """Cache backend that never stores anything."""
+
+    def _get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+class LRUCache(BaseCache):
+    """In-process cache evicting the least recently used entry when full.
+
+    Args:
+        maxsize: Maximum number of entries held before evicting.
+        ttl: Number of seconds an entry stays valid, or None for no expiry.
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        super().__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def size_in_bytes(self):
+        with self._lock:
+            return sum(
+                sys.getsizeof(key) + deep_sizeof(value)
+                for key, (_, value) in self._data.items()
+            )
+
+
+class FileSystemCache(BaseCache):
+    """Cache storing text values as files inside a directory.
+
+    Entries survive restarts and are shared by every process (e.g. gunicorn
+    workers and import.py) pointing at the same directory.
+
+    Args:
+        directory: Directory holding the cache files. Created if missing.
+    """
+
+    SUFFIX = '.cache'
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + self.SUFFIX)
+
+    def _get(self, key):
+        try:
+            with open(self._path(key), encoding='utf-8') as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(value)
+        os.replace(tmp_path, self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for filename in os.listdir(self.directory):
+            if filename.endswith(self.SUFFIX):
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except FileNotFoundError:
+                    pass
+
+    def __len__(self):
+        return sum(
+            1 for filename in os.listdir(self.directory)
+            if filename.endswith(self.SUFFIX)
+        )
+
+    def size_in_bytes(self):
+        total = 0
+        for filename in os.listdir(self.directory):
+            if filename.endswith(self.SUFFIX):
+                try:
+                    total += os.path.getsize(os.path.join(self.directory, filename))
+                except FileNotFoundError:
+                    pass
+        return total
+
+
+def make_cache(backend, maxsize=128, directory=None, ttl=None):
+    """Creates a cache backend by name.
+
+    Args:
+        backend: One of 'lru', 'filesystem' or 'null' (None is 'null').
+        maxsize: Maximum number of entries for the 'lru' backend.
+        directory: Directory used by the 'filesystem' backend.
+        ttl: Entry lifetime in seconds for the 'lru' backend (None: forever).
+
+    Returns:
+        A BaseCache instance.
+
+    Raises:
+        ValueError: <backend> is not a known backend name.
+    """
+    if backend in (None, 'null'):
+        return NullCache()
+    if backend == 'lru':
+        return LRUCache(maxsize, ttl=ttl)
+    if backend == 'filesystem':
+        return FileSystemCache(directory)
+    raise ValueError(f"Cache backend '{backend}' not found.")
+
+
+class Cache:
+    """Flask extension exposing a cache backend chosen by app configuration.
+
+    Reads <prefix>_BACKEND, <prefix>_SIZE, <prefix>_DIR and <prefix>_TTL
+    from the app config when init_app() is called. Until then every lookup
+    misses.
+
+    Args:
+        prefix: Prefix of the configuration keys for this cache.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.backend = NullCache()
+
+    def init_app(self, app):
+        self.backend = make_cache(
+            app.config.get(f'{self.prefix}_BACKEND'),
+            maxsize=app.config.get(f'{self.prefix}_SIZE', 128),
+            directory=app.config.get(f'{self.prefix}_DIR'),
+            ttl=app.config.get(f'{self.prefix}_TTL')
+        )
+
+    @property
+    def enabled(self):
+        """True unless the configured backend is the null backend."""
+        return not isinstance(self.backend, NullCache)
+
+    def get(self, key, version=None):
+        return self.backend.get(key, version)
+
+    def set(self, key, value, version=None):
+        """Stores <value> under <key>.
+
+        Text values may be stored with a <version> (without ':'), which
+        get() must be given to find them. Each key holds a single version,
+        so storing a new version replaces the previous one instead of
+        leaving it behind.
+        """
+        if version is not None:
+            value = f'{version}:{value}'
+        self.backend.set(key, value)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return self.backend.stats()
@@ -8,9 +8,37 @@ class Config:
         config = json.load(file)
     SECRET_KEY = config.get('FLASK_SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = config.get('SQLALCHEMY_DATABASE_URI')
+    SQLALCHEMY_REPLICA_URI = config.get('SQLALCHEMY_REPLICA_URI')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    DATABASE_PROFILE = config.get('DATABASE_PROFILE', 'auto')
+    DATABASE_MAX_CONNECTIONS = config.get('DATABASE_MAX_CONNECTIONS', 20)
+    DATABASE_WORKERS = config.get('DATABASE_WORKERS')
+    DATABASE_STATEMENT_TIMEOUT = config.get('DATABASE_STATEMENT_TIMEOUT', 10000)
     MAIL_SERVER = config.get("MAIL_SERVER")
     MAIL_PORT = config.get("MAIL_PORT")
     MAIL_USE_TLS = True
     MAIL_USERNAME = config.get('EMAIL_USERNAME')
     MAIL_PASSWORD = config.get('EMAIL_PASSWORD')
+    TIMELINE_CACHE_BACKEND = config.get('TIMELINE_CACHE_BACKEND', 'lru')
+    TIMELINE_CACHE_SIZE = config.get('TIMELINE_CACHE_SIZE', 256)
+    TIMELINE_CACHE_DIR = config.get('TIMELINE_CACHE_DIR', 'cache/timeline')
+    TIMELINE_WINDOW_YEARS = config.get('TIMELINE_WINDOW_YEARS', 0)
+    SEARCH_BITMAP_INDEX = config.get('SEARCH_BITMAP_INDEX', False)
+    SEARCH_PAGE_SIZE = config.get('SEARCH_PAGE_SIZE', 25)
+    SEARCH_CACHE_BACKEND = config.get('SEARCH_CACHE_BACKEND', 'lru')
+    SEARCH_CACHE_SIZE = config.get('SEARCH_CACHE_SIZE', 512)
+    SEARCH_CACHE_TTL = config.get('SEARCH_CACHE_TTL', 300)
+    FACET_CACHE_BACKEND = config.get('FACET_CACHE_BACKEND', 'lru')
+    FACET_CACHE_SIZE = config.get('FACET_CACHE_SIZE', 256)
+    SUGGEST_LIMIT = config.get('SUGGEST_LIMIT', 10)
+    SUGGEST_INDEX_MAX_AGE = config.get('SUGGEST_INDEX_MAX_AGE', 300)
+    MAX_CONTENT_LENGTH = config.get('MAX_CONTENT_LENGTH', 64 * 1024 * 1024)
+    IMAGE_MAX_SIZE = config.get('IMAGE_MAX_SIZE', 16 * 1024 * 1024)
+    UPLOAD_TEMP_DIR = config.get('UPLOAD_TEMP_DIR')
+    IMAGE_SENDFILE = config.get('IMAGE_SENDFILE')
+    IMAGE_ACCEL_PREFIX = config.get('IMAGE_ACCEL_PREFIX', '/protected/images/event/')
+    IMAGE_JPEG_QUALITY = config.get('IMAGE_JPEG_QUALITY', 82)
+    IMAGE_WEBP_QUALITY = config.get('IMAGE_WEBP_QUALITY', 80)
+    JOB_POLL_INTERVAL = config.get('JOB_POLL_INTERVAL', 2)
+    JOB_MAX_ATTEMPTS = config.get('JOB_MAX_ATTEMPTS', 3)
+    JOB_TIMEOUT = config.get('JOB_TIMEOUT', 600)
@@ -0,0 +1,220 @@
+import os
+import sqlite3
+from flask import has_request_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool, StaticPool
+from sqlalchemy.sql.dml import UpdateBase
+
+# PRAGMAs run on every new SQLite connection by the 'sqlite' profile.
+# WAL lets readers proceed while a writer commits, and NORMAL synchronous is
+# durable in WAL mode except against power loss of the last transactions.
+SQLITE_PRAGMAS = [
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('cache_size', -64000),
+    ('mmap_size', 268435456),
+    ('temp_store', 'MEMORY'),
+]
+
+PROFILES = ('default', 'sqlite', 'postgres')
+
+# Name of the bind of the read replica (see RoutingSession)
+REPLICA_BIND = 'replica'
+
+
+def profile_for_uri(uri):
+    """Returns the engine profile matching the database of <uri>."""
+    backend = make_url(uri).get_backend_name() if uri else None
+    if backend == 'sqlite':
+        return 'sqlite'
+    if backend == 'postgresql':
+        return 'postgres'
+    return 'default'
+
+
+def is_memory_database(uri):
+    """Tests whether <uri> points at an in-memory SQLite database."""
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and (
+        url.database in (None, '', ':memory:')
+        or url.query.get('mode') == 'memory'
+    )
+
+
+def postgres_pool_sizes(max_connections, workers):
+    """Splits the connection budget of the database between worker processes.
+
+    Every gunicorn worker holds its own pool, so each one may open at most
+    max_connections // workers connections: half of them kept in the pool,
+    the rest opened on demand as overflow.
+
+    Returns:
+        Tuple of (pool_size, max_overflow).
+    """
+    per_worker = max(1, max_connections // max(1, workers))
+    pool_size = max(1, per_worker // 2)
+    return pool_size, per_worker - pool_size
+
+
+def engine_options(profile, config):
+    """Returns the create_engine() options of an engine profile.
+
+    Args:
+        profile: One of PROFILES.
+        config: App config holding the DATABASE_* settings.
+
+    Returns:
+        Dictionary of keyword arguments for create_engine().
+    """
+    if profile == 'postgres':
+        workers = config.get('DATABASE_WORKERS') or int(
+            os.environ.get('WEB_CONCURRENCY', 1)
+        )
+        pool_size, max_overflow = postgres_pool_sizes(
+            config.get('DATABASE_MAX_CONNECTIONS', 20), workers
+        )
+        timeout = int(config.get('DATABASE_STATEMENT_TIMEOUT', 10000))
+        return {
+            'pool_size': pool_size,
+            'max_overflow': max_overflow,
+            'pool_timeout': 10,
+            'pool_recycle': 1800,
+            'pool_pre_ping': True,
+            'connect_args': {'options': f'-c statement_timeout={timeout}'},
+        }
+    if profile == 'sqlite':
+        uri = config.get('SQLALCHEMY_DATABASE_URI')
+        if uri and is_memory_database(uri):
+            # Each connection to an in-memory database opens a new, empty
+            # database, so every checkout must share a single connection
+            return {
+                'poolclass': StaticPool,
+                'connect_args': {'check_same_thread': False},
+            }
+        # SQLite file databases default to opening a connection per checkout;
+        # pooling keeps the page cache and memory map, and the PRAGMAs run
+        # once per connection instead of once per request
+        return {
+            'poolclass': QueuePool,
+            'pool_size': 5,
+            'max_overflow': 10,
+            'connect_args': {'check_same_thread': False},
+        }
+    return {}
+
+
+class EngineProfile:
+    """Flask extension tuning the database engine with a named profile.
+
+    Reads DATABASE_PROFILE from the app config when init_app() is called:
+    'sqlite' and 'postgres' tune the engine for that database (in-memory
+    SQLite databases keep a single shared connection), 'default' keeps the
+    SQLAlchemy defaults and 'auto' picks the profile matching
+    SQLALCHEMY_DATABASE_URI. Must be initialized before the engine is first
+    used.
+
+    Also registers SQLALCHEMY_REPLICA_URI, if set, as the replica bind (see
+    RoutingSession). The replica engine uses the same profile.
+
+    Attributes:
+        profile:
+            Name of the active profile.
+        pragmas:
+            List of (name, value) PRAGMAs run on new SQLite connections.
+    """
+
+    def __init__(self):
+        self.profile = 'default'
+        self.pragmas = []
+        event.listen(Engine, 'connect', self.set_sqlite_pragmas)
+
+    def init_app(self, app):
+        profile = app.config.get('DATABASE_PROFILE', 'auto')
+        if profile == 'auto':
+            profile = profile_for_uri(app.config.get('SQLALCHEMY_DATABASE_URI'))
+        if profile not in PROFILES:
+            raise ValueError(f"Database profile '{profile}' not found.")
+        self.profile = profile
+        uri = app.config.get('SQLALCHEMY_DATABASE_URI')
+        # WAL and the memory map only apply to file databases
+        self.pragmas = SQLITE_PRAGMAS if (
+            profile == 'sqlite' and uri and not is_memory_database(uri)
+        ) else []
+        # Options set by a previous init_app() call are replaced, not merged
+        previous = app.extensions.get('engine_profile', {})
+        options = {
+            key: value for key, value in
+            (app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}).items()
+            if key not in previous
+        }
+        profile_options = engine_options(profile, app.config)
+        options.update(profile_options)
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+        app.extensions['engine_profile'] = profile_options
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds.pop(REPLICA_BIND, None)
+        if app.config.get('SQLALCHEMY_REPLICA_URI'):
+            binds[REPLICA_BIND] = app.config['SQLALCHEMY_REPLICA_URI']
+        app.config['SQLALCHEMY_BINDS'] = binds or None
+
+    def set_sqlite_pragmas(self, dbapi_connection, connection_record):
+        """Runs the profile's PRAGMAs on every new SQLite connection."""
+        if not self.pragmas or not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for name, value in self.pragmas:
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+
+class RoutingSession(SignallingSession):
+    """Session sending the reads of anonymous GET requests to a replica.
+
+    When the app has a replica bind, statements run by the session use the
+    replica engine unless one of these holds, in which case they use the
+    primary database:
+
+    - The session is not used by a request (e.g. scripts).
+    - The request is not GET or HEAD, or comes from a logged-in user, so
+      that admins always read their own writes.
+    - The session has flushed or written anything, or has pending changes.
+      Once a request wrote to the primary, all of its later reads go to the
+      primary too.
+    - The statement is an INSERT, UPDATE or DELETE.
+    """
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.use_replica(mapper, clause):
+            return self.db.get_engine(self.app, bind=REPLICA_BIND)
+        return super().get_bind(mapper, clause)
+
+    def use_replica(self, mapper, clause):
+        """Tests whether a statement may be answered by the replica."""
+        if REPLICA_BIND not in (self.app.config.get('SQLALCHEMY_BINDS') or {}):
+            return False
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info['wrote'] = True
+        if self.info.get('wrote') or self.new or self.dirty or self.deleted:
+            return False
+        if mapper is not None and mapper.persist_selectable.info.get('bind_key'):
+            return False
+        return (
+            has_request_context()
+            and request.method in ('GET', 'HEAD')
+            and '_user_id' not in session
+        )
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy extension whose sessions are RoutingSessions."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
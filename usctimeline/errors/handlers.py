@@ -13,3 +13,9 @@ def error_404(error):
 def error_500(error):
     """Returns rendered template for 500 page when 500 error occurs."""
     return render_template('errors/500.html'), 500
+
+
+@errors.app_errorhandler(413)
+def error_413(error):
+    """Returns rendered template for 413 page when an upload is too large."""
+    return render_template('errors/413.html', description=error.description), 413
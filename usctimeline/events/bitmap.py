@@ -0,0 +1,348 @@
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from datetime import date
+from sqlalchemy import event, inspect
+from usctimeline import db
+from usctimeline.models import Category, Event, Image, Tag, event_tags
+from usctimeline.versions import ALL, get_versions
+
+# Sorted date keys pack (date ordinal, event id) into one integer
+ID_BITS = 32
+ID_MASK = (1 << ID_BITS) - 1
+NONZERO_BYTE = re.compile(rb'[^\x00]')
+
+
+def date_key(ordinal, event_id=0):
+    """Returns the sort key of an event on day <ordinal> in the date array."""
+    return (ordinal << ID_BITS) | event_id
+
+
+def ids_to_bitmap(ids):
+    """Returns an integer bitmap with the bits of <ids> set."""
+    ids = list(ids)
+    if not ids:
+        return 0
+    bits = bytearray(max(ids) // 8 + 1)
+    for event_id in ids:
+        bits[event_id >> 3] |= 1 << (event_id & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def count_bits(bitmap):
+    """Returns the number of bits set in <bitmap>."""
+    return bin(bitmap).count('1')
+
+
+def bitmap_to_ids(bitmap):
+    """Returns the ids whose bits are set in <bitmap>, in ascending order."""
+    ids = []
+    bits = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for match in NONZERO_BYTE.finditer(bits):
+        byte = match.group()[0]
+        base = match.start() << 3
+        for bit in range(8):
+            if byte & (1 << bit):
+                ids.append(base + bit)
+    return ids
+
+
+class BitmapIndex:
+    """In-process index of events for category, tag and date filtering.
+
+    Every category and tag maps to an integer bitmap of event ids, and the
+    events are kept in an array sorted by (date, id) for range lookups, so
+    filters are combined with bitwise ANDs without touching the database.
+
+    The index is built lazily and remembers the 'all' DataVersion it
+    reflects. Writes committed by this process are applied incrementally
+    (see the session listeners below); writes from any other process change
+    the version and trigger a full rebuild on the next search.
+
+    Attributes:
+        version:
+            DataVersion 'all' counter the index reflects, or None if the index
+            must be rebuilt before use.
+        all_events:
+            Bitmap of every indexed event.
+        categories:
+            Dictionary mapping category ids to bitmaps.
+        tags:
+            Dictionary mapping tag ids to bitmaps.
+        years:
+            Dictionary mapping years to bitmaps.
+        dates:
+            Array of date keys (see date_key()) sorted ascending.
+        events:
+            Dictionary mapping event ids to (date ordinal, category_id,
+            tuple of tag ids).
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """Empties the index and marks it for rebuilding."""
+        with self.lock:
+            self.version = None
+            self.all_events = 0
+            self.categories = {}
+            self.tags = {}
+            self.years = {}
+            self.dates = array('q')
+            self.events = {}
+
+    def rebuild(self):
+        """Loads every event from the database with two queries."""
+        with self.lock:
+            version = get_versions(ALL)[ALL][0]
+            rows = db.session.query(Event.id, Event.date, Event.category_id)
+            tag_rows = db.session.query(event_tags.c.event_id, event_tags.c.tag_id)
+            tags_per_event = {}
+            tag_members = {}
+            for event_id, tag_id in tag_rows:
+                tags_per_event.setdefault(event_id, set()).add(tag_id)
+                tag_members.setdefault(tag_id, []).append(event_id)
+            category_members = {}
+            year_members = {}
+            self.clear()
+            for event_id, day, category_id in rows:
+                tag_ids = tuple(tags_per_event.get(event_id, ()))
+                self.events[event_id] = (day.toordinal(), category_id, tag_ids)
+                category_members.setdefault(category_id, []).append(event_id)
+                year_members.setdefault(day.year, []).append(event_id)
+            self.all_events = ids_to_bitmap(self.events)
+            self.categories = {
+                category_id: ids_to_bitmap(ids)
+                for category_id, ids in category_members.items()
+            }
+            self.tags = {
+                tag_id: ids_to_bitmap(i for i in ids if i in self.events)
+                for tag_id, ids in tag_members.items()
+            }
+            self.years = {
+                year: ids_to_bitmap(ids) for year, ids in year_members.items()
+            }
+            self.dates = array('q', sorted(
+                date_key(ordinal, event_id)
+                for event_id, (ordinal, _, _) in self.events.items()
+            ))
+            self.version = version
+
+    def ensure_current(self):
+        """Rebuilds the index if the database changed since it was built."""
+        with self.lock:
+            if self.version is None or self.version != get_versions(ALL)[ALL][0]:
+                self.rebuild()
+
+    def add_event(self, event_id, day, category_id, tag_ids):
+        """Adds or replaces a single event in the index."""
+        with self.lock:
+            self.remove_event(event_id)
+            bit = 1 << event_id
+            ordinal = day.toordinal()
+            self.events[event_id] = (ordinal, category_id, tuple(set(tag_ids)))
+            self.all_events |= bit
+            self.categories[category_id] = self.categories.get(category_id, 0) | bit
+            for tag_id in tag_ids:
+                self.tags[tag_id] = self.tags.get(tag_id, 0) | bit
+            self.years[day.year] = self.years.get(day.year, 0) | bit
+            insort(self.dates, date_key(ordinal, event_id))
+
+    def remove_event(self, event_id):
+        """Removes a single event from the index, if present."""
+        with self.lock:
+            info = self.events.pop(event_id, None)
+            if info is None:
+                return
+            ordinal, category_id, tag_ids = info
+            mask = ~(1 << event_id)
+            self.all_events &= mask
+            self.categories[category_id] &= mask
+            for tag_id in tag_ids:
+                self.tags[tag_id] &= mask
+            self.years[date.fromordinal(ordinal).year] &= mask
+            del self.dates[bisect_left(self.dates, date_key(ordinal, event_id))]
+
+    def date_range(self, from_date, to_date):
+        """Returns the bitmap of events dated within [from_date, to_date]."""
+        start = bisect_left(self.dates, date_key(from_date.toordinal()))
+        end = bisect_left(self.dates, date_key(to_date.toordinal() + 1))
+        return ids_to_bitmap(key & ID_MASK for key in self.dates[start:end])
+
+    def match(self, criteria):
+        """Returns the bitmap of events matching <criteria>.
+
+        The title criterion is not supported and is ignored; callers must
+        use the database for text searches.
+
+        Args:
+            criteria: An instance of SearchCriteria.
+        """
+        self.ensure_current()
+        with self.lock:
+            result = self.all_events
+            if criteria.category_id:
+                result &= self.categories.get(criteria.category_id, 0)
+            for tag_id in criteria.tag_ids:
+                result &= self.tags.get(tag_id, 0)
+            if criteria.exact_date:
+                result &= self.date_range(criteria.exact_date, criteria.exact_date)
+            if criteria.from_date and criteria.to_date:
+                result &= self.date_range(criteria.from_date, criteria.to_date)
+            return result
+
+    def sort_keys(self, bitmap):
+        """Returns the sort keys of the events in <bitmap>.
+
+        Args:
+            bitmap: Bitmap of matching events (see match()).
+
+        Returns:
+            List of (date ordinal, event id) tuples in ascending order.
+        """
+        with self.lock:
+            return sorted(
+                (self.events[event_id][0], event_id)
+                for event_id in bitmap_to_ids(bitmap)
+            )
+
+    def page(self, bitmap, after=None, limit=25):
+        """Returns a page of matching event ids in (date, id) order.
+
+        Walks the sorted date array from the cursor, so the cost depends on
+        the page size and the density of matches, not on the page number.
+
+        Args:
+            bitmap: Bitmap of matching events (see match()).
+            after: (date, id) of the last event of the previous page, or None
+                for the first page.
+            limit: Maximum number of ids returned.
+
+        Returns:
+            List of at most <limit> event ids.
+        """
+        bits = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+        size = len(bits)
+        ids = []
+        with self.lock:
+            start = 0
+            if after is not None:
+                start = bisect_right(
+                    self.dates, date_key(after[0].toordinal(), after[1])
+                )
+            for position in range(start, len(self.dates)):
+                event_id = self.dates[position] & ID_MASK
+                byte = event_id >> 3
+                if byte < size and bits[byte] & (1 << (event_id & 7)):
+                    ids.append(event_id)
+                    if len(ids) == limit:
+                        break
+        return ids
+
+    def facets(self, bitmap):
+        """Counts matching events per category, tag and year.
+
+        Args:
+            bitmap: Bitmap of matching events (see match()).
+
+        Returns:
+            Tuple of three dictionaries (categories, tags, years) mapping ids
+            or years to non-zero counts.
+        """
+        with self.lock:
+            counts = []
+            for groups in (self.categories, self.tags, self.years):
+                group_counts = {}
+                for key, members in groups.items():
+                    count = count_bits(bitmap & members)
+                    if count:
+                        group_counts[key] = count
+                counts.append(group_counts)
+            return tuple(counts)
+
+    def stats(self):
+        """Returns a dictionary describing the size of the index."""
+        with self.lock:
+            bitmaps = [self.all_events]
+            bitmaps.extend(self.categories.values())
+            bitmaps.extend(self.tags.values())
+            bitmaps.extend(self.years.values())
+            bitmap_bytes = sum(sys.getsizeof(bitmap) for bitmap in bitmaps)
+            date_bytes = sys.getsizeof(self.dates)
+            event_bytes = sys.getsizeof(self.events) + sum(
+                sys.getsizeof(info) + sys.getsizeof(info[2])
+                for info in self.events.values()
+            )
+            return {
+                'version': self.version,
+                'events': len(self.events),
+                'categories': len(self.categories),
+                'tags': len(self.tags),
+                'bitmap_bytes': bitmap_bytes,
+                'date_bytes': date_bytes,
+                'event_bytes': event_bytes,
+                'total_bytes': bitmap_bytes + date_bytes + event_bytes,
+            }
+
+
+bitmap_index = BitmapIndex()
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_index_changes(session, flush_context):
+    """Records the flushed changes to apply to the index on commit.
+
+    Each flush writing an Event, Tag, Category or Image bumps the 'all'
+    DataVersion once (see versions.py); those flushes are counted so the
+    index version can follow its own process' writes.
+    """
+    changes = session.info.setdefault('bitmap_changes', [])
+    flushed = False
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Event):
+            changes.append((
+                'add', obj.id, obj.date, obj.category_id,
+                [tag.id for tag in obj.tags]
+            ))
+        elif isinstance(obj, Tag):
+            if inspect(obj).attrs.events.history.has_changes():
+                changes.append(('stale',))
+        flushed = flushed or isinstance(obj, (Event, Image, Tag, Category))
+    for obj in session.deleted:
+        if isinstance(obj, Event):
+            changes.append(('remove', obj.id))
+        elif isinstance(obj, (Tag, Category)):
+            changes.append(('stale',))
+        flushed = flushed or isinstance(obj, (Event, Image, Tag, Category))
+    if flushed:
+        session.info['bitmap_flushes'] = session.info.get('bitmap_flushes', 0) + 1
+
+
+@event.listens_for(db.session, 'after_commit')
+def apply_index_changes(session):
+    """Applies the changes of a committed transaction to the index."""
+    changes = session.info.pop('bitmap_changes', [])
+    flushes = session.info.pop('bitmap_flushes', 0)
+    with bitmap_index.lock:
+        if bitmap_index.version is None or not flushes:
+            return
+        for change in changes:
+            if change[0] == 'add':
+                bitmap_index.add_event(*change[1:])
+            elif change[0] == 'remove':
+                bitmap_index.remove_event(change[1])
+            else:
+                bitmap_index.clear()
+                return
+        bitmap_index.version += flushes
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_index_changes(session):
+    """Forgets the changes recorded for a transaction that was rolled back."""
+    session.info.pop('bitmap_changes', None)
+    session.info.pop('bitmap_flushes', None)
@@ -3,12 +3,12 @@ from wtforms import StringField, TextAreaField, MultipleFileField, SubmitField
 from wtforms.fields.html5 import DateField, URLField
 from wtforms.validators import DataRequired, Optional
 from wtforms.ext.sqlalchemy.fields import QuerySelectField, QuerySelectMultipleField
-from usctimeline.models import Category, Tag
+from usctimeline.reference import item_pk, reference_cache
 from usctimeline.tags.forms import tag_query
 
 def category_query():
-    """Returns a Flask-SQLAlchemy query object for the Category model."""
-    return Category.query
+    """Returns the cached Category snapshots (see reference.py)."""
+    return reference_cache.get().categories
 
 class EventForm(FlaskForm):
     """Form for creating a new Event object.
@@ -44,6 +44,7 @@ class EventForm(FlaskForm):
         'Category',
         validators=[DataRequired()],
         query_factory=category_query,
+        get_pk=item_pk,
         get_label='name',
         allow_blank=True,
         blank_text='Choose Category'
@@ -51,44 +52,48 @@ class EventForm(FlaskForm):
     tags = QuerySelectMultipleField(
         'Tag(s)',
         query_factory=tag_query,
+        get_pk=item_pk,
         get_label='name'
     )
     images = MultipleFileField('Image(s)')
     submit = SubmitField('Submit')
 
 
-def update_event_form_factory(default_category_name, event_id):
+def update_event_form_factory(default_category_id, default_tag_ids):
     """Returns a new instance of UpdateEventForm.
 
     Creates a new instance of UpdateEventForm. This class inherits EventForm
     and overwrites the category and tags fields of an existing Event.
 
     Args:
-        default_category_name:
-            Category name of an existing Event. This category name will be
+        default_category_id:
+            Category ID of an existing Event. This category will be
             pre-selected in the category select element.
-        event_id:
-            ID of an existing event. Needed to retrieve all tag(s) (if any) for
-            the Event of interest. If any tag(s) belong to the Event, then they
-            will be pre-selected in the tags select element.
+        default_tag_ids:
+            IDs of the tag(s) (if any) of an existing Event. These tags will
+            be pre-selected in the tags select element.
     Returns:
         An instance of UpdateEventForm.
     """
+    reference = reference_cache.get()
+
     class UpdateEventForm(EventForm):
         category = QuerySelectField(
             'Update Category',
             validators=[DataRequired()],
             query_factory=category_query,
+            get_pk=item_pk,
             get_label='name',
             allow_blank=True,
             blank_text='Choose Category',
-            default=Category.query.filter_by(name=default_category_name).first()
+            default=reference.category(default_category_id)
         )
         tags = QuerySelectMultipleField(
             'Update Tag(s)',
             query_factory=tag_query,
+            get_pk=item_pk,
             get_label='name',
-            default=Tag.query.filter(Tag.events.any(id=event_id)).all()
+            default=[reference.tag(tag_id) for tag_id in default_tag_ids]
         )
         submit = SubmitField('Update')
 
@@ -98,6 +103,9 @@ def update_event_form_factory(default_category_name, event_id):
 class SearchEventForm(FlaskForm):
     """Form for searching specific event(s) in the database.
 
+    The form is submitted with GET, so that searches and result pages have
+    bookmarkable URLs. It changes nothing, so it is not CSRF protected.
+
     Attributes:
         title:
             An input element of type text for the event title.
@@ -138,6 +146,7 @@ class SearchEventForm(FlaskForm):
     category = QuerySelectField(
         'Category:',
         query_factory=category_query,
+        get_pk=item_pk,
         get_label='name',
         allow_blank=True,
         blank_text='None'
@@ -145,6 +154,10 @@ class SearchEventForm(FlaskForm):
     tags = QuerySelectMultipleField(
         'Tag(s):',
         query_factory=tag_query,
+        get_pk=item_pk,
         get_label='name'
     )
     submit = SubmitField('Search')
+
+    class Meta:
+        csrf = False
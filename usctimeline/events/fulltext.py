@@ -0,0 +1,167 @@
+import re
+from sqlalchemy import cast, column, event, literal_column, table, text
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION
+from usctimeline import db
+from usctimeline.models import Event
+
+# SQLite: FTS5 index over event.title and event.description, stored as an
+# external content table and kept in sync by triggers, so that ORM writes and
+# Core bulk inserts (import.py) are indexed alike.
+SQLITE_CREATE = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS event_fts USING fts5(
+        title, description,
+        content='event', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS event_fts_insert AFTER INSERT ON event
+    BEGIN
+        INSERT INTO event_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS event_fts_delete AFTER DELETE ON event
+    BEGIN
+        INSERT INTO event_fts(event_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS event_fts_update AFTER UPDATE ON event
+    BEGIN
+        INSERT INTO event_fts(event_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO event_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END""",
+]
+SQLITE_REBUILD = ["INSERT INTO event_fts(event_fts) VALUES ('rebuild')"]
+SQLITE_DROP = ["DROP TABLE IF EXISTS event_fts"]
+
+# Postgres: GIN expression index, maintained by Postgres itself on every write.
+POSTGRES_DOCUMENT = (
+    "to_tsvector('english', event.title || ' ' || event.description)"
+)
+POSTGRES_INDEX = 'event_fulltext_idx'
+POSTGRES_INDEXED = "to_tsvector('english', title || ' ' || description)"
+# Run with the event table, which is empty and not yet used by any query
+POSTGRES_CREATE = [
+    f"CREATE INDEX IF NOT EXISTS {POSTGRES_INDEX} ON event USING GIN "
+    f"({POSTGRES_INDEXED})"
+]
+# Run in autocommit mode on a live table: building the index concurrently
+# does not block writes (REINDEX CONCURRENTLY requires Postgres 12)
+POSTGRES_REBUILD = [
+    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {POSTGRES_INDEX} ON event "
+    f"USING GIN ({POSTGRES_INDEXED})",
+    f"REINDEX INDEX CONCURRENTLY {POSTGRES_INDEX}",
+]
+
+# Whether the full-text index exists, per engine URL (see fulltext_available)
+indexed_engines = {}
+
+
+def create_fulltext_index(connection):
+    """Creates the full-text index (and sync triggers) if missing."""
+    statements = {
+        'sqlite': SQLITE_CREATE,
+        'postgresql': POSTGRES_CREATE,
+    }.get(connection.dialect.name, [])
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+def rebuild_fulltext_index(connection):
+    """Creates the full-text index if missing and reindexes every event.
+
+    On Postgres the index is built concurrently, so <connection> must be in
+    autocommit mode.
+
+    Returns:
+        True if the database supports full-text search.
+    """
+    if connection.dialect.name != 'postgresql':
+        create_fulltext_index(connection)
+    statements = {
+        'sqlite': SQLITE_REBUILD,
+        'postgresql': POSTGRES_REBUILD,
+    }.get(connection.dialect.name)
+    if statements is None:
+        return False
+    for statement in statements:
+        connection.execute(text(statement))
+    return True
+
+
+@event.listens_for(Event.__table__, 'after_create')
+def create_index_with_table(target, connection, **kw):
+    create_fulltext_index(connection)
+
+
+@event.listens_for(Event.__table__, 'before_drop')
+def drop_index_with_table(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        for statement in SQLITE_DROP:
+            connection.execute(text(statement))
+
+
+def fulltext_available():
+    """Tests whether the configured database has a full-text index.
+
+    The result is remembered per engine, so the check runs once per process.
+    """
+    engine = db.engine
+    key = str(engine.url)
+    if key not in indexed_engines:
+        if engine.dialect.name == 'sqlite':
+            found = engine.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE name = 'event_fts'"
+            )).scalar()
+        elif engine.dialect.name == 'postgresql':
+            found = engine.execute(text(
+                f"SELECT to_regclass('{POSTGRES_INDEX}')"
+            )).scalar()
+        else:
+            found = None
+        indexed_engines[key] = found is not None
+    return indexed_engines[key]
+
+
+def query_terms(search_text):
+    """Splits user input into plain word terms, dropping any query syntax."""
+    return re.findall(r'\w+', search_text)
+
+
+def match_events(query, search_text):
+    """Restricts a query over Event to full-text matches of <search_text>.
+
+    Every word must match the start of a word in the title or description
+    (e.g. 'refer' matches 'referendum'). Falls back to a title LIKE when the
+    database has no full-text index.
+
+    Args:
+        query: SQLAlchemy query selecting from Event.
+        search_text: Text typed by the user.
+
+    Returns:
+        Tuple of (filtered query, rank expression). Ordering by the rank
+        expression ascending puts the most relevant events first. The rank
+        is None when falling back to LIKE.
+    """
+    terms = query_terms(search_text)
+    if not terms or not fulltext_available():
+        return query.filter(Event.title.like(f'%{search_text}%')), None
+    if db.engine.dialect.name == 'sqlite':
+        fts_query = ' AND '.join(f'"{term}"*' for term in terms)
+        fts = table('event_fts', column('rowid'), column('rank'))
+        matches = db.session.query(
+            fts.c.rowid.label('event_id'),
+            fts.c.rank.label('rank')
+        ).filter(
+            literal_column('event_fts').op('MATCH')(fts_query)
+        ).subquery('fulltext')
+        query = query.join(matches, matches.c.event_id == Event.id)
+        return query, matches.c.rank
+    ts_query = ' & '.join(f'{term}:*' for term in terms)
+    document = literal_column(POSTGRES_DOCUMENT)
+    ts_query = db.func.to_tsquery(literal_column("'english'"), ts_query)
+    query = query.filter(document.op('@@')(ts_query))
+    # ts_rank() returns a real, which would not survive the round trip
+    # through a page cursor as a Python float (see search.py keyset_filter)
+    return query, cast(-db.func.ts_rank(document, ts_query), DOUBLE_PRECISION)
@@ -1,16 +1,77 @@
-import os
 from calendar import month_name
-from flask import Blueprint, flash, request, redirect, render_template, url_for
+from flask import Blueprint, current_app, flash, jsonify, request, redirect, render_template, url_for
 from flask_login import current_user, login_required
-from sqlalchemy import and_
-from usctimeline import db
+from usctimeline import db, search_cache
 from usctimeline.models import Event, Image, Tag
 from usctimeline.utils import save_img_to_file_system, delete_img_from_file_system
+from usctimeline.uploads import upload_image_format
+from usctimeline.images import send_image
 from usctimeline.events.forms import EventForm, SearchEventForm, update_event_form_factory
+from usctimeline.events.rows import all_event_rows
+from usctimeline.events.search import criteria_from_form, search_page
+from usctimeline.events.bitmap import bitmap_index
+from usctimeline.events.suggest import suggest_index
+from usctimeline.versions import ALL, REFERENCE, conditional, event_key, get_versions, make_etag
 
 events = Blueprint('events', __name__)
 
 
+def event_validators(id):
+    """Returns the (ETag, Last-Modified) validators of an event page.
+
+    Args:
+        id: ID of the displayed event.
+    """
+    versions = get_versions(event_key(id), REFERENCE)
+    event_version, event_modified = versions[event_key(id)]
+    reference_version, reference_modified = versions[REFERENCE]
+    etag = make_etag(
+        'event', id, event_version, reference_version, request.referrer
+    )
+    modified = [m for m in (event_modified, reference_modified) if m]
+    return etag, max(modified) if modified else None
+
+
+def search_validators():
+    """Returns the (ETag, Last-Modified) validators of the search page.
+
+    Results depend on every event, so the validators follow the 'all'
+    DataVersion and the query string holding the criteria and cursor.
+    """
+    version, modified = get_versions(ALL)[ALL]
+    return make_etag('search', version, request.full_path), modified
+
+
+def search_url(**changes):
+    """Returns the URL of the current search with some arguments replaced.
+
+    Any change drops the page cursor, unless a new one is given with the
+    `after` argument.
+
+    Args:
+        changes: Query string arguments to set. None removes an argument.
+
+    Returns:
+        A URL for the search_event route.
+    """
+    args = request.args.to_dict(flat=False)
+    args.pop('after', None)
+    for name, value in changes.items():
+        if value is None:
+            args.pop(name, None)
+        else:
+            args[name] = value
+    return url_for('events.search_event', **args)
+
+
+def tags_from_form(form):
+    """Loads the Tag rows selected in an EventForm with a single query."""
+    tag_ids = [tag.id for tag in form.tags.data or []]
+    if not tag_ids:
+        return []
+    return Tag.query.filter(Tag.id.in_(tag_ids)).all()
+
+
 @events.route("/event/new", methods=['GET', 'POST'])
 @login_required
 def new_event():
@@ -28,17 +89,15 @@ def new_event():
             date=form.date.data,
             description=form.description.data,
             external_url=form.external_url.data,
-            category=form.category.data
+            category_id=form.category.data.id
         )
         if form.tags.data:
-            for tag in form.tags.data:
-                event.tags.append(tag)
+            event.tags = tags_from_form(form)
         if form.images.data[0].filename != '':
             for image in form.images.data:
-                filename, file_ext = os.path.splitext(image.filename)
-                if file_ext not in ['.png', '.PNG', '.jpg', '.JPG',
-                                    '.jpeg', '.JPEG', '.svg', '.SVG']:
-                    flash('File does not have an approved extension:'
+                # The format is recognised from the file's first bytes
+                if upload_image_format(image) is None:
+                    flash('File is not an approved image type:'
                           ' jpg, jpeg, png, svg', 'error')
                     return render_template(
                         'events/edit_event.html',
@@ -49,7 +108,11 @@ def new_event():
                     )
                 else:
                     img = save_img_to_file_system(image)
-                    event.images.append(img)
+                    # Images are shared between events; loading img.events
+                    # before changing it keeps the flush listeners from
+                    # loading it mid-flush
+                    if event not in img.events:
+                        img.events.append(event)
         db.session.add(event)
         db.session.commit()
         flash('Event has been created!', 'success')
@@ -68,10 +131,12 @@ def new_event():
 def manage_events():
     """Route for managing all existing events.
 
+    Events are listed as EventRow (see rows.py), loaded in two queries.
+
     Returns:
         A rendered HTML template for this route.
     """
-    events = Event.query.all()
+    events = all_event_rows()
     return render_template(
         'events/manage_events.html',
         title='Manage Events',
@@ -80,6 +145,7 @@ def manage_events():
 
 
 @events.route("/event/<int:id>")
+@conditional(event_validators, vary=('Referer',))
 def event(id):
     """Route for displaying a single event.
 
@@ -118,21 +184,22 @@ def update_event(id):
         Otherwise, a rendered HTML template for this route is returned.
     """
     event = Event.query.get_or_404(id)
-    UpdateEventForm = update_event_form_factory(event.category.name, event.id)
+    UpdateEventForm = update_event_form_factory(
+        event.category_id, [tag.id for tag in event.tags]
+    )
     form = UpdateEventForm()
     if form.validate_on_submit():
         event.title = form.title.data
         event.date = form.date.data
         event.description = form.description.data
         event.external_url = form.external_url.data
-        event.category = form.category.data
-        event.tags = form.tags.data
+        event.category_id = form.category.data.id
+        event.tags = tags_from_form(form)
         if form.images.data[0].filename != '':
             for image in form.images.data:
-                filename, file_ext = os.path.splitext(image.filename)
-                if file_ext not in ['.png', '.PNG', '.jpg', '.JPG',
-                                    '.jpeg', '.JPEG', '.svg', '.SVG']:
-                    flash('File does not have an approved extension:'
+                # The format is recognised from the file's first bytes
+                if upload_image_format(image) is None:
+                    flash('File is not an approved image type:'
                           ' jpg, jpeg, png, svg', 'error')
                     return render_template(
                         'events/edit_event.html',
@@ -143,7 +210,11 @@ def update_event(id):
                     )
                 else:
                     img = save_img_to_file_system(image)
-                    event.images.append(img)
+                    # Images are shared between events; loading img.events
+                    # before changing it keeps the flush listeners from
+                    # loading it mid-flush
+                    if event not in img.events:
+                        img.events.append(event)
         db.session.commit()
         flash('Event has been updated!', 'success')
         return redirect(url_for('events.event', id=event.id))
@@ -163,11 +234,29 @@ def update_event(id):
     )
 
 
+@events.route('/images/event/<path:filename>')
+def event_image(filename):
+    """Route for serving an event image or one of its variants.
+
+    Args:
+        filename: Filename of the image (see images.py send_image()).
+
+    Returns:
+        The image, a partial or 304 response, or a response naming the
+        file for the front proxy to send.
+        Otherwise, a 404 page.
+    """
+    return send_image(filename)
+
+
 @events.route('/event/<int:event_id>/image/<int:image_id>/delete/')
 @login_required
 def delete_event_image(event_id, image_id):
     """Route for removing an image from an event.
 
+    Images are shared by the events showing the same picture, so the image
+    itself is only deleted once no event shows it.
+
     Args:
         event_id: Event ID
         image_id: ID of the image to be removed
@@ -177,9 +266,13 @@ def delete_event_image(event_id, image_id):
         an event with <event_id> and an image with <image_id> exists.
         Otherwise, a 404 page.
     """
+    event = Event.query.get_or_404(event_id)
     image = Image.query.get_or_404(image_id)
-    delete_img_from_file_system(image)
-    db.session.delete(image)
+    if event in image.events:
+        image.events.remove(event)
+    if not image.events:
+        delete_img_from_file_system(image)
+        db.session.delete(image)
     db.session.commit()
     flash('Image has been removed.', 'success')
     return redirect(url_for('events.update_event', id=event_id))
@@ -249,69 +342,103 @@ def delete_event_confirmation(id):
     )
 
 
-@events.route("/event/search", methods=['GET', 'POST'])
+@events.route("/event/search")
+@conditional(search_validators)
 def search_event():
     """Route for searching event(s).
 
+    Results are paginated with the `after` cursor of the previous page and
+    come with per-category, per-tag and per-year counts of every match.
+
     Returns:
-        A rendered HTML template for this route with all events matching the
-        criteria provided in the SearchEventForm (if any exist).
+        A rendered HTML template for this route with a page of the events
+        matching the criteria provided in the SearchEventForm (if any exist).
     """
-    form = SearchEventForm()
-    events = []
-    if form.validate_on_submit():
-        title = form.title.data
-        exact_date = form.exact_date.data
-        from_date = form.from_date.data
-        to_date = form.to_date.data
-        category = form.category.data
-        tags = form.tags.data
-        all_events = Event.query.all()
-        event_ids = set()
-        for event in all_events:
-            event_ids.add(event.id)
-        if title:
-            title_ids = set()
-            result = Event.query.filter(Event.title.like(f'%{title}%')).all()
-            for event in result:
-                title_ids.add(event.id)
-            event_ids = event_ids.intersection(title_ids)
-        if exact_date:
-            date_ids = set()
-            result = Event.query.filter(Event.date == exact_date)
-            for event in result:
-                date_ids.add(event.id)
-            event_ids = event_ids.intersection(date_ids)
-        if from_date and to_date:
-            date_ids = set()
-            result = Event.query.filter(and_(
-                from_date <= Event.date, Event.date <= to_date)
-            ).all()
-            for event in result:
-                date_ids.add(event.id)
-            event_ids = event_ids.intersection(date_ids)
-        if category:
-            category_ids = set()
-            result = Event.query.filter_by(category=category).all()
-            for event in result:
-                category_ids.add(event.id)
-            event_ids = event_ids.intersection(category_ids)
-        if tags:
-            for tag in tags:
-                tag_ids = set()
-                result = Tag.query.filter_by(name=tag.name).first()
-                for event in result.events:
-                    tag_ids.add(event.id)
-                event_ids = event_ids.intersection(tag_ids)
-        for id in event_ids:
-            event = Event.query.get(id)
-            events.append(event)
-        if len(events) == 0:
+    form = SearchEventForm(request.args)
+    criteria = None
+    page = None
+    if request.args and form.validate():
+        criteria = criteria_from_form(form)
+        page = search_page(
+            criteria,
+            cursor=request.args.get('after'),
+            page_size=current_app.config['SEARCH_PAGE_SIZE']
+        )
+        if page.total == 0:
             flash('No events found.', 'error')
     return render_template(
         'events/search_event.html',
         title='Search Event',
         form=form,
-        events=events,
+        criteria=criteria,
+        page=page,
+        search_url=search_url,
         month_name=month_name
     )
+
+
+@events.route("/event/suggest")
+def suggest():
+    """Route suggesting event titles and tags as the user types.
+
+    Answered from the in-process prefix index (see suggest.py) without
+    querying the database. The number of suggestions is capped by the
+    SUGGEST_LIMIT config; a smaller `limit` argument may be requested.
+
+    Returns:
+        A JSON object with the events and tags having a word starting with
+        the `q` argument.
+    """
+    max_limit = current_app.config['SUGGEST_LIMIT']
+    limit = min(request.args.get('limit', max_limit, type=int), max_limit)
+    suggest_index.ensure_loaded(current_app.config['SUGGEST_INDEX_MAX_AGE'])
+    matching_events, matching_tags = suggest_index.suggest(
+        request.args.get('q', ''), max(limit, 0)
+    )
+    return jsonify({
+        'events': [
+            {
+                'id': event_id,
+                'title': title,
+                'url': url_for('events.event', id=event_id),
+            }
+            for event_id, title in matching_events
+        ],
+        'tags': [
+            {'id': tag_id, 'name': name} for tag_id, name in matching_tags
+        ],
+    })
+
+
+@events.route("/event/suggest/index/stats")
+@login_required
+def suggest_index_stats():
+    """Route exposing the size of the suggestion index to logged-in admins.
+
+    Returns:
+        A JSON object with the item and entry counts of the index.
+    """
+    return jsonify(suggest_index.stats())
+
+
+@events.route("/event/search/index/stats")
+@login_required
+def search_index_stats():
+    """Route exposing the size of the in-process search index to admins.
+
+    Returns:
+        A JSON object with the entry counts and memory usage of the index.
+    """
+    return jsonify(bitmap_index.stats())
+
+
+@events.route("/event/search/cache/stats")
+@login_required
+def search_cache_stats():
+    """Route exposing the search result cache counters to logged-in admins.
+
+    Returns:
+        A JSON object with the hit rate, entry count and memory usage of the
+        search result cache.
+    """
+    return jsonify(search_cache.stats())
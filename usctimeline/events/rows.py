@@ -0,0 +1,112 @@
+from collections import namedtuple
+from sqlalchemy import func, literal
+from usctimeline import db
+from usctimeline.models import Event, event_tags
+from usctimeline.reference import reference_cache
+
+# Maximum number of ids bound into a single IN clause when loading rows
+ROW_CHUNK_SIZE = 500
+
+# Number of description characters selected for result excerpts
+SUMMARY_LENGTH = 200
+
+# Lightweight row holding only the columns event lists display. summary is
+# the start of the description (or None if not selected) and tag_names a
+# tuple of the names of the event's tags.
+EventRow = namedtuple(
+    'EventRow',
+    ['id', 'title', 'date', 'category_id', 'summary', 'tag_names']
+)
+
+
+def event_row_query(summary=False):
+    """Returns a query selecting the columns of EventRow but tag_names.
+
+    Args:
+        summary: If True, the first SUMMARY_LENGTH characters of the
+            description are selected, otherwise None.
+
+    Returns:
+        A SQLAlchemy query yielding (id, title, date, category_id, summary)
+        rows, which can be filtered like a query over Event.
+    """
+    if summary:
+        summary_column = func.substr(Event.description, 1, SUMMARY_LENGTH)
+    else:
+        summary_column = literal(None)
+    return db.session.query(
+        Event.id,
+        Event.title,
+        Event.date,
+        Event.category_id,
+        summary_column.label('summary')
+    )
+
+
+def tag_names_by_event(event_ids=None):
+    """Returns the tag names of events, read from the association table.
+
+    Tag names come from the reference data cache, so only (event_id, tag_id)
+    pairs are selected.
+
+    Args:
+        event_ids: List of Event ids, or None for every event.
+
+    Returns:
+        Dictionary mapping event ids to tuples of tag names. Events without
+        tags are missing.
+    """
+    reference = reference_cache.get()
+    query = db.session.query(event_tags.c.event_id, event_tags.c.tag_id)
+    if event_ids is None:
+        chunks = [query]
+    else:
+        chunks = [
+            query.filter(event_tags.c.event_id.in_(
+                event_ids[start:start + ROW_CHUNK_SIZE]
+            ))
+            for start in range(0, len(event_ids), ROW_CHUNK_SIZE)
+        ]
+    names = {}
+    for chunk in chunks:
+        for event_id, tag_id in chunk.order_by(
+            event_tags.c.event_id, event_tags.c.tag_id
+        ):
+            tag = reference.tag(tag_id)
+            if tag is not None:
+                names.setdefault(event_id, []).append(tag.name)
+    return {event_id: tuple(tags) for event_id, tags in names.items()}
+
+
+def make_rows(rows, tag_names):
+    """Builds EventRow from (id, title, date, category_id, summary) rows."""
+    return [
+        EventRow(event_id, title, day, category_id, summary,
+                 tag_names.get(event_id, ()))
+        for event_id, title, day, category_id, summary in rows
+    ]
+
+
+def all_event_rows():
+    """Returns an EventRow for every event, ordered by id, in two queries."""
+    rows = event_row_query().order_by(Event.id).all()
+    return make_rows(rows, tag_names_by_event())
+
+
+def event_rows(event_ids, summary=True):
+    """Loads the EventRow of events by id.
+
+    Args:
+        event_ids: List of Event ids.
+        summary: Whether to select the description excerpt.
+
+    Returns:
+        List of EventRow in the same order as <event_ids>.
+    """
+    rows = {}
+    for start in range(0, len(event_ids), ROW_CHUNK_SIZE):
+        chunk = event_ids[start:start + ROW_CHUNK_SIZE]
+        for row in event_row_query(summary).filter(Event.id.in_(chunk)):
+            rows[row[0]] = row
+    found = [rows[event_id] for event_id in event_ids if event_id in rows]
+    return make_rows(found, tag_names_by_event([row[0] for row in found]))
@@ -0,0 +1,485 @@
+import json
+from array import array
+from collections import namedtuple
+from datetime import date
+from flask import current_app
+from sqlalchemy import (Integer, String, and_, cast, event, extract, func,
+                        literal, null, or_, select, union_all)
+from usctimeline import db, facet_cache, search_cache
+from usctimeline.models import Category, Event, Tag, event_tags
+from usctimeline.events.fulltext import match_events
+from usctimeline.events.bitmap import bitmap_index
+from usctimeline.events.rows import event_row_query, event_rows, make_rows, tag_names_by_event
+from usctimeline.reference import reference_cache
+from usctimeline.versions import ALL, get_versions
+
+# Search criteria extracted from a SearchEventForm. Unused criteria are None,
+# except tag_ids which is an empty tuple when no tag is selected.
+SearchCriteria = namedtuple(
+    'SearchCriteria',
+    ['title', 'exact_date', 'from_date', 'to_date', 'category_id', 'tag_ids']
+)
+
+# One page of search results, with the size and facets of the whole result.
+# events is a list of EventRow (see rows.py); next_cursor is None on the
+# last page.
+SearchPage = namedtuple(
+    'SearchPage',
+    ['events', 'total', 'next_cursor', 'facets']
+)
+
+# Matching event counts per category, tag and year, as lists of FacetCount
+Facets = namedtuple('Facets', ['categories', 'tags', 'years'])
+FacetCount = namedtuple('FacetCount', ['id', 'name', 'count'])
+
+# Entry of search_cache: the ordered ids of every matching event, as an
+# array('q'), their sort keys (date ordinals as an array('l') and, for
+# title searches, ranks as an array('d'), otherwise None) and the Facets of
+# the whole result
+CachedSearch = namedtuple(
+    'CachedSearch',
+    ['event_ids', 'days', 'ranks', 'facets']
+)
+
+
+def criteria_from_form(form):
+    """Extracts the search criteria from a submitted SearchEventForm.
+
+    Args:
+        form: Validated instance of SearchEventForm.
+
+    Returns:
+        An instance of SearchCriteria.
+    """
+    return SearchCriteria(
+        title=form.title.data or None,
+        exact_date=form.exact_date.data,
+        from_date=form.from_date.data,
+        to_date=form.to_date.data,
+        category_id=form.category.data.id if form.category.data else None,
+        tag_ids=tuple(sorted(tag.id for tag in form.tags.data or []))
+    )
+
+
+def tag_match_query(tag_ids):
+    """Returns a query selecting ids of events tagged with all of <tag_ids>.
+
+    Args:
+        tag_ids: Non-empty sequence of Tag ids.
+    """
+    return db.session.query(event_tags.c.event_id).filter(
+        event_tags.c.tag_id.in_(tag_ids)
+    ).group_by(
+        event_tags.c.event_id
+    ).having(
+        func.count(func.distinct(event_tags.c.tag_id)) == len(set(tag_ids))
+    )
+
+
+def filter_events(query, criteria):
+    """Applies the search criteria to a query over Event.
+
+    The title criterion is a full-text search over event titles and
+    descriptions (see fulltext.py). A date range is only applied when both
+    from_date and to_date are given. All criteria must match (AND),
+    including every selected tag.
+
+    Args:
+        query: SQLAlchemy query selecting from Event.
+        criteria: An instance of SearchCriteria.
+
+    Returns:
+        Tuple of (filtered query, relevance rank expression or None).
+    """
+    rank = None
+    if criteria.title:
+        query, rank = match_events(query, criteria.title)
+    if criteria.exact_date:
+        query = query.filter(Event.date == criteria.exact_date)
+    if criteria.from_date and criteria.to_date:
+        query = query.filter(and_(
+            criteria.from_date <= Event.date, Event.date <= criteria.to_date
+        ))
+    if criteria.category_id:
+        query = query.filter(Event.category_id == criteria.category_id)
+    if criteria.tag_ids:
+        query = query.filter(Event.id.in_(tag_match_query(criteria.tag_ids)))
+    return query, rank
+
+
+def encode_cursor(values):
+    """Returns the query string cursor of a page's last sort key <values>."""
+    return '_'.join(str(value) for value in values)
+
+
+def decode_cursor(cursor, ranked):
+    """Parses a cursor produced by encode_cursor().
+
+    Args:
+        cursor: Cursor taken from the query string, or None.
+        ranked: Whether results are ordered by relevance rank first.
+
+    Returns:
+        Tuple of sort key values ([rank,] date, id), or None if <cursor> is
+        missing or malformed.
+    """
+    if not cursor:
+        return None
+    parts = cursor.split('_')
+    try:
+        if ranked:
+            rank, day, event_id = parts
+            return float(rank), date.fromisoformat(day), int(event_id)
+        day, event_id = parts
+        return date.fromisoformat(day), int(event_id)
+    except ValueError:
+        return None
+
+
+def keyset_filter(columns, values):
+    """Returns a condition selecting rows sorted after <values>.
+
+    Compares (columns) > (values) lexicographically, spelled out with
+    AND/OR so it works on every database.
+    """
+    condition = columns[-1] > values[-1]
+    for column, value in zip(reversed(columns[:-1]), reversed(values[:-1])):
+        condition = or_(column > value, and_(column == value, condition))
+    return condition
+
+
+def facet_counts(criteria):
+    """Counts the events matching <criteria> per category, tag and year.
+
+    All three groupings are computed by a single statement over a common
+    table expression of the matching events.
+
+    Args:
+        criteria: An instance of SearchCriteria.
+
+    Returns:
+        An instance of Facets.
+    """
+    matches, _ = filter_events(
+        db.session.query(
+            Event.id.label('id'),
+            Event.date.label('date'),
+            Event.category_id.label('category_id')
+        ),
+        criteria
+    )
+    matches = matches.cte('matches')
+    year = cast(extract('year', matches.c.date), Integer)
+    statement = union_all(
+        select([
+            literal('category').label('kind'),
+            Category.id.label('key'),
+            Category.name.label('name'),
+            func.count().label('count'),
+        ]).select_from(
+            matches.join(Category, Category.id == matches.c.category_id)
+        ).group_by(Category.id, Category.name),
+        select([
+            literal('tag'), Tag.id, Tag.name, func.count()
+        ]).select_from(
+            matches.join(event_tags, event_tags.c.event_id == matches.c.id)
+            .join(Tag, Tag.id == event_tags.c.tag_id)
+        ).group_by(Tag.id, Tag.name),
+        select([
+            literal('year'), year, cast(null(), String), func.count()
+        ]).select_from(matches).group_by(year),
+    )
+    groups = {'category': [], 'tag': [], 'year': []}
+    for kind, key, name, count in db.session.execute(statement):
+        groups[kind].append(FacetCount(key, name, count))
+    return sorted_facets(groups['category'], groups['tag'], groups['year'])
+
+
+def cached_facet_counts(criteria):
+    """Returns facet_counts(<criteria>), cached in facet_cache.
+
+    Entries are keyed on the canonical criteria (see search_cache_key) and
+    the DataVersion 'all' counter, so the facets of a result are counted
+    once for all of its pages, and the next page after any write counts
+    them again.
+    """
+    version = get_versions(ALL)[ALL][0]
+    key = f'{search_cache_key(criteria)}:{version}'
+    facets = facet_cache.get(key)
+    if facets is None:
+        facets = facet_counts(criteria)
+        facet_cache.set(key, facets)
+    return facets
+
+
+def sorted_facets(categories, tags, years):
+    """Returns an instance of Facets with its lists in display order.
+
+    Categories and tags are ordered by decreasing count, then name; years
+    in ascending order.
+    """
+    def by_count(facet):
+        return -facet.count, facet.name
+
+    return Facets(
+        categories=sorted(categories, key=by_count),
+        tags=sorted(tags, key=by_count),
+        years=sorted(years)
+    )
+
+
+def bitmap_facets(bitmap):
+    """Returns the Facets of a bitmap index match, named from reference data."""
+    category_counts, tag_counts, year_counts = bitmap_index.facets(bitmap)
+    reference = reference_cache.get()
+    categories = [
+        FacetCount(category_id, reference.category(category_id).name, count)
+        for category_id, count in category_counts.items()
+        if reference.category(category_id)
+    ]
+    tags = [
+        FacetCount(tag_id, reference.tag(tag_id).name, count)
+        for tag_id, count in tag_counts.items()
+        if reference.tag(tag_id)
+    ]
+    years = [
+        FacetCount(year, None, count) for year, count in year_counts.items()
+    ]
+    return sorted_facets(categories, tags, years)
+
+
+def bitmap_search_page(criteria, cursor, page_size):
+    """Returns a SearchPage answered by the in-process bitmap index.
+
+    Only the rows of the requested page are loaded from the database.
+    """
+    bitmap = bitmap_index.match(criteria)
+    after = decode_cursor(cursor, ranked=False)
+    event_ids = bitmap_index.page(bitmap, after, page_size + 1)
+    events = event_rows(event_ids[:page_size])
+    next_cursor = None
+    if len(event_ids) > page_size and events:
+        next_cursor = encode_cursor((events[-1].date, events[-1].id))
+    facets = bitmap_facets(bitmap)
+    return SearchPage(
+        events=events,
+        total=sum(facet.count for facet in facets.categories),
+        next_cursor=next_cursor,
+        facets=facets
+    )
+
+
+def search_cache_key(criteria):
+    """Returns the search_cache key of the canonical form of <criteria>.
+
+    Searches returning the same events share a key: the title is lowercased
+    with its whitespace collapsed, a date range missing one of its bounds is
+    dropped (see filter_events) and tag ids are sorted and deduplicated.
+    """
+    title = ' '.join(criteria.title.lower().split()) if criteria.title else None
+    has_range = bool(criteria.from_date and criteria.to_date)
+    canonical = [
+        title or None,
+        criteria.exact_date.isoformat() if criteria.exact_date else None,
+        criteria.from_date.isoformat() if has_range else None,
+        criteria.to_date.isoformat() if has_range else None,
+        criteria.category_id or None,
+        sorted(set(criteria.tag_ids)),
+    ]
+    return 'search:' + json.dumps(canonical, separators=(',', ':'))
+
+
+def run_search(criteria):
+    """Runs a search without paging and returns a CachedSearch.
+
+    Only event ids and sort keys are selected, in the order of
+    keyset_search_page().
+    """
+    if current_app.config.get('SEARCH_BITMAP_INDEX') and not criteria.title:
+        bitmap = bitmap_index.match(criteria)
+        keys = bitmap_index.sort_keys(bitmap)
+        return CachedSearch(
+            array('q', (event_id for _, event_id in keys)),
+            array('l', (ordinal for ordinal, _ in keys)),
+            None,
+            bitmap_facets(bitmap)
+        )
+    query, rank = filter_events(db.session.query(Event.id, Event.date), criteria)
+    if rank is not None:
+        query = query.add_columns(rank).order_by(rank)
+    query = query.order_by(Event.date.asc(), Event.id.asc())
+    event_ids = array('q')
+    days = array('l')
+    ranks = array('d') if rank is not None else None
+    for row in query:
+        event_ids.append(row[0])
+        days.append(row[1].toordinal())
+        if ranks is not None:
+            ranks.append(row[2])
+    return CachedSearch(event_ids, days, ranks, facet_counts(criteria))
+
+
+def cached_sort_key(result, position):
+    """Returns the sort key of the event at <position> in a CachedSearch.
+
+    Dates are returned as ordinals, e.g. (rank, ordinal, id).
+    """
+    key = (result.days[position], result.event_ids[position])
+    if result.ranks is not None:
+        key = (result.ranks[position],) + key
+    return key
+
+
+def cached_position(result, after):
+    """Locates a decoded cursor in the cached ids of a search.
+
+    Args:
+        result: An instance of CachedSearch.
+        after: Sort key of the previous page's last event (see
+            decode_cursor()).
+
+    Returns:
+        Position of the first event sorted after <after>, or None if the
+        event of <after> is not part of <result>.
+    """
+    target = after[:-2] + (after[-2].toordinal(), after[-1])
+    low, high = 0, len(result.event_ids)
+    while low < high:
+        middle = (low + high) // 2
+        if cached_sort_key(result, middle) <= target:
+            low = middle + 1
+        else:
+            high = middle
+    if low == 0 or cached_sort_key(result, low - 1) != target:
+        return None
+    return low
+
+
+def cached_search_page(criteria, cursor, page_size):
+    """Returns a SearchPage sliced from the cached ids of the whole result.
+
+    On a miss the search runs once without paging and its ids, sort keys and
+    facets are stored in search_cache; every page of the same search is then
+    served by loading only its own rows. Cursors are the same as those of
+    keyset_search_page() and are located by binary search over the cached
+    sort keys. A cursor whose event is not in the cached result (e.g. one
+    written since) is served by keyset_search_page() instead.
+    """
+    key = search_cache_key(criteria)
+    result = search_cache.get(key)
+    if result is None:
+        result = run_search(criteria)
+        search_cache.set(key, result)
+    start = 0
+    after = decode_cursor(cursor, ranked=result.ranks is not None)
+    if after is not None:
+        start = cached_position(result, after)
+        if start is None:
+            return keyset_search_page(criteria, cursor, page_size)
+    end = min(start + page_size, len(result.event_ids))
+    next_cursor = None
+    if end < len(result.event_ids) and end > start:
+        values = cached_sort_key(result, end - 1)
+        values = values[:-2] + (date.fromordinal(values[-2]), values[-1])
+        next_cursor = encode_cursor(values)
+    return SearchPage(
+        events=event_rows(list(result.event_ids[start:end])),
+        total=len(result.event_ids),
+        next_cursor=next_cursor,
+        facets=result.facets
+    )
+
+
+def keyset_search_page(criteria, cursor, page_size):
+    """Returns a SearchPage selected with keyset pagination.
+
+    The cursor holds the sort key of the previous page's last event, so
+    every page costs O(page size) however deep it is, apart from the facets
+    and total, which are counted once per result (see
+    cached_facet_counts()). Searches without a title are answered by the
+    bitmap index when SEARCH_BITMAP_INDEX is enabled (see
+    bitmap_search_page()).
+    """
+    if current_app.config.get('SEARCH_BITMAP_INDEX') and not criteria.title:
+        return bitmap_search_page(criteria, cursor, page_size)
+    query, rank = filter_events(event_row_query(summary=True), criteria)
+    columns = [Event.date, Event.id]
+    if rank is not None:
+        columns.insert(0, rank)
+        query = query.add_columns(rank)
+    after = decode_cursor(cursor, ranked=rank is not None)
+    if after is not None:
+        query = query.filter(keyset_filter(columns, after))
+    rows = query.order_by(*columns).limit(page_size + 1).all()
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        values = (last.date, last.id)
+        if rank is not None:
+            values = (last[-1],) + values
+        next_cursor = encode_cursor(values)
+    rows = [row[:5] for row in rows]
+    events = make_rows(rows, tag_names_by_event([row[0] for row in rows]))
+    facets = cached_facet_counts(criteria)
+    return SearchPage(
+        events=events,
+        total=sum(facet.count for facet in facets.categories),
+        next_cursor=next_cursor,
+        facets=facets
+    )
+
+
+def search_page(criteria, cursor=None, page_size=25):
+    """Returns one page of the events matching the search criteria.
+
+    Pages are selected with keyset pagination: the cursor holds the sort key
+    of the previous page's last event, so every page costs O(page size)
+    however deep it is. Matching events are ordered by relevance when
+    searching text, otherwise by date.
+
+    Only the columns displayed in the result list are selected (see
+    rows.py). When search_cache is enabled, the ids of the whole result are
+    cached instead (see cached_search_page()).
+
+    Args:
+        criteria: An instance of SearchCriteria.
+        cursor: next_cursor of the previous page, or None for the first page.
+        page_size: Maximum number of events per page.
+
+    Returns:
+        An instance of SearchPage.
+    """
+    if search_cache.enabled:
+        return cached_search_page(criteria, cursor, page_size)
+    return keyset_search_page(criteria, cursor, page_size)
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_search_changes(session, flush_context):
+    """Marks the transaction as changing search results.
+
+    Inserting, updating or deleting an Event, Tag or Category can change the
+    matches or facets of any search.
+    """
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Event, Tag, Category)):
+            session.info['search_changed'] = True
+            return
+
+
+@event.listens_for(db.session, 'after_commit')
+def clear_search_cache(session):
+    """Empties search_cache once a transaction changing results commits.
+
+    Writes committed by other processes are only picked up when the cached
+    entries expire (SEARCH_CACHE_TTL).
+    """
+    if session.info.pop('search_changed', False):
+        search_cache.clear()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_search_changes(session):
+    """Forgets the search changes of a transaction that was rolled back."""
+    session.info.pop('search_changed', None)
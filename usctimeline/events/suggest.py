@@ -0,0 +1,337 @@
+import re
+import time
+import threading
+from bisect import bisect_left, insort
+from flask import current_app
+from sqlalchemy import event
+from usctimeline import db
+from usctimeline.models import Event, Tag
+
+# Number of characters of each suffix kept as a sort key. Longer prefixes are
+# matched against the full normalized text.
+KEY_LENGTH = 24
+
+# Words which do not start a suffix of their own, to keep the index small.
+# They still match when typed after the previous word (e.g. 'war of').
+STOPWORDS = frozenset([
+    'a', 'an', 'and', 'at', 'by', 'for', 'in', 'of', 'on', 'or', 'the', 'to'
+])
+
+
+def normalize(text):
+    """Returns <text> lowercased, with punctuation and extra spaces removed."""
+    return ' '.join(re.findall(r'\w+', text.casefold()))
+
+
+def word_starts(normalized):
+    """Returns the positions at which the words of a normalized text start."""
+    return [match.start() for match in re.finditer(r'\w+', normalized)]
+
+
+class PrefixIndex:
+    """Sorted array of text suffixes answering prefix lookups by bisection.
+
+    Every indexed text is normalized, then one entry is kept per word it
+    contains (except stopwords), holding the text from that word onwards, so
+    that 'refer' and 'quebec refer' both find 'Quebec Referendum'.
+
+    Attributes:
+        entries:
+            List of (suffix key, id) tuples sorted ascending.
+        texts:
+            Dictionary mapping ids to (original text, normalized text).
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """Removes every entry."""
+        with self.lock:
+            self.entries = []
+            self.texts = {}
+
+    @staticmethod
+    def suffix_keys(normalized):
+        """Returns the sort keys of the suffixes of a normalized text."""
+        keys = set()
+        for start in word_starts(normalized):
+            word = normalized[start:].split(' ', 1)[0]
+            if start == 0 or word not in STOPWORDS:
+                keys.add(normalized[start:start + KEY_LENGTH])
+        return keys
+
+    def load(self, items):
+        """Replaces the content of the index with <items>.
+
+        Args:
+            items: Iterable of (id, text) tuples.
+        """
+        texts = {}
+        entries = []
+        for item_id, text in items:
+            normalized = normalize(text)
+            texts[item_id] = (text, normalized)
+            entries.extend((key, item_id) for key in self.suffix_keys(normalized))
+        entries.sort()
+        with self.lock:
+            self.entries = entries
+            self.texts = texts
+
+    def add(self, item_id, text):
+        """Adds or replaces the text of <item_id>."""
+        with self.lock:
+            self.remove(item_id)
+            normalized = normalize(text)
+            self.texts[item_id] = (text, normalized)
+            for key in self.suffix_keys(normalized):
+                insort(self.entries, (key, item_id))
+
+    def remove(self, item_id):
+        """Removes the text of <item_id>, if present."""
+        with self.lock:
+            texts = self.texts.pop(item_id, None)
+            if texts is None:
+                return
+            for key in self.suffix_keys(texts[1]):
+                position = bisect_left(self.entries, (key, item_id))
+                if self.entries[position:position + 1] == [(key, item_id)]:
+                    del self.entries[position]
+
+    def lookup(self, prefix, limit):
+        """Returns the items having a suffix starting with <prefix>.
+
+        Only entries sharing the prefix are visited, so the cost is
+        O(log n + limit) for prefixes up to KEY_LENGTH characters.
+
+        Args:
+            prefix: Normalized prefix (see normalize()).
+            limit: Maximum number of items returned.
+
+        Returns:
+            List of (id, text) tuples ordered by the matching suffix.
+        """
+        if not prefix:
+            return []
+        key_prefix = prefix[:KEY_LENGTH]
+        long_prefix = len(prefix) > KEY_LENGTH
+        results = []
+        seen = set()
+        with self.lock:
+            position = bisect_left(self.entries, (key_prefix,))
+            while position < len(self.entries) and len(results) < limit:
+                key, item_id = self.entries[position]
+                position += 1
+                if not key.startswith(key_prefix):
+                    break
+                if item_id in seen:
+                    continue
+                text, normalized = self.texts[item_id]
+                if long_prefix and not any(
+                    normalized.startswith(prefix, start)
+                    for start in word_starts(normalized)
+                ):
+                    continue
+                seen.add(item_id)
+                results.append((item_id, text))
+        return results
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def apply_changes(events, tags, changes):
+    """Applies committed changes to a pair of PrefixIndex.
+
+    Args:
+        events: PrefixIndex of event titles.
+        tags: PrefixIndex of tag names.
+        changes: List of ('event' or 'tag', id, text) tuples, where a text of
+            None removes the item.
+    """
+    for kind, item_id, text in changes:
+        index = events if kind == 'event' else tags
+        if text is None:
+            index.remove(item_id)
+        else:
+            index.add(item_id, text)
+
+
+class SuggestIndex:
+    """In-process prefix indexes of event titles and tag names.
+
+    The indexes are loaded from the database on first use and then kept up
+    to date by this process' own commits (see the session listeners below),
+    so lookups never query the database. Writes committed by other processes
+    are picked up when the indexes are rebuilt every <max_age> seconds. The
+    rebuild runs in a background thread, and lookups are answered by the
+    previous indexes until the new ones are swapped in.
+
+    Attributes:
+        generation:
+            Incremented whenever the indexes are cleared or replaced, so
+            that a rebuild started before is discarded.
+        refresh_thread:
+            Thread of the running or latest rebuild, or None.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.events = PrefixIndex()
+        self.tags = PrefixIndex()
+        self.loaded_at = None
+        self.generation = 0
+        self.refresh_thread = None
+        # Changes committed while a rebuild runs, replayed onto its result
+        self.replay = None
+
+    def clear(self):
+        """Empties the indexes and marks them for reloading."""
+        with self.lock:
+            self.events = PrefixIndex()
+            self.tags = PrefixIndex()
+            self.loaded_at = None
+            self.generation += 1
+
+    @staticmethod
+    def read():
+        """Reads every event title and tag name with two queries.
+
+        Returns:
+            Tuple of two new PrefixIndex: (events, tags).
+        """
+        events = PrefixIndex()
+        events.load(db.session.query(Event.id, Event.title))
+        tags = PrefixIndex()
+        tags.load(db.session.query(Tag.id, Tag.name))
+        return events, tags
+
+    def load(self):
+        """Loads the indexes from the database in the calling thread."""
+        with self.lock:
+            self.events, self.tags = self.read()
+            self.loaded_at = time.monotonic()
+            self.generation += 1
+
+    def ensure_loaded(self, max_age=None):
+        """Loads the indexes if empty, or rebuilds them if older than <max_age>.
+
+        Only the first load runs in the calling thread; rebuilds run in the
+        background (see refresh()).
+        """
+        with self.lock:
+            if self.loaded_at is None:
+                self.load()
+                return
+            stale = max_age and time.monotonic() - self.loaded_at > max_age
+        if stale:
+            self.refresh(current_app._get_current_object())
+
+    def refresh(self, app):
+        """Starts rebuilding the indexes in a background thread, unless running.
+
+        Args:
+            app: Flask app whose database the indexes are read from.
+        """
+        with self.lock:
+            if self.replay is not None:
+                return
+            self.replay = []
+            self.refresh_thread = threading.Thread(
+                target=self.rebuild, args=(app, self.generation), daemon=True
+            )
+            self.refresh_thread.start()
+
+    def rebuild(self, app, generation):
+        """Reads new indexes and swaps them in (see refresh()).
+
+        Changes committed by this process while the indexes were read are
+        applied to them first. The result is discarded if the indexes were
+        cleared or replaced meanwhile.
+        """
+        try:
+            with app.app_context():
+                try:
+                    events, tags = self.read()
+                finally:
+                    db.session.remove()
+            with self.lock:
+                if generation == self.generation:
+                    apply_changes(events, tags, self.replay)
+                    self.events, self.tags = events, tags
+                    self.loaded_at = time.monotonic()
+                    self.generation += 1
+        except Exception as e:
+            app.logger.warning(f'Rebuilding the suggest index failed: {e}')
+        finally:
+            with self.lock:
+                self.replay = None
+
+    def apply(self, changes):
+        """Applies the changes of a committed transaction to the indexes."""
+        with self.lock:
+            if self.loaded_at is None:
+                return
+            apply_changes(self.events, self.tags, changes)
+            if self.replay is not None:
+                self.replay.extend(changes)
+
+    def suggest(self, text, limit):
+        """Returns the events and tags whose text has a word starting with <text>.
+
+        Args:
+            text: Text typed by the user.
+            limit: Maximum number of events, and of tags, returned.
+
+        Returns:
+            Tuple of two lists of (id, text) tuples: (events, tags).
+        """
+        prefix = normalize(text)
+        with self.lock:
+            events, tags = self.events, self.tags
+        return events.lookup(prefix, limit), tags.lookup(prefix, limit)
+
+    def stats(self):
+        """Returns a dictionary describing the size of the indexes."""
+        with self.lock:
+            return {
+                'events': len(self.events.texts),
+                'event_entries': len(self.events),
+                'tags': len(self.tags.texts),
+                'tag_entries': len(self.tags),
+                'age': (time.monotonic() - self.loaded_at
+                        if self.loaded_at is not None else None),
+                'refreshing': self.replay is not None,
+            }
+
+
+suggest_index = SuggestIndex()
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_suggest_changes(session, flush_context):
+    """Records the flushed title and tag name changes to apply on commit."""
+    changes = session.info.setdefault('suggest_changes', [])
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Event):
+            changes.append(('event', obj.id, obj.title))
+        elif isinstance(obj, Tag):
+            changes.append(('tag', obj.id, obj.name))
+    for obj in session.deleted:
+        if isinstance(obj, Event):
+            changes.append(('event', obj.id, None))
+        elif isinstance(obj, Tag):
+            changes.append(('tag', obj.id, None))
+
+
+@event.listens_for(db.session, 'after_commit')
+def apply_suggest_changes(session):
+    """Applies the changes of a committed transaction to the indexes."""
+    suggest_index.apply(session.info.pop('suggest_changes', []))
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_suggest_changes(session):
+    """Forgets the changes recorded for a transaction that was rolled back."""
+    session.info.pop('suggest_changes', None)
@@ -0,0 +1,291 @@
+import os
+import re
+import hashlib
+import tempfile
+from urllib.parse import quote
+from flask import abort, current_app, request, safe_join, send_file
+from usctimeline import db
+from PIL import Image as PILImage, ImageOps
+from usctimeline.models import ImageVariant
+
+# Directory of event images, relative to the app's root path
+IMAGE_DIRECTORY = os.path.join('static', 'images', 'event')
+
+# Variants generated for every raster image, as (name, maximum width). A
+# variant is never wider than the original, and variants which would be as
+# wide as a narrower one are skipped.
+VARIANT_WIDTHS = [('thumb', 320), ('medium', 800), ('large', 1600)]
+
+# Raster formats handled by Pillow, by file extension. Other files (SVG)
+# are served as uploaded.
+RASTER_FORMATS = {'.jpg': 'jpeg', '.jpeg': 'jpeg', '.png': 'png'}
+
+EXTENSIONS = {'jpeg': '.jpg', 'png': '.png', 'webp': '.webp', 'svg': '.svg'}
+
+# Content types of event images by extension. mimetypes only knows WebP from
+# the system's mime.types, which slim images (e.g. Docker's python) lack.
+MIMETYPES = {
+    '.jpg': 'image/jpeg',
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+    '.svg': 'image/svg+xml',
+}
+
+# EXIF orientations of images stored rotated by a quarter turn
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+# Images are named after the SHA-256 digest of their content, in two levels
+# of subdirectories named after its first bytes (ab/cd/abcd...ef.jpg), so
+# no directory holds more than a few files per thousand images. Variants
+# add their name to the stem (ab/cd/abcd...ef-thumb.webp).
+CONTENT_FILENAME = re.compile(
+    r'[0-9a-f]{2}/[0-9a-f]{2}/(?P<digest>[0-9a-f]{64})(?P<variant>-[a-z]+)?\.[a-z]+'
+)
+
+# Bytes read at a time when hashing or copying image files
+CHUNK_SIZE = 65536
+
+# Content-addressed files never change, so browsers may keep them a year
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def image_path(filename):
+    """Returns the path of an event image file."""
+    return os.path.join(current_app.root_path, IMAGE_DIRECTORY, filename)
+
+
+def is_content_filename(filename):
+    """Tests whether <filename> is a content-addressed image or variant."""
+    return CONTENT_FILENAME.fullmatch(filename) is not None
+
+
+def content_filename(digest, extension):
+    """Returns the filename of an image with the SHA-256 hex <digest>."""
+    return f'{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def normalized_extension(filename):
+    """Returns the lowercase extension of <filename>, '.jpeg' as '.jpg'."""
+    _, extension = os.path.splitext(filename)
+    extension = extension.lower()
+    return '.jpg' if extension == '.jpeg' else extension
+
+
+def file_digest(file):
+    """Returns the SHA-256 hex digest of a file opened in binary mode."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def add_immutable_cache_headers(response):
+    """Lets browsers cache content-addressed event images for a year.
+
+    Registered with after_request, for the images still requested through
+    the static route rather than send_image().
+    """
+    prefix = 'images/event/'
+    filename = (request.view_args or {}).get('filename', '')
+    if (request.endpoint == 'static'
+            and response.status_code in (200, 206, 304)
+            and filename.startswith(prefix)
+            and is_content_filename(filename[len(prefix):])):
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.headers.pop('Expires', None)
+    return response
+
+
+def send_image(filename):
+    """Returns the response serving the event image file <filename>.
+
+    With IMAGE_SENDFILE set to 'x-accel-redirect' (nginx) or 'x-sendfile'
+    (Apache, lighttpd), the response only names the file and the front
+    proxy sends it, along with Range and conditional responses. Otherwise
+    the file is passed to the WSGI server's file wrapper, which servers
+    such as gunicorn send with sendfile(), and Range, HEAD and conditional
+    requests are answered here. Content-addressed originals use their hash
+    as ETag, other files their modification time and size.
+
+    Args:
+        filename: Filename of the image or variant in IMAGE_DIRECTORY.
+
+    Returns:
+        Response for the current request.
+
+    Raises:
+        NotFound: No image is stored under <filename>.
+    """
+    _, extension = os.path.splitext(filename)
+    if extension not in EXTENSIONS.values():
+        # Also keeps variants being written (temporary files) private
+        abort(404)
+    path = safe_join(os.path.join(current_app.root_path, IMAGE_DIRECTORY), filename)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        abort(404)
+    mimetype = MIMETYPES[extension]
+    backend = current_app.config.get('IMAGE_SENDFILE')
+    if backend == 'x-accel-redirect':
+        response = current_app.response_class(mimetype=mimetype)
+        prefix = current_app.config.get('IMAGE_ACCEL_PREFIX', '/protected/images/event/')
+        response.headers['X-Accel-Redirect'] = quote(prefix + filename)
+    elif backend == 'x-sendfile':
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers['X-Sendfile'] = path
+    else:
+        response = send_file(path, mimetype=mimetype, add_etags=False)
+        match = CONTENT_FILENAME.fullmatch(filename)
+        if match and not match.group('variant'):
+            response.set_etag(match.group('digest'))
+        else:
+            response.set_etag(f'{int(stat.st_mtime)}-{stat.st_size}')
+        # werkzeug only advertises ranges in answer to a Range request
+        response.headers['Accept-Ranges'] = 'bytes'
+        response = response.make_conditional(
+            request, accept_ranges=True, complete_length=stat.st_size
+        )
+    if is_content_filename(filename):
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.headers.pop('Expires', None)
+    return response
+
+
+def variant_filename(filename, name, image_format):
+    """Returns the filename of a variant of the image <filename>."""
+    stem, _ = os.path.splitext(filename)
+    return f'{stem}-{name}{EXTENSIONS[image_format]}'
+
+
+def save_image_file(picture, path, image_format):
+    """Encodes <picture> into <path> through a temporary file.
+
+    Files are replaced atomically, so that a variant being regenerated is
+    never served half written.
+    """
+    if image_format == 'jpeg':
+        options = {
+            'quality': current_app.config.get('IMAGE_JPEG_QUALITY', 82),
+            'optimize': True,
+            'progressive': True,
+        }
+        if picture.mode != 'RGB':
+            picture = picture.convert('RGB')
+    elif image_format == 'webp':
+        options = {
+            'quality': current_app.config.get('IMAGE_WEBP_QUALITY', 80),
+            'method': 4,
+        }
+    else:
+        options = {'optimize': True}
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            picture.save(file, format=image_format.upper(), **options)
+        # mkstemp() creates files only readable by their owner
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def generate_variants(filename):
+    """Writes the resized and WebP variants of an event image.
+
+    Every variant is written in the original format and in WebP, with the
+    EXIF orientation applied and metadata stripped. Files which are not
+    raster images (SVG) or that Pillow cannot read get no variants.
+
+    Args:
+        filename: Filename of the original image in IMAGE_DIRECTORY.
+
+    Returns:
+        List of new ImageVariant (not added to the session).
+    """
+    _, extension = os.path.splitext(filename)
+    image_format = RASTER_FORMATS.get(extension.lower())
+    if image_format is None:
+        return []
+    try:
+        with PILImage.open(image_path(filename)) as original:
+            original = ImageOps.exif_transpose(original)
+            if original.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                # Palette and 1-bit images would be resized without filtering
+                original = original.convert('RGBA')
+            variants = []
+            widths = set()
+            for name, max_width in VARIANT_WIDTHS:
+                width = min(max_width, original.width)
+                if width in widths:
+                    continue
+                widths.add(width)
+                height = max(1, round(original.height * width / original.width))
+                if (width, height) == original.size:
+                    picture = original
+                else:
+                    picture = original.resize((width, height), PILImage.LANCZOS)
+                for variant_format in (image_format, 'webp'):
+                    variant = ImageVariant(
+                        name=name,
+                        format=variant_format,
+                        width=width,
+                        height=height,
+                        filename=variant_filename(filename, name, variant_format)
+                    )
+                    save_image_file(picture, image_path(variant.filename), variant_format)
+                    variants.append(variant)
+            return variants
+    except (OSError, PILImage.DecompressionBombError) as e:
+        current_app.logger.warning(f"No variants for image '{filename}': {e}")
+        return []
+
+
+def image_size(filename):
+    """Reads the displayed size of an event image from its header.
+
+    Args:
+        filename: Filename of the original image in IMAGE_DIRECTORY.
+
+    Returns:
+        Tuple of (width, height) with the EXIF orientation applied, or
+        (None, None) for files which are not raster images (SVG).
+
+    Raises:
+        OSError: The file is missing or is not a readable image.
+    """
+    _, extension = os.path.splitext(filename)
+    if extension.lower() not in RASTER_FORMATS:
+        return None, None
+    with PILImage.open(image_path(filename)) as picture:
+        width, height = picture.size
+        if picture.getexif().get(0x0112) in TRANSPOSED_ORIENTATIONS:
+            return height, width
+        return width, height
+
+
+def process_image(image):
+    """Records the size of <image> and (re)generates its variants.
+
+    Args:
+        image: Image whose file was saved in IMAGE_DIRECTORY.
+
+    Raises:
+        OSError: The file is missing or is not a readable image.
+    """
+    image.width, image.height = image_size(image.filename)
+    if image.variants:
+        delete_variant_files(image)
+        image.variants = []
+        # Regenerated variants reuse the filenames of the deleted rows
+        db.session.flush()
+    image.variants = generate_variants(image.filename)
+
+
+def delete_variant_files(image):
+    """Removes the variant files of <image>."""
+    for variant in image.variants:
+        path = image_path(variant.filename)
+        if os.path.isfile(path):
+            os.remove(path)
@@ -0,0 +1,764 @@
+import re
+import json
+import time
+import queue
+import codecs
+import hashlib
+import threading
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from sqlalchemy import bindparam, func, select, text
+from usctimeline import db, search_cache
+from usctimeline.models import Category, Event, Tag, event_images, event_tags
+from usctimeline.versions import ALL, bump_versions, event_key, year_key
+from usctimeline.reference import reference_cache
+from usctimeline.events.bitmap import bitmap_index
+from usctimeline.events.suggest import suggest_index
+
+DEFAULT_CHUNK_SIZE = 1000
+
+# Size of the blocks read from import files, and maximum size of one record
+READ_SIZE = 65536
+MAX_RECORD_SIZE = 4 * 1024 * 1024
+
+# Record read from an import file: the line on which it starts, the byte
+# offset right after it (where reading resumes) and the decoded record
+SourceRecord = namedtuple('SourceRecord', ['line', 'offset', 'record'])
+
+WHITESPACE = re.compile(r'[ \t\r\n\ufeff]*')
+
+# Invalid record of an import file, with the line on which it starts
+RecordError = namedtuple('RecordError', ['line', 'message'])
+
+# Event columns and tag ids parsed from a valid record
+ParsedEvent = namedtuple('ParsedEvent', ['values', 'tag_ids'])
+
+# Parsed chunk of records: (line, ParsedEvent) of the valid records,
+# RecordError of the invalid ones, the number of records and the offset
+# following the last one
+ParsedChunk = namedtuple('ParsedChunk', ['events', 'errors', 'size', 'offset'])
+
+# [categories, tags] lookups of a parse worker process (see parsed_chunks)
+worker_lookups = []
+
+
+class ImportResult:
+    """Progress and outcome of a bulk import.
+
+    Attributes:
+        imported:
+            Number of events written (committed, unless the import is atomic
+            and still running).
+        errors:
+            List of RecordError of the records that were skipped.
+        started:
+            perf_counter() value when the import started.
+        records_read:
+            Number of records read, valid or not, up to the last commit.
+        resume_offset:
+            Byte offset following the last committed record, from which an
+            interrupted import can be resumed (see stream_records).
+        updated, unchanged, deleted:
+            Number of existing events updated, skipped and deleted by
+            sync_import().
+    """
+
+    def __init__(self):
+        self.imported = 0
+        self.errors = []
+        self.started = time.perf_counter()
+        self.records_read = 0
+        self.resume_offset = None
+        self.updated = 0
+        self.unchanged = 0
+        self.deleted = 0
+
+    @property
+    def seconds(self):
+        """Returns the number of seconds elapsed since the import started."""
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        """Returns the number of events written per second."""
+        written = self.imported + self.updated + self.deleted
+        return written / max(self.seconds, 1e-9)
+
+
+class JsonStream:
+    """Buffered reader decoding JSON values one at a time from a binary file.
+
+    Only the current block of the file and the value being decoded are held
+    in memory. Tracks the byte offset and line number of the first
+    character not consumed yet.
+    """
+
+    def __init__(self, file, offset, line):
+        self.file = file
+        self.offset = offset
+        self.line = line
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def fill(self):
+        """Reads the next block of the file; returns False at end of file."""
+        if self.eof:
+            return False
+        block = self.file.read(READ_SIZE)
+        self.eof = not block
+        self.buffer = self.buffer[self.position:] + self.text_decoder.decode(
+            block, final=self.eof
+        )
+        self.position = 0
+        return not self.eof
+
+    def consume(self, end):
+        """Consumes the buffer up to position <end>."""
+        consumed = self.buffer[self.position:end]
+        self.offset += len(consumed.encode('utf-8'))
+        self.line += consumed.count('\n')
+        self.position = end
+
+    def peek(self):
+        """Skips whitespace and returns the next character ('' at the end)."""
+        while True:
+            self.consume(WHITESPACE.match(self.buffer, self.position).end())
+            if self.position < len(self.buffer) or not self.fill():
+                return self.buffer[self.position:self.position + 1]
+
+    def value(self):
+        """Decodes and consumes the next JSON value.
+
+        Raises:
+            ValueError: The value is malformed or larger than
+                MAX_RECORD_SIZE.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError as e:
+                line = self.line + self.buffer.count('\n', self.position, e.pos)
+                if len(self.buffer) - self.position > MAX_RECORD_SIZE:
+                    raise ValueError(
+                        f'Line {self.line}: record is malformed or larger '
+                        f'than {MAX_RECORD_SIZE} bytes.'
+                    )
+                if not self.fill():
+                    raise ValueError(f'Line {line}: {e.msg}.')
+                continue
+            self.consume(end)
+            return value
+
+
+def stream_json_array(file, offset, line):
+    """Yields the SourceRecord of a JSON array file (see stream_records)."""
+    stream = JsonStream(file, offset, line)
+    if offset == 0:
+        if stream.peek() != '[':
+            raise ValueError(f'Line {stream.line}: expected a JSON array of events.')
+        stream.consume(stream.position + 1)
+    if stream.peek() in (']', ''):
+        return
+    while True:
+        stream.peek()
+        record_line = stream.line
+        record = stream.value()
+        separator = stream.peek()
+        if separator not in (',', ']'):
+            raise ValueError(f"Line {stream.line}: expected ',' or ']'.")
+        stream.consume(stream.position + 1)
+        yield SourceRecord(record_line, stream.offset, record)
+        if separator == ']':
+            return
+
+
+def stream_ndjson(file, offset, line):
+    """Yields the SourceRecord of a newline-delimited JSON file.
+
+    Lines which are not valid JSON are yielded with the ValueError raised
+    while decoding them as record, so that they are reported like other
+    invalid records.
+    """
+    file.seek(offset)
+    for raw_line in file:
+        offset += len(raw_line)
+        if raw_line.strip():
+            try:
+                record = json.loads(raw_line)
+            except ValueError as e:
+                record = ValueError(f'Invalid JSON: {e}.')
+            yield SourceRecord(line, offset, record)
+        line += 1
+
+
+def is_json_array(file):
+    """Tests whether a binary file holds a JSON array rather than NDJSON."""
+    file.seek(0)
+    while True:
+        block = file.read(READ_SIZE)
+        stripped = block.lstrip(b' \t\r\n\xef\xbb\xbf')
+        if stripped or not block:
+            return stripped[:1] == b'['
+
+
+def count_lines(file, offset):
+    """Returns the line number of byte <offset> of a binary file."""
+    file.seek(0)
+    line = 1
+    while offset > 0:
+        block = file.read(min(READ_SIZE, offset))
+        if not block:
+            break
+        line += block.count(b'\n')
+        offset -= len(block)
+    return line
+
+
+def stream_records(file, offset=0, skip=0):
+    """Yields the records of a JSON array or NDJSON file as they are parsed.
+
+    The format is detected from the first character of the file. Memory use
+    does not depend on the size of the file, only on the size of a record.
+
+    Args:
+        file: File opened in binary mode.
+        offset: Byte offset to resume from, as found in the offset of a
+            previously yielded SourceRecord. 0 to read from the start.
+        skip: Number of records to skip before yielding.
+
+    Yields:
+        Instances of SourceRecord.
+
+    Raises:
+        ValueError: The file is not well-formed JSON or NDJSON.
+    """
+    array = is_json_array(file)
+    line = count_lines(file, offset)
+    file.seek(offset)
+    if array:
+        records = stream_json_array(file, offset, line)
+    else:
+        records = stream_ndjson(file, offset, line)
+    return islice(records, skip, None)
+
+
+def load_lookups():
+    """Returns dictionaries mapping Category and Tag names to their ids."""
+    categories = dict(db.session.query(Category.name, Category.id))
+    tags = dict(db.session.query(Tag.name, Tag.id))
+    return categories, tags
+
+
+def load_source_ids():
+    """Returns the set of the source ids of the existing events."""
+    return {
+        source_id for source_id, in
+        db.session.query(Event.source_id).filter(Event.source_id.isnot(None))
+    }
+
+
+def parse_record(record, categories, tags):
+    """Validates an import record and converts it to table values.
+
+    Records hold the keys 'Title', 'Date' (YYYY-MM-DD), 'Description',
+    'Category', and optionally 'URL', 'Tag' (comma-separated tag names)
+    and 'ID' (a stable id of the event in the source, see natural_key).
+
+    Args:
+        record: Object read from the import file.
+        categories: Dictionary mapping Category names to ids.
+        tags: Dictionary mapping Tag names to ids.
+
+    Returns:
+        An instance of ParsedEvent.
+
+    Raises:
+        ValueError: The record is invalid, or is the ValueError raised while
+            decoding it (see stream_ndjson).
+    """
+    if isinstance(record, ValueError):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError('Expected a JSON object.')
+    for key in ('Title', 'Date', 'Description', 'Category'):
+        if not record.get(key):
+            raise ValueError(f"Missing '{key}'.")
+    try:
+        day = datetime.strptime(record['Date'], '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid date '{record['Date']}'.")
+    category_id = categories.get(record['Category'])
+    if category_id is None:
+        raise ValueError(f"Category '{record['Category']}' not found.")
+    tag_ids = []
+    for name in (record.get('Tag') or '').split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in tags:
+            raise ValueError(f"Tag '{name}' not found.")
+        if tags[name] not in tag_ids:
+            tag_ids.append(tags[name])
+    source_id = record.get('ID')
+    values = {
+        'title': record['Title'],
+        'date': day,
+        'description': record['Description'],
+        'external_url': record.get('URL') or None,
+        'category_id': category_id,
+        'source_id': str(source_id) if source_id not in (None, '') else None,
+    }
+    values['content_hash'] = content_hash(values, tag_ids)
+    return ParsedEvent(values, tag_ids)
+
+
+def content_hash(values, tag_ids):
+    """Returns the SHA-256 hex digest of an event's imported content."""
+    content = [
+        values['title'],
+        values['date'].isoformat(),
+        values['description'],
+        values['external_url'],
+        values['category_id'],
+        values['source_id'],
+        sorted(tag_ids),
+    ]
+    encoded = json.dumps(content, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def natural_key(values):
+    """Returns the key matching an import record to an existing Event.
+
+    Records with an 'ID' are matched on it, others on their title and date.
+    """
+    if values['source_id'] is not None:
+        return 'id', values['source_id']
+    return 'event', values['title'], values['date']
+
+
+def parse_chunk(chunk, categories, tags):
+    """Parses a chunk of SourceRecord (see parse_record).
+
+    Returns:
+        An instance of ParsedChunk.
+    """
+    events = []
+    errors = []
+    for source in chunk:
+        try:
+            events.append((source.line, parse_record(source.record, categories, tags)))
+        except ValueError as e:
+            errors.append(RecordError(source.line, str(e)))
+    return ParsedChunk(events, errors, len(chunk), chunk[-1].offset)
+
+
+def init_parse_worker(categories, tags):
+    """Initializer of the parse worker processes (see parsed_chunks)."""
+    worker_lookups[:] = [categories, tags]
+
+
+def parse_chunk_in_worker(chunk):
+    """Parses a chunk in a worker process, with its lookups."""
+    return parse_chunk(chunk, *worker_lookups)
+
+
+def parsed_chunks(records, chunk_size, categories, tags, workers=0):
+    """Yields the ParsedChunk of every <chunk_size> records, in order.
+
+    With <workers>, chunks are parsed and validated by a pool of worker
+    processes while the consumer writes the previous chunks. A feeder
+    thread reads the records and submits chunks to the pool through a
+    queue bounded to two chunks per worker, so that memory use stays
+    bounded when the consumer is the slower stage.
+
+    Args:
+        records: Iterable of SourceRecord.
+        chunk_size: Number of records per chunk.
+        categories: Dictionary mapping Category names to ids.
+        tags: Dictionary mapping Tag names to ids.
+        workers: Number of worker processes, or 0 to parse in this thread.
+
+    Yields:
+        Instances of ParsedChunk.
+    """
+    records = iter(records)
+    chunks = iter(lambda: list(islice(records, chunk_size)), [])
+    if not workers:
+        for chunk in chunks:
+            yield parse_chunk(chunk, categories, tags)
+        return
+    pending = queue.Queue(maxsize=workers * 2)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def feed(executor):
+        try:
+            for chunk in chunks:
+                if stopped.is_set():
+                    return
+                put(executor.submit(parse_chunk_in_worker, chunk))
+        except Exception as e:
+            put(e)
+        else:
+            put(None)
+
+    # Workers are spawned rather than forked, since the feeder thread starts
+    # them while this process holds database connections
+    with ProcessPoolExecutor(
+        workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_parse_worker,
+        initargs=(categories, tags)
+    ) as executor:
+        feeder = threading.Thread(target=feed, args=(executor,), daemon=True)
+        feeder.start()
+        try:
+            while True:
+                item = pending.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item.result()
+        finally:
+            stopped.set()
+            feeder.join()
+            while not pending.empty():
+                item = pending.get()
+                if isinstance(item, Future):
+                    item.cancel()
+
+
+def reserve_event_ids(connection, count):
+    """Returns <count> unused Event ids.
+
+    On Postgres the ids are drawn from the id sequence. Other databases use
+    the ids following the largest one, which is safe as long as the calling
+    transaction already holds the write lock (see insert_events).
+    """
+    if connection.dialect.name == 'postgresql':
+        rows = connection.execute(text(
+            "SELECT nextval(pg_get_serial_sequence('event', 'id')) "
+            "FROM generate_series(1, :count)"
+        ), count=count)
+        return [event_id for event_id, in rows]
+    last_id = connection.execute(
+        select([func.coalesce(func.max(Event.id), 0)])
+    ).scalar()
+    return list(range(last_id + 1, last_id + count + 1))
+
+
+def insert_events(connection, events):
+    """Inserts parsed events and their tags with one executemany each.
+
+    Bulk inserts bypass the session, so the DataVersion counters of the
+    events ('all' and those of their years) are bumped here. Bumping them
+    first also takes the SQLite write lock before ids are reserved.
+
+    Args:
+        connection: Connection inside the transaction to write in.
+        events: List of ParsedEvent.
+
+    Returns:
+        None
+    """
+    years = {event.values['date'].year for event in events}
+    bump_versions(connection, [ALL] + [year_key(year) for year in sorted(years)])
+    event_ids = reserve_event_ids(connection, len(events))
+    event_rows = []
+    tag_rows = []
+    for event_id, event in zip(event_ids, events):
+        event_rows.append(dict(event.values, id=event_id))
+        tag_rows.extend(
+            {'event_id': event_id, 'tag_id': tag_id} for tag_id in event.tag_ids
+        )
+    connection.execute(Event.__table__.insert(), event_rows)
+    if tag_rows:
+        connection.execute(event_tags.insert(), tag_rows)
+
+
+def invalidate_caches():
+    """Invalidates the caches of this process after a bulk write.
+
+    The session listeners which normally do this never see Core writes.
+    Other processes notice the bumped DataVersion counter, or their cached
+    entries expire. The timeline cache is keyed on DataVersion counters, so
+    it needs no invalidation.
+    """
+    search_cache.clear()
+    reference_cache.invalidate()
+    bitmap_index.clear()
+    suggest_index.clear()
+
+
+def check_chunking(chunk_size, workers):
+    """Validates the chunk size and worker count of an import.
+
+    Raises:
+        ValueError: <chunk_size> is below 1 or <workers> is negative.
+    """
+    if chunk_size < 1:
+        raise ValueError(f'Chunk size must be at least 1, not {chunk_size}.')
+    if workers < 0:
+        raise ValueError(f'Worker count must be at least 0, not {workers}.')
+
+
+def bulk_import(records, chunk_size=DEFAULT_CHUNK_SIZE, atomic=False,
+                progress=None, workers=0):
+    """Imports events with Core executemany, in chunks.
+
+    Categories and tags are looked up in dictionaries loaded once. Records
+    are consumed lazily, one chunk at a time. Each chunk is written in its
+    own transaction, so the write lock is only held while one chunk is
+    inserted, and an interrupted import can be resumed from the
+    resume_offset of the ImportResult. Invalid records are skipped and
+    reported; the chunks written before them stay committed. Records whose
+    'ID' is already used, by an existing event or an earlier record, are
+    reported as invalid.
+
+    Args:
+        records: Iterable of SourceRecord (see stream_records).
+        chunk_size: Number of records written per transaction.
+        atomic: If True, every chunk is written in a single transaction
+            which is rolled back if any record is invalid.
+        progress: Optional function called with the ImportResult after each
+            chunk.
+        workers: Number of processes parsing records while chunks are
+            written (see parsed_chunks), or 0 to parse them in turn.
+
+    Returns:
+        An instance of ImportResult.
+
+    Raises:
+        ValueError: <chunk_size> is below 1 or <workers> is negative.
+    """
+    check_chunking(chunk_size, workers)
+    categories, tags = load_lookups()
+    existing = load_source_ids()
+    db.session.rollback()
+    result = ImportResult()
+    seen = {}
+    chunks = parsed_chunks(records, chunk_size, categories, tags, workers)
+    connection = db.engine.connect()
+    transaction = connection.begin() if atomic else None
+    try:
+        for chunk in chunks:
+            result.errors.extend(chunk.errors)
+            events = []
+            for line, event in chunk.events:
+                source_id = event.values['source_id']
+                if source_id in existing:
+                    result.errors.append(RecordError(
+                        line, f"An event with ID '{source_id}' already exists."
+                    ))
+                    continue
+                if source_id in seen:
+                    result.errors.append(RecordError(
+                        line, f'Duplicate of the record on line {seen[source_id]}.'
+                    ))
+                    continue
+                if source_id is not None:
+                    seen[source_id] = line
+                events.append(event)
+            if events and not (atomic and result.errors):
+                if atomic:
+                    insert_events(connection, events)
+                else:
+                    with connection.begin():
+                        insert_events(connection, events)
+                    invalidate_caches()
+                result.imported += len(events)
+            if not atomic:
+                result.records_read += chunk.size
+                result.resume_offset = chunk.offset
+            if progress is not None:
+                progress(result)
+        if atomic:
+            if result.errors:
+                transaction.rollback()
+                result.imported = 0
+            else:
+                transaction.commit()
+                invalidate_caches()
+    finally:
+        chunks.close()
+        if transaction is not None and transaction.is_active:
+            transaction.rollback()
+        connection.close()
+    return result
+
+
+def load_existing_events():
+    """Returns the existing events by natural key (see natural_key).
+
+    Returns:
+        Dictionary mapping keys to (id, content_hash) tuples. Events
+        sharing a key are represented by the one with the lowest id.
+    """
+    existing = {}
+    rows = db.session.query(
+        Event.id, Event.source_id, Event.title, Event.date, Event.content_hash
+    ).order_by(Event.id.desc())
+    for event_id, source_id, title, day, digest in rows:
+        key = natural_key({'source_id': source_id, 'title': title, 'date': day})
+        existing[key] = (event_id, digest)
+    db.session.rollback()
+    return existing
+
+
+def event_years(connection, event_ids):
+    """Returns the set of the years of the existing events <event_ids>."""
+    rows = connection.execute(
+        select([Event.date]).where(Event.id.in_(event_ids))
+    )
+    return {day.year for day, in rows}
+
+
+def update_events(connection, updates):
+    """Overwrites existing events with parsed events, tags included.
+
+    Args:
+        connection: Connection inside the transaction to write in.
+        updates: List of (event_id, ParsedEvent) tuples.
+
+    Returns:
+        None
+    """
+    event_ids = [event_id for event_id, _ in updates]
+    years = event_years(connection, event_ids)
+    years.update(event.values['date'].year for _, event in updates)
+    bump_versions(
+        connection,
+        [ALL] + [event_key(i) for i in event_ids]
+        + [year_key(year) for year in sorted(years)]
+    )
+    connection.execute(
+        Event.__table__.update().where(Event.id == bindparam('event_id')),
+        [dict(event.values, event_id=event_id) for event_id, event in updates]
+    )
+    connection.execute(
+        event_tags.delete().where(event_tags.c.event_id.in_(event_ids))
+    )
+    tag_rows = [
+        {'event_id': event_id, 'tag_id': tag_id}
+        for event_id, event in updates for tag_id in event.tag_ids
+    ]
+    if tag_rows:
+        connection.execute(event_tags.insert(), tag_rows)
+
+
+def delete_events(connection, event_ids):
+    """Deletes events with their tag and image associations.
+
+    Images are kept, as when an event is deleted from the site.
+    """
+    years = event_years(connection, event_ids)
+    bump_versions(
+        connection,
+        [ALL] + [event_key(i) for i in event_ids]
+        + [year_key(year) for year in sorted(years)]
+    )
+    for table in (event_tags, event_images):
+        connection.execute(table.delete().where(table.c.event_id.in_(event_ids)))
+    connection.execute(Event.__table__.delete().where(Event.id.in_(event_ids)))
+
+
+def sync_import(records, chunk_size=DEFAULT_CHUNK_SIZE, delete_missing=False,
+                progress=None, workers=0):
+    """Synchronizes the events with an import file.
+
+    Records are matched to existing events by natural key. Records whose
+    content hash matches the stored one are skipped without writing, changed
+    records overwrite their event, and new records are inserted, so that
+    importing the same file again costs no writes. Each chunk is written in
+    its own transaction.
+
+    Args:
+        records: Iterable of SourceRecord (see stream_records).
+        chunk_size: Number of records processed per transaction.
+        delete_missing: If True, events previously written by an import
+            (which have a content hash) and missing from <records> are
+            deleted. Skipped if any record is invalid, since an invalid
+            record cannot be matched to its event.
+        progress: Optional function called with the ImportResult after each
+            chunk.
+        workers: Number of processes parsing records while chunks are
+            written (see parsed_chunks), or 0 to parse them in turn.
+
+    Returns:
+        An instance of ImportResult.
+
+    Raises:
+        ValueError: <chunk_size> is below 1 or <workers> is negative.
+    """
+    check_chunking(chunk_size, workers)
+    categories, tags = load_lookups()
+    existing = load_existing_events()
+    db.session.rollback()
+    result = ImportResult()
+    seen = {}
+    chunks = parsed_chunks(records, chunk_size, categories, tags, workers)
+    connection = db.engine.connect()
+    try:
+        for chunk in chunks:
+            result.errors.extend(chunk.errors)
+            inserts = []
+            updates = []
+            for line, event in chunk.events:
+                key = natural_key(event.values)
+                if key in seen:
+                    result.errors.append(RecordError(
+                        line, f'Duplicate of the record on line {seen[key]}.'
+                    ))
+                    continue
+                seen[key] = line
+                match = existing.get(key)
+                if match is None:
+                    inserts.append(event)
+                elif match[1] == event.values['content_hash']:
+                    result.unchanged += 1
+                else:
+                    updates.append((match[0], event))
+            if inserts or updates:
+                with connection.begin():
+                    if inserts:
+                        insert_events(connection, inserts)
+                    if updates:
+                        update_events(connection, updates)
+                invalidate_caches()
+            result.imported += len(inserts)
+            result.updated += len(updates)
+            result.records_read += chunk.size
+            result.resume_offset = chunk.offset
+            if progress is not None:
+                progress(result)
+        if delete_missing and not result.errors:
+            missing = [
+                event_id for key, (event_id, digest) in existing.items()
+                if digest is not None and key not in seen
+            ]
+            for start in range(0, len(missing), chunk_size):
+                part = missing[start:start + chunk_size]
+                with connection.begin():
+                    delete_events(connection, part)
+                invalidate_caches()
+                result.deleted += len(part)
+    finally:
+        chunks.close()
+        connection.close()
+    return result
@@ -0,0 +1,156 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, or_
+from usctimeline import db
+from usctimeline.images import process_image
+from usctimeline.models import Job
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Extracts the size of an uploaded image and generates its variants
+PROCESS_IMAGE = 'process_image'
+
+
+def run_process_image(job):
+    """Handler of PROCESS_IMAGE jobs."""
+    if job.image is not None:
+        process_image(job.image)
+
+
+# Functions running each kind of job, called with the Job within the
+# transaction which marks it done
+JOB_HANDLERS = {
+    PROCESS_IMAGE: run_process_image,
+}
+
+
+def utcnow():
+    """Returns the current UTC time, as stored in Job's datetime columns."""
+    return datetime.utcnow().replace(microsecond=0)
+
+
+def enqueue(kind, image=None):
+    """Queues a job, to be committed with the current transaction.
+
+    Args:
+        kind: Kind of job, a key of JOB_HANDLERS.
+        image: Image the job works on, if any.
+
+    Returns:
+        The new Job, added to the session.
+    """
+    job = Job(kind=kind, image=image, status=PENDING, attempts=0, created=utcnow())
+    db.session.add(job)
+    return job
+
+
+def claimable():
+    """Returns the filter matching the jobs a worker may start.
+
+    These are the pending jobs, and running jobs whose worker stopped
+    without completing them within JOB_TIMEOUT seconds.
+    """
+    timeout = current_app.config.get('JOB_TIMEOUT', 600)
+    stale = utcnow() - timedelta(seconds=timeout)
+    return or_(
+        Job.status == PENDING,
+        and_(Job.status == RUNNING, Job.started < stale)
+    )
+
+
+def claim_job():
+    """Marks the oldest claimable job as running and returns it.
+
+    The job is claimed with a conditional UPDATE, so any number of workers
+    can share the queue: a worker which loses the race for a job moves on
+    to the next one.
+
+    Returns:
+        The claimed Job, or None if the queue is empty.
+    """
+    while True:
+        job_id = db.session.query(Job.id).filter(claimable()) \
+            .order_by(Job.id).limit(1).scalar()
+        if job_id is None:
+            db.session.rollback()
+            return None
+        claimed = db.session.query(Job) \
+            .filter(Job.id == job_id, claimable()) \
+            .update({
+                Job.status: RUNNING,
+                Job.started: utcnow(),
+                Job.attempts: Job.attempts + 1,
+            }, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return Job.query.get(job_id)
+
+
+def run_job(job):
+    """Runs a claimed job and records its outcome.
+
+    A failed job is queued again until it was attempted JOB_MAX_ATTEMPTS
+    times, then marked failed with its error.
+
+    Args:
+        job: Job returned by claim_job().
+
+    Returns:
+        True if the job completed.
+    """
+    job_id = job.id
+    try:
+        JOB_HANDLERS[job.kind](job)
+        job.status = DONE
+        job.error = None
+        job.finished = utcnow()
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.warning(f'Job {job_id} failed: {e}')
+        job = Job.query.get(job_id)
+        if job is None:
+            return False
+        max_attempts = current_app.config.get('JOB_MAX_ATTEMPTS', 3)
+        job.error = str(e) or type(e).__name__
+        if job.attempts >= max_attempts:
+            job.status = FAILED
+            job.finished = utcnow()
+        else:
+            job.status = PENDING
+        db.session.commit()
+        return False
+
+
+def run_worker(stop, once=False, poll_interval=None):
+    """Runs queued jobs until <stop> is set.
+
+    Args:
+        stop: threading.Event which ends the loop once the current job is
+            done.
+        once: If True, returns as soon as the queue is empty.
+        poll_interval: Seconds to wait for new jobs when the queue is
+            empty. Defaults to JOB_POLL_INTERVAL.
+
+    Returns:
+        Number of jobs run.
+    """
+    if poll_interval is None:
+        poll_interval = current_app.config.get('JOB_POLL_INTERVAL', 2)
+    count = 0
+    while not stop.is_set():
+        job = claim_job()
+        if job is None:
+            if once:
+                break
+            # Idle workers hold no connection while they wait
+            db.session.remove()
+            stop.wait(poll_interval)
+            continue
+        run_job(job)
+        count += 1
+    return count
@@ -1,46 +1,82 @@
-from flask import Blueprint, render_template
-from usctimeline.models import Event
-from calendar import month_name
-from datetime import datetime
+from flask import Blueprint, abort, current_app, jsonify, render_template, request
+from flask_login import login_required
+from usctimeline import timeline_cache
+from usctimeline.main.timeline import (
+    render_year_fragments, timeline_version, timeline_years
+)
+from usctimeline.versions import conditional, make_etag
 
 main = Blueprint('main', __name__)
 
 
+def timeline_validators():
+    """Returns the (ETag, Last-Modified) validators of the index page."""
+    version, modified = timeline_version()
+    etag = make_etag(
+        'timeline',
+        version,
+        current_app.config.get('TIMELINE_WINDOW_YEARS'),
+        request.args.get('year')
+    )
+    return etag, modified
+
+
 @main.route("/")
+@conditional(timeline_validators)
 def index():
     """Index page for the website displaying the timeline.
 
+    When TIMELINE_WINDOW_YEARS is set, only that many of the most recent years
+    (plus the year requested with the `year` query argument) are rendered.
+    Every other year is sent as a placeholder holding its year anchor, which
+    the client replaces with the year_fragment route as the user scrolls.
+
     Returns:
         A rendered HTML template for the index page.
     """
-    all_events = Event.query.order_by(Event.date.asc())
-    events_per_year = {}
-    for event in all_events:
-        year = event.date.strftime("%Y")
-        if year not in events_per_year:
-            events_per_year[year] = {
-                1: [],
-                2: [],
-                3: [],
-                4: [],
-                5: [],
-                6: [],
-                7: [],
-                8: [],
-                9: [],
-                10: [],
-                11: [],
-                12: [],
-            }
-            for month in events_per_year[year]:
-                if month == int(event.date.strftime("%-m")):
-                    events_per_year[year][month].append(event)
-        else:
-            for month in events_per_year[year]:
-                if month == int(event.date.strftime("%-m")):
-                    events_per_year[year][month].append(event)
+    years = timeline_years()
+    window = current_app.config.get('TIMELINE_WINDOW_YEARS')
+    if window:
+        rendered_years = set(years[-window:])
+        anchor_year = request.args.get('year', type=int)
+        if anchor_year in years:
+            rendered_years.add(anchor_year)
+        rendered_years = [year for year in years if year in rendered_years]
+    else:
+        rendered_years = years
+    fragments = dict(zip(
+        rendered_years,
+        render_year_fragments(rendered_years)
+    ))
     return render_template(
         'main/timeline.html',
-        events_per_year=events_per_year,
-        month_name=month_name
+        year_fragments=[(year, fragments.get(year)) for year in years],
+        windowed=bool(window)
     )
+
+
+@main.route("/timeline/year/<int:year>")
+def year_fragment(year):
+    """Route returning the timeline HTML fragment of a single year.
+
+    Args:
+        year: Year to be rendered.
+
+    Returns:
+        The rendered HTML fragment for <year> if it holds any events.
+        Otherwise, a 404 page.
+    """
+    if year not in timeline_years():
+        abort(404)
+    return render_year_fragments([year])[0]
+
+
+@main.route("/timeline/cache/stats")
+@login_required
+def timeline_cache_stats():
+    """Route exposing the timeline cache counters to logged-in admins.
+
+    Returns:
+        A JSON object with the hit/miss counters of the timeline cache.
+    """
+    return jsonify(timeline_cache.stats())
@@ -0,0 +1,183 @@
+from calendar import month_name
+from collections import namedtuple
+from datetime import date
+from flask import g, render_template
+from markupsafe import Markup
+from sqlalchemy import and_, extract, or_
+from usctimeline import db, timeline_cache
+from usctimeline.models import Event, Category
+from usctimeline.versions import ALL, REFERENCE, get_versions, year_key
+
+# Lightweight row holding only the columns the timeline displays.
+TimelineEvent = namedtuple(
+    'TimelineEvent',
+    ['id', 'title', 'date', 'category_name']
+)
+
+YEARS_CACHE_KEY = 'timeline:years'
+
+
+def timeline_query():
+    """Returns a query for every event needed to render the timeline.
+
+    Selects only the columns displayed on the timeline and joins the
+    category name so that no further queries are issued while rendering.
+
+    Returns:
+        A SQLAlchemy query yielding (id, title, date, category_name) rows
+        ordered by date.
+    """
+    return db.session.query(
+        Event.id,
+        Event.title,
+        Event.date,
+        Category.name
+    ).join(
+        Category, Event.category_id == Category.id
+    ).order_by(
+        Event.date.asc(),
+        Event.id.asc()
+    )
+
+
+def group_events(rows):
+    """Groups timeline rows by year and month in a single pass.
+
+    Args:
+        rows: Iterable of (id, title, date, category_name) rows sorted by date.
+
+    Returns:
+        Dictionary mapping each year (int) to a dictionary of months (1-12),
+        each holding a list of TimelineEvent in chronological order.
+    """
+    events_per_year = {}
+    current_year = None
+    months = None
+    for row in rows:
+        event = TimelineEvent._make(row)
+        year = event.date.year
+        if year != current_year:
+            months = events_per_year.get(year)
+            if months is None:
+                months = {month: [] for month in range(1, 13)}
+                events_per_year[year] = months
+            current_year = year
+        months[event.date.month].append(event)
+    return events_per_year
+
+
+def build_timeline():
+    """Builds the year/month structure rendered by the timeline page.
+
+    Returns:
+        Dictionary of events per year and month (see group_events()).
+    """
+    return group_events(timeline_query())
+
+
+def timeline_version():
+    """Returns the DataVersion 'all' (version, modified) tuple.
+
+    The counter is read at most once per request. The list of years is
+    cached under its version, so that the writes of every process (other
+    workers, import.py) are seen by the next request, and the ETag of the
+    page (see main/routes.py) uses the same read.
+    """
+    current = g.get('timeline_version')
+    if current is None:
+        current = g.timeline_version = get_versions(ALL)[ALL]
+    return current
+
+
+def year_versions(years):
+    """Returns the cache version of the fragment of each of <years>.
+
+    A fragment depends on the events of its year ('year:<year>' DataVersion
+    counters) and on category names ('reference'), all read in one query.
+
+    Returns:
+        Dictionary mapping each year to its version string.
+    """
+    versions = get_versions(REFERENCE, *[year_key(year) for year in years])
+    reference = versions[REFERENCE][0]
+    return {
+        year: f'{versions[year_key(year)][0]}.{reference}' for year in years
+    }
+
+
+def year_cache_key(year):
+    """Returns the timeline cache key of the rendered fragment for <year>."""
+    return f'timeline:year:{year}'
+
+
+def empty_months():
+    """Returns a dictionary mapping every month (1-12) to an empty list."""
+    return {month: [] for month in range(1, 13)}
+
+
+def timeline_years():
+    """Returns every year holding at least one event, in ascending order.
+
+    The list of years is cached alongside the year fragments so that a fully
+    cached timeline is served without loading any event.
+    """
+    version = timeline_version()[0]
+    cached = timeline_cache.get(YEARS_CACHE_KEY, version)
+    if cached is not None:
+        return [int(year) for year in cached.split(',') if year]
+    result = db.session.query(extract('year', Event.date)).distinct()
+    years = sorted(int(year) for year, in result)
+    timeline_cache.set(
+        YEARS_CACHE_KEY, ','.join(str(year) for year in years), version
+    )
+    return years
+
+
+def render_year(year, events_per_month):
+    """Returns the rendered HTML fragment for a single year of the timeline."""
+    return render_template(
+        'main/year.html',
+        year=year,
+        events_per_month=events_per_month,
+        month_name=month_name
+    )
+
+
+def render_year_fragments(years):
+    """Returns the rendered HTML fragments for <years>.
+
+    Fragments are read from the timeline cache, under the current version of
+    their year (see year_versions), so that writing an event only rebuilds
+    the years of its previous and new date. All missing years are loaded
+    with a single query, rendered and stored back into the cache, replacing
+    their previous version.
+
+    Args:
+        years: List of years to render.
+
+    Returns:
+        List of Markup fragments in the same order as <years>.
+    """
+    versions = year_versions(years)
+    fragments = {}
+    missing = []
+    for year in years:
+        html = timeline_cache.get(year_cache_key(year), versions[year])
+        if html is None:
+            missing.append(year)
+        else:
+            fragments[year] = html
+    if missing:
+        query = timeline_query()
+        if len(missing) < len(years):
+            query = query.filter(or_(*[
+                and_(Event.date >= date(year, 1, 1),
+                     Event.date < date(year + 1, 1, 1))
+                for year in missing
+            ]))
+        events_per_year = group_events(query)
+        for year in missing:
+            html = render_year(year, events_per_year.get(year, empty_months()))
+            timeline_cache.set(year_cache_key(year), html, versions[year])
+            fragments[year] = html
+    return [Markup(fragments[year]) for year in years]
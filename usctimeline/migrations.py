@@ -0,0 +1,412 @@
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+from datetime import datetime
+from functools import partial
+from flask import current_app
+from sqlalchemy import inspect, select, text
+from usctimeline import db
+from usctimeline.events.fulltext import (POSTGRES_INDEX, POSTGRES_INDEXED,
+                                         rebuild_fulltext_index)
+from usctimeline.images import (content_filename, file_digest, image_path,
+                                is_content_filename, normalized_extension,
+                                variant_filename)
+from usctimeline.models import (Image, ImageVariant, Job, SchemaMigration,
+                                event_images)
+from usctimeline.versions import ALL, bump_versions, event_key
+
+# A versioned schema change. upgrade is called with a connection and must be
+# safe to run again if it was interrupted. It may return a function, called
+# once the migration is committed, which cleans up outside of the database.
+# Non transactional migrations run in autocommit mode on Postgres, so their
+# indexes can be built concurrently.
+Migration = namedtuple(
+    'Migration',
+    ['version', 'name', 'upgrade', 'transactional']
+)
+
+# Postgres DDL gives up instead of queueing behind long transactions, since
+# a queued lock blocks every query on the table until it is granted
+POSTGRES_LOCK_TIMEOUT = '5s'
+
+# Association tables keyed by both of their columns (see migration 2)
+ASSOCIATION_TABLES = [
+    ('event_tags', 'event_id', 'event', 'tag_id', 'tag'),
+    ('event_images', 'event_id', 'event', 'image_id', 'image'),
+]
+
+
+def create_index(connection, name, table, columns, unique=False, using=None):
+    """Creates an index if it does not exist, without blocking writes.
+
+    On Postgres the index is built concurrently, and an invalid index left
+    by an interrupted build is dropped and built again. <columns> may hold
+    expressions, and <using> names the Postgres index method (e.g. 'gin').
+    """
+    unique = 'UNIQUE ' if unique else ''
+    if connection.dialect.name == 'postgresql':
+        valid = connection.execute(text(
+            "SELECT i.indisvalid FROM pg_index i "
+            "JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+        ), name=name).scalar()
+        if valid is False:
+            connection.execute(text(f'DROP INDEX CONCURRENTLY {name}'))
+        method = f'USING {using} ' if using else ''
+        connection.execute(text(
+            f'CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {name} '
+            f'ON {table} {method}({", ".join(columns)})'
+        ))
+    else:
+        connection.execute(text(
+            f'CREATE {unique}INDEX IF NOT EXISTS {name} '
+            f'ON {table} ({", ".join(columns)})'
+        ))
+
+
+def create_missing_tables(connection):
+    """Migration 1: creates the tables missing from older databases.
+
+    Databases created by createdb.py before migrations existed are adopted
+    as they are; only missing tables (e.g. data_version) are created.
+    """
+    db.metadata.create_all(connection, checkfirst=True)
+
+
+def add_association_primary_keys(connection):
+    """Migration 2: keys event_tags and event_images by both of their ids.
+
+    Rows with a missing id and duplicate rows are removed first.
+
+    SQLite cannot add a primary key to a table, so each table is copied into
+    a new keyed table within the migration's transaction, which only holds
+    the write lock for the time of the copy. On Postgres the key's unique
+    index is built concurrently and then attached as the primary key.
+    """
+    inspector = inspect(connection)
+    for table, left, left_table, right, right_table in ASSOCIATION_TABLES:
+        if inspector.get_pk_constraint(table)['constrained_columns']:
+            continue
+        if connection.dialect.name == 'sqlite':
+            connection.execute(text(f'DROP TABLE IF EXISTS {table}_new'))
+            connection.execute(text(
+                f'CREATE TABLE {table}_new ('
+                f'{left} INTEGER NOT NULL REFERENCES {left_table} (id), '
+                f'{right} INTEGER NOT NULL REFERENCES {right_table} (id), '
+                f'PRIMARY KEY ({left}, {right}))'
+            ))
+            connection.execute(text(
+                f'INSERT OR IGNORE INTO {table}_new ({left}, {right}) '
+                f'SELECT {left}, {right} FROM {table} '
+                f'WHERE {left} IS NOT NULL AND {right} IS NOT NULL'
+            ))
+            connection.execute(text(f'DROP TABLE {table}'))
+            connection.execute(text(f'ALTER TABLE {table}_new RENAME TO {table}'))
+            continue
+        connection.execute(text(
+            f'DELETE FROM {table} WHERE {left} IS NULL OR {right} IS NULL'
+        ))
+        connection.execute(text(
+            f'DELETE FROM {table} a USING {table} b WHERE a.ctid > b.ctid '
+            f'AND a.{left} = b.{left} AND a.{right} = b.{right}'
+        ))
+        create_index(connection, f'{table}_pkey', table, [left, right], unique=True)
+        connection.execute(text(
+            f'ALTER TABLE {table} '
+            f'ALTER COLUMN {left} SET NOT NULL, '
+            f'ALTER COLUMN {right} SET NOT NULL, '
+            f'ADD CONSTRAINT {table}_pkey PRIMARY KEY USING INDEX {table}_pkey'
+        ))
+
+
+def add_performance_indexes(connection):
+    """Migration 3: indexes the columns used to sort and filter events.
+
+    The names match the indexes declared in models.py, so migrated databases
+    and databases created by create_all() have the same schema.
+    """
+    create_index(connection, 'ix_event_date', 'event', ['date'])
+    create_index(connection, 'ix_event_category_id', 'event', ['category_id'])
+    create_index(connection, 'ix_event_tags_tag_id', 'event_tags', ['tag_id'])
+
+
+def add_event_source_columns(connection):
+    """Migration 4: adds the columns used by import.py --sync to event.
+
+    Both columns are nullable without a default, so adding them does not
+    rewrite the table. The unique index on source_id is built afterwards.
+    """
+    columns = {column['name'] for column in inspect(connection).get_columns('event')}
+    if 'source_id' not in columns:
+        connection.execute(text('ALTER TABLE event ADD COLUMN source_id VARCHAR(120)'))
+    if 'content_hash' not in columns:
+        connection.execute(text('ALTER TABLE event ADD COLUMN content_hash VARCHAR(64)'))
+    create_index(connection, 'ix_event_source_id', 'event', ['source_id'], unique=True)
+
+
+def create_image_variant_table(connection):
+    """Migration 5: creates the image_variant table (see images.py).
+
+    Existing images get their variants from backfillimages.py.
+    """
+    ImageVariant.__table__.create(connection, checkfirst=True)
+
+
+def add_image_jobs(connection):
+    """Migration 6: creates the job table and the image size columns.
+
+    Images processed before this migration keep empty sizes until
+    backfillimages.py processes them again.
+    """
+    columns = {column['name'] for column in inspect(connection).get_columns('image')}
+    if 'width' not in columns:
+        connection.execute(text('ALTER TABLE image ADD COLUMN width INTEGER'))
+    if 'height' not in columns:
+        connection.execute(text('ALTER TABLE image ADD COLUMN height INTEGER'))
+    Job.__table__.create(connection, checkfirst=True)
+
+
+def link_file(source, destination):
+    """Gives the file <source> the additional name <destination>.
+
+    The file is hard linked, or copied where links are not supported.
+    An existing <destination> is kept.
+    """
+    if os.path.exists(destination):
+        return
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    try:
+        os.link(source, destination)
+    except OSError:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(destination))
+        os.close(fd)
+        shutil.copyfile(source, tmp_path)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, destination)
+
+
+def remove_image_files(filenames):
+    """Removes the files <filenames> from IMAGE_DIRECTORY, if they exist."""
+    for filename in filenames:
+        if os.path.isfile(image_path(filename)):
+            os.remove(image_path(filename))
+
+
+def merge_image(connection, image_id, kept_id):
+    """Moves the events of image <image_id> to <kept_id>, then deletes it."""
+    kept_events = {
+        event_id for event_id, in connection.execute(
+            select([event_images.c.event_id])
+            .where(event_images.c.image_id == kept_id)
+        )
+    }
+    event_ids = [
+        event_id for event_id, in connection.execute(
+            select([event_images.c.event_id])
+            .where(event_images.c.image_id == image_id)
+        )
+    ]
+    for event_id in event_ids:
+        if event_id not in kept_events:
+            connection.execute(
+                event_images.insert().values(event_id=event_id, image_id=kept_id)
+            )
+    connection.execute(event_images.delete().where(event_images.c.image_id == image_id))
+    for table in (ImageVariant.__table__, Job.__table__):
+        connection.execute(table.delete().where(table.c.image_id == image_id))
+    images = Image.__table__
+    connection.execute(images.delete().where(images.c.id == image_id))
+
+
+def rehash_image_files(connection):
+    """Migration 7: renames event images after the hash of their content.
+
+    Each image and its variants get their content-addressed filename (see
+    images.py) as an additional name, and their rows are updated. Images
+    with the same content are merged into the oldest one, which takes over
+    their events. The previous files are kept until the migration is
+    committed, so that a failed or interrupted run leaves every row pointing
+    at an existing file. Images whose file is missing keep their name.
+
+    Returns:
+        Function removing the previous files (see Migration).
+    """
+    images = Image.__table__
+    variants = ImageVariant.__table__
+    rows = connection.execute(
+        select([images.c.id, images.c.filename]).order_by(images.c.id)
+    ).fetchall()
+    image_ids = {filename: image_id for image_id, filename in rows}
+    changed = []
+    obsolete = []
+    for image_id, filename in rows:
+        if is_content_filename(filename):
+            continue
+        path = image_path(filename)
+        if not os.path.isfile(path):
+            current_app.logger.warning(f"Image file '{filename}' is missing.")
+            continue
+        with open(path, 'rb') as file:
+            new_filename = content_filename(
+                file_digest(file), normalized_extension(filename)
+            )
+        variant_rows = connection.execute(
+            select([variants.c.id, variants.c.name, variants.c.format,
+                    variants.c.filename])
+            .where(variants.c.image_id == image_id)
+        ).fetchall()
+        obsolete.append(filename)
+        obsolete.extend(row.filename for row in variant_rows)
+        changed.append(image_id)
+        kept_id = image_ids.get(new_filename)
+        if kept_id is not None:
+            changed.append(kept_id)
+            merge_image(connection, image_id, kept_id)
+            continue
+        link_file(path, image_path(new_filename))
+        for row in variant_rows:
+            new_variant = variant_filename(new_filename, row.name, row.format)
+            if os.path.isfile(image_path(row.filename)):
+                link_file(image_path(row.filename), image_path(new_variant))
+            connection.execute(
+                variants.update().where(variants.c.id == row.id)
+                .values(filename=new_variant)
+            )
+        connection.execute(
+            images.update().where(images.c.id == image_id)
+            .values(filename=new_filename)
+        )
+        image_ids[new_filename] = image_id
+    if changed:
+        # Cached and exported pages refer to the previous filenames
+        event_ids = connection.execute(
+            select([event_images.c.event_id]).distinct()
+            .where(event_images.c.image_id.in_(changed))
+        )
+        bump_versions(
+            connection, [ALL] + [event_key(event_id) for event_id, in event_ids]
+        )
+    return partial(remove_image_files, obsolete)
+
+
+def add_fulltext_index(connection):
+    """Migration 8: creates the full-text index of older databases.
+
+    On Postgres the GIN index is built concurrently. On SQLite the FTS5
+    table and its triggers are created and filled with every event, unless
+    the database already has them (see events/fulltext.py).
+    """
+    if connection.dialect.name == 'postgresql':
+        create_index(
+            connection, POSTGRES_INDEX, 'event', [POSTGRES_INDEXED], using='gin'
+        )
+    elif connection.dialect.name == 'sqlite':
+        if not connection.dialect.has_table(connection, 'event_fts'):
+            rebuild_fulltext_index(connection)
+
+
+MIGRATIONS = [
+    Migration(1, 'create_missing_tables', create_missing_tables, True),
+    Migration(2, 'add_association_primary_keys', add_association_primary_keys, False),
+    Migration(3, 'add_performance_indexes', add_performance_indexes, False),
+    Migration(4, 'add_event_source_columns', add_event_source_columns, False),
+    Migration(5, 'create_image_variant_table', create_image_variant_table, True),
+    Migration(6, 'add_image_jobs', add_image_jobs, True),
+    Migration(7, 'rehash_image_files', rehash_image_files, True),
+    Migration(8, 'add_fulltext_index', add_fulltext_index, False),
+]
+
+
+def applied_versions(connection):
+    """Returns the set of migration versions applied to the database."""
+    table = SchemaMigration.__table__
+    if not connection.dialect.has_table(connection, table.name):
+        return set()
+    return {
+        version for version, in connection.execute(select([table.c.version]))
+    }
+
+
+def record_migration(connection, migration):
+    """Marks <migration> as applied."""
+    connection.execute(SchemaMigration.__table__.insert().values(
+        version=migration.version,
+        name=migration.name,
+        applied=datetime.utcnow().replace(microsecond=0)
+    ))
+
+
+def pending_migrations(engine=None):
+    """Returns the migrations not yet applied to the database, in order."""
+    engine = engine or db.engine
+    with engine.connect() as connection:
+        applied = applied_versions(connection)
+    return [m for m in MIGRATIONS if m.version not in applied]
+
+
+def upgrade(engine=None):
+    """Applies every pending migration in order.
+
+    Each migration is applied and recorded in its own transaction, except
+    non transactional migrations on Postgres, which are applied in
+    autocommit mode and recorded once they completed. The cleanup function
+    returned by a migration runs once it is recorded.
+
+    Args:
+        engine: Engine of the database to migrate. Defaults to db.engine.
+
+    Returns:
+        List of the applied migrations.
+    """
+    engine = engine or db.engine
+    SchemaMigration.__table__.create(engine, checkfirst=True)
+    applied = []
+    for migration in pending_migrations(engine):
+        if engine.dialect.name == 'postgresql' and not migration.transactional:
+            with engine.connect() as connection:
+                connection = connection.execution_options(
+                    isolation_level='AUTOCOMMIT'
+                )
+                connection.execute(text(
+                    f"SET lock_timeout = '{POSTGRES_LOCK_TIMEOUT}'"
+                ))
+                cleanup = migration.upgrade(connection)
+                connection.execute(text('RESET lock_timeout'))
+            with engine.begin() as connection:
+                record_migration(connection, migration)
+        else:
+            with engine.begin() as connection:
+                if engine.dialect.name == 'postgresql':
+                    connection.execute(text(
+                        f"SET LOCAL lock_timeout = '{POSTGRES_LOCK_TIMEOUT}'"
+                    ))
+                cleanup = migration.upgrade(connection)
+                record_migration(connection, migration)
+        if cleanup is not None:
+            cleanup()
+        applied.append(migration)
+    return applied
+
+
+def create_schema(engine=None):
+    """Creates the database schema.
+
+    Empty databases are created from the models and marked as fully
+    migrated; databases which already have tables are upgraded instead.
+
+    Args:
+        engine: Engine of the database. Defaults to db.engine.
+
+    Returns:
+        List of the applied migrations.
+    """
+    engine = engine or db.engine
+    with engine.connect() as connection:
+        existing = inspect(connection).get_table_names()
+    if existing:
+        return upgrade(engine)
+    with engine.begin() as connection:
+        db.metadata.create_all(connection)
+        for migration in MIGRATIONS:
+            record_migration(connection, migration)
+    return []
@@ -17,18 +17,18 @@ def load_user(user_id):
     """
     return User.query.get(int(user_id))
 
-# Many-to-many relationship table between Event and Tag
+# Many-to-many relationship table between Event and Tag, keyed by both ids
 event_tags = db.Table(
     'event_tags',
-    db.Column('event_id', db.Integer, db.ForeignKey('event.id')),
-    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'))
+    db.Column('event_id', db.Integer, db.ForeignKey('event.id'), primary_key=True),
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True, index=True)
 )
 
-# Many-to-many relationship table between Event and Image
+# Many-to-many relationship table between Event and Image, keyed by both ids
 event_images = db.Table(
     'event_images',
-    db.Column('event_id', db.Integer, db.ForeignKey('event.id')),
-    db.Column('image_id', db.Integer, db.ForeignKey('image.id'))
+    db.Column('event_id', db.Integer, db.ForeignKey('event.id'), primary_key=True),
+    db.Column('image_id', db.Integer, db.ForeignKey('image.id'), primary_key=True)
 )
 
 
@@ -96,22 +96,32 @@ class Event(db.Model):
         title:
             Defines string column for the event's title.
         date:
-            Defines date column for the event's date.
+            Defines indexed date column for the event's date.
         external_url:
             Defines text column for a URL.
         category_id:
-            Defines foreign key integer column for a specific category id.
+            Defines indexed foreign key integer column for a specific
+            category id.
+        source_id:
+            Defines unique string column for the id of the event in the
+            import file, if it has one.
+        content_hash:
+            Defines string column for the hash of the imported record (see
+            importer.py). NULL for events not written by import.py.
     """
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(120), nullable=False)
-    date = db.Column(db.Date, nullable=False)
+    date = db.Column(db.Date, nullable=False, index=True)
     description = db.Column(db.Text, nullable=False)
     external_url = db.Column(db.Text)
     category_id = db.Column(
         db.Integer,
         db.ForeignKey('category.id'),
-        nullable=False
+        nullable=False,
+        index=True
     )
+    source_id = db.Column(db.String(120), unique=True, index=True)
+    content_hash = db.Column(db.String(64))
 
     def __repr__(self):
         return f"Event('{self.title}', '{self.date}')"
@@ -125,23 +135,156 @@ class Image(db.Model):
             Defines primary key integer column.
         filename:
             Defines string column for an image filename.
+        width:
+            Defines integer column for the width in pixels, once the image
+            was processed. (None for SVG images)
+        height:
+            Defines integer column for the height in pixels, once the image
+            was processed. (None for SVG images)
         events:
             Defines foreign key id for specific row in event_images table.
             (Many-to-many relationship)
+        variants:
+            Defines one-to-many relationship with ImageVariant table,
+            ordered by width.
+        jobs:
+            Defines one-to-many relationship with Job table, oldest first.
     """
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(120), unique=True, nullable=False)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
     events = db.relationship(
         'Event',
         secondary=event_images,
         backref="images",
         lazy=True
     )
+    variants = db.relationship(
+        'ImageVariant',
+        backref='image',
+        lazy=True,
+        cascade='all, delete-orphan',
+        order_by='ImageVariant.width'
+    )
+    jobs = db.relationship(
+        'Job',
+        backref='image',
+        lazy=True,
+        cascade='all, delete-orphan',
+        order_by='Job.id'
+    )
+
+    def variants_in(self, image_format):
+        """Returns the variants encoded in <image_format>, narrowest first."""
+        return [v for v in self.variants if v.format == image_format]
+
+    def display_filename(self, max_width=800):
+        """Returns the file to use when srcset is not supported.
+
+        This is the widest variant in the original format no wider than
+        <max_width>, or the original file if it has no variants.
+        """
+        variants = [
+            v for v in self.variants
+            if v.format != 'webp' and v.width <= max_width
+        ]
+        return variants[-1].filename if variants else self.filename
+
+    def latest_job(self):
+        """Returns the most recently queued Job of the image, or None."""
+        return self.jobs[-1] if self.jobs else None
 
     def __repr__(self):
         return f"Image('{self.filename}')"
 
 
+class ImageVariant(db.Model):
+    """Defines an ImageVariant table.
+
+    Each row is a resized copy of an Image, in the original format or in
+    WebP, stored next to the original file (see images.py).
+
+    Attributes:
+        id:
+            Defines primary key integer column.
+        image_id:
+            Defines indexed foreign key integer column for the original
+            image.
+        name:
+            Defines string column for the variant name. ('thumb', 'medium'
+            or 'large')
+        format:
+            Defines string column for the encoding. ('jpeg', 'png' or 'webp')
+        width:
+            Defines integer column for the width in pixels.
+        height:
+            Defines integer column for the height in pixels.
+        filename:
+            Defines string column for the variant filename.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    image_id = db.Column(
+        db.Integer,
+        db.ForeignKey('image.id'),
+        nullable=False,
+        index=True
+    )
+    name = db.Column(db.String(20), nullable=False)
+    format = db.Column(db.String(10), nullable=False)
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    filename = db.Column(db.String(120), unique=True, nullable=False)
+
+    def __repr__(self):
+        return f"ImageVariant('{self.filename}')"
+
+
+class Job(db.Model):
+    """Defines a Job table.
+
+    Each row is a unit of background work, run by worker.py (see jobs.py).
+
+    Attributes:
+        id:
+            Defines primary key integer column. Jobs run in id order.
+        kind:
+            Defines string column naming the job's handler.
+            ('process_image')
+        image_id:
+            Defines indexed foreign key integer column for the image the job
+            works on.
+        status:
+            Defines indexed string column for the job's state.
+            ('pending', 'running', 'done' or 'failed')
+        attempts:
+            Defines integer column for the number of times the job was
+            started.
+        error:
+            Defines text column for the error of the latest failed attempt.
+        created:
+            Defines datetime column for the time the job was queued (UTC).
+        started:
+            Defines datetime column for the start of the latest attempt
+            (UTC).
+        finished:
+            Defines datetime column for the time the job completed or
+            failed for good (UTC).
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(40), nullable=False)
+    image_id = db.Column(db.Integer, db.ForeignKey('image.id'), index=True)
+    status = db.Column(db.String(10), nullable=False, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    created = db.Column(db.DateTime, nullable=False)
+    started = db.Column(db.DateTime)
+    finished = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f"Job('{self.id}', '{self.kind}', '{self.status}')"
+
+
 class Category(db.Model):
     """Defines a Category table.
 
@@ -184,3 +327,49 @@ class Tag(db.Model):
 
     def __repr__(self):
         return f"Tag('{self.name}')"
+
+
+class DataVersion(db.Model):
+    """Defines a DataVersion table.
+
+    Each row is a monotonically increasing counter bumped whenever the data it
+    covers is written (see versions.py).
+
+    Attributes:
+        key:
+            Defines primary key string column naming the covered data.
+            ('all', 'reference' or 'event:<id>')
+        version:
+            Defines integer column for the number of writes seen so far.
+        modified:
+            Defines datetime column for the time of the latest write (UTC).
+    """
+    key = db.Column(db.String(40), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    modified = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"DataVersion('{self.key}', '{self.version}')"
+
+
+class SchemaMigration(db.Model):
+    """Defines a SchemaMigration table.
+
+    Each row records a schema migration applied to the database (see
+    migrations.py).
+
+    Attributes:
+        version:
+            Defines primary key integer column for the migration number.
+        name:
+            Defines string column for the migration name.
+        applied:
+            Defines datetime column for the time the migration was applied
+            (UTC).
+    """
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(120), nullable=False)
+    applied = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"SchemaMigration('{self.version}', '{self.name}')"
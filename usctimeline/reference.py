@@ -0,0 +1,140 @@
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+from flask import g
+from sqlalchemy import event, func
+from usctimeline import db
+from usctimeline.models import Category, Event, Tag, event_tags
+from usctimeline.versions import ALL, get_versions
+
+# Immutable snapshot of a Category or Tag row with its number of events
+ReferenceItem = namedtuple('ReferenceItem', ['id', 'name', 'event_count'])
+
+
+def item_pk(item):
+    """Returns the primary key of a ReferenceItem (for QuerySelectField)."""
+    return item.id
+
+
+class ReferenceData:
+    """Immutable snapshot of every Category and Tag.
+
+    Attributes:
+        version:
+            DataVersion 'all' counter the snapshot reflects.
+        categories:
+            Tuple of ReferenceItem ordered by id.
+        tags:
+            Tuple of ReferenceItem ordered by id.
+    """
+
+    def __init__(self, version, categories, tags):
+        self.version = version
+        self.categories = tuple(categories)
+        self.tags = tuple(tags)
+        self.categories_by_id = MappingProxyType({c.id: c for c in self.categories})
+        self.categories_by_name = MappingProxyType({c.name: c for c in self.categories})
+        self.tags_by_id = MappingProxyType({t.id: t for t in self.tags})
+        self.tags_by_name = MappingProxyType({t.name: t for t in self.tags})
+
+    def category(self, category_id):
+        """Returns the Category with <category_id>, or None."""
+        return self.categories_by_id.get(category_id)
+
+    def category_named(self, name):
+        """Returns the Category named <name>, or None."""
+        return self.categories_by_name.get(name)
+
+    def tag(self, tag_id):
+        """Returns the Tag with <tag_id>, or None."""
+        return self.tags_by_id.get(tag_id)
+
+    def tag_named(self, name):
+        """Returns the Tag named <name>, or None."""
+        return self.tags_by_name.get(name)
+
+
+def load_reference_data():
+    """Reads every Category and Tag with their event counts in two queries.
+
+    Returns:
+        An instance of ReferenceData.
+    """
+    version = get_versions(ALL)[ALL][0]
+    categories = db.session.query(
+        Category.id, Category.name, func.count(Event.id)
+    ).outerjoin(
+        Event, Event.category_id == Category.id
+    ).group_by(Category.id, Category.name).order_by(Category.id)
+    tags = db.session.query(
+        Tag.id, Tag.name, func.count(event_tags.c.event_id)
+    ).outerjoin(
+        event_tags, event_tags.c.tag_id == Tag.id
+    ).group_by(Tag.id, Tag.name).order_by(Tag.id)
+    return ReferenceData(
+        version,
+        [ReferenceItem(*row) for row in categories],
+        [ReferenceItem(*row) for row in tags]
+    )
+
+
+class ReferenceCache:
+    """Process-local cache of the ReferenceData snapshot.
+
+    Commits of this process which write an Event, Tag or Category drop the
+    snapshot (see the session listeners below). Writes of other processes
+    (other workers, import.py) are detected by comparing the DataVersion
+    'all' counter, at most once per request.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = None
+
+    def init_app(self, app):
+        """Exposes the snapshot to templates as `reference`."""
+        app.context_processor(lambda: {'reference': self.get()})
+
+    def get(self):
+        """Returns the current ReferenceData snapshot."""
+        data = self.data
+        if data is not None and not g.get('reference_checked'):
+            if get_versions(ALL)[ALL][0] != data.version:
+                data = None
+            g.reference_checked = True
+        if data is None:
+            data = load_reference_data()
+            with self.lock:
+                self.data = data
+            g.reference_checked = True
+        return data
+
+    def invalidate(self):
+        """Drops the snapshot, so that the next get() reloads it."""
+        with self.lock:
+            self.data = None
+
+
+reference_cache = ReferenceCache()
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_reference_changes(session, flush_context):
+    """Marks the transaction as changing categories, tags or event counts."""
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Event, Tag, Category)):
+            session.info['reference_changed'] = True
+            return
+
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_reference_data(session):
+    """Drops the snapshot once a transaction changing it commits."""
+    if session.info.pop('reference_changed', False):
+        reference_cache.invalidate()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_reference_changes(session):
+    """Forgets the changes of a transaction that was rolled back."""
+    session.info.pop('reference_changed', None)
@@ -0,0 +1,61 @@
+// Suggests event titles and tags while typing in the search field. Title
+// suggestions fill the field's datalist; tag suggestions are shown as buttons
+// selecting the tag in the tags field.
+(function () {
+    var input = document.querySelector('.search-title-input-field');
+    var datalist = document.getElementById('title-suggestions');
+    var tagSuggestions = document.querySelector('.search-tag-suggestions');
+    var tagSelect = document.querySelector('.search-tag-input-field');
+    if (!input || !datalist) {
+        return;
+    }
+    var timer = null;
+    var latest = '';
+
+    function showSuggestions(suggestions) {
+        datalist.innerHTML = '';
+        suggestions.events.forEach(function (event) {
+            var option = document.createElement('option');
+            option.value = event.title;
+            datalist.appendChild(option);
+        });
+        tagSuggestions.innerHTML = '';
+        suggestions.tags.forEach(function (tag) {
+            var option = tagSelect.querySelector('option[value="' + tag.id + '"]');
+            if (!option || option.selected) {
+                return;
+            }
+            var button = document.createElement('button');
+            button.type = 'button';
+            button.className = 'search-tag-suggestion';
+            button.textContent = tag.name;
+            button.addEventListener('click', function () {
+                option.selected = true;
+                button.remove();
+            });
+            tagSuggestions.appendChild(button);
+        });
+    }
+
+    input.addEventListener('input', function () {
+        clearTimeout(timer);
+        timer = setTimeout(function () {
+            var query = input.value.trim();
+            latest = query;
+            if (!query) {
+                showSuggestions({events: [], tags: []});
+                return;
+            }
+            fetch(datalist.dataset.url + '?q=' + encodeURIComponent(query))
+                .then(function (response) {
+                    return response.json();
+                })
+                .then(function (suggestions) {
+                    if (query === latest) {
+                        showSuggestions(suggestions);
+                    }
+                })
+                .catch(function () {});
+        }, 150);
+    });
+})();
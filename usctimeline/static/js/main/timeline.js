@@ -0,0 +1,58 @@
+// Replaces year placeholders with their rendered fragment once they are
+// about to scroll into view. A year requested through the URL anchor
+// (e.g. `/#1998` when coming back from an event page) is loaded first.
+(function () {
+    var placeholders = document.querySelectorAll('.year-placeholder');
+
+    function loadYear(placeholder) {
+        if (placeholder.dataset.loading) {
+            return Promise.resolve();
+        }
+        placeholder.dataset.loading = 'true';
+        return fetch(placeholder.dataset.url)
+            .then(function (response) {
+                if (!response.ok) {
+                    throw new Error(response.statusText);
+                }
+                return response.text();
+            })
+            .then(function (html) {
+                placeholder.outerHTML = html;
+            })
+            .catch(function () {
+                delete placeholder.dataset.loading;
+            });
+    }
+
+    var anchor = window.location.hash.slice(1);
+    var anchored = document.querySelector('.year-placeholder[data-year="' + anchor + '"]');
+    var ready = Promise.resolve();
+    if (anchored) {
+        ready = loadYear(anchored).then(function () {
+            var heading = document.getElementById(anchor);
+            if (heading) {
+                heading.scrollIntoView();
+            }
+        });
+    }
+
+    ready.then(function () {
+        if (!('IntersectionObserver' in window)) {
+            placeholders.forEach(loadYear);
+            return;
+        }
+        var observer = new IntersectionObserver(function (entries) {
+            entries.forEach(function (entry) {
+                if (entry.isIntersecting) {
+                    observer.unobserve(entry.target);
+                    loadYear(entry.target);
+                }
+            });
+        }, {rootMargin: '1000px 0px'});
+        placeholders.forEach(function (placeholder) {
+            if (document.body.contains(placeholder)) {
+                observer.observe(placeholder);
+            }
+        });
+    });
+})();
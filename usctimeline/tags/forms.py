@@ -1,12 +1,12 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField
 from wtforms.validators import DataRequired
-from usctimeline.models import Tag
+from usctimeline.reference import reference_cache
 
 
 def tag_query():
-    """Returns a Flask-SQLAlchemy query object for the Tag model."""
-    return Tag.query
+    """Returns the cached Tag snapshots (see reference.py)."""
+    return reference_cache.get().tags
 
 
 class TagForm(FlaskForm):
@@ -3,6 +3,7 @@ from flask_login import login_required
 from usctimeline import db
 from usctimeline.models import Tag
 from usctimeline.tags.forms import TagForm
+from usctimeline.reference import reference_cache
 
 tags = Blueprint('tags', __name__)
 
@@ -37,10 +38,12 @@ def new_tag():
 def manage_tags():
     """Route for managing all existing tags.
 
+    Tags and their event counts are read from the reference data cache.
+
     Returns:
         A rendered HTML template for this route.
     """
-    tags = Tag.query.all()
+    tags = reference_cache.get().tags
     return render_template(
         'tags/manage_tags.html',
         title='Manage Tags',
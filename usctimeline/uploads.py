@@ -0,0 +1,209 @@
+import os
+import errno
+import shutil
+import hashlib
+import tempfile
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+from usctimeline.images import EXTENSIONS, content_filename, image_path
+
+# Bytes examined to recognise the format of an upload. SVG files may open
+# with an XML declaration, a doctype and comments before the svg element.
+SNIFF_SIZE = 4096
+
+# Leading bytes of the raster formats accepted for event images
+SIGNATURES = [
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+]
+
+
+def sniff_image_format(head):
+    """Recognises an event image from its first bytes.
+
+    Args:
+        head: Up to SNIFF_SIZE first bytes of the file.
+
+    Returns:
+        'jpeg', 'png' or 'svg', or None if the file is none of these.
+    """
+    for signature, image_format in SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    text = head.lstrip(b'\xef\xbb\xbf \t\r\n').lower()
+    if text.startswith(b'<') and b'<svg' in text:
+        return 'svg'
+    return None
+
+
+def file_too_large(max_size):
+    """Returns the error aborting an upload larger than <max_size> bytes."""
+    return RequestEntityTooLarge(
+        f'Images may not be larger than {max_size / (1024 * 1024):.3g} MB.'
+    )
+
+
+def upload_image_format(file):
+    """Returns the format sniffed from an uploaded FileStorage, or None."""
+    return getattr(file.stream, 'image_format', None)
+
+
+def upload_directory():
+    """Returns the directory holding the uploads being received.
+
+    UPLOAD_TEMP_DIR defaults to `uploads/tmp` in the app's instance folder,
+    which the static route does not serve. It should be on the filesystem
+    of the event images, so that storing an upload only renames it.
+    """
+    return current_app.config.get('UPLOAD_TEMP_DIR') or os.path.join(
+        current_app.instance_path, 'uploads', 'tmp'
+    )
+
+
+def move_file(source, destination):
+    """Moves the file <source> to <destination>, replacing it atomically.
+
+    The file is renamed, or copied through a temporary file next to
+    <destination> if the two are on different filesystems.
+    """
+    try:
+        os.replace(source, destination)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(destination))
+    os.close(fd)
+    try:
+        shutil.copyfile(source, tmp_path)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.remove(source)
+
+
+class UploadStream:
+    """Receives an uploaded file from the form parser, chunk by chunk.
+
+    The file is written to a temporary file in <directory> (see
+    upload_directory()), where it cannot be downloaded, and hashed as it is
+    written. Storing it then only moves it among the event images. Files larger
+    than <max_size> abort the request as soon as the limit is crossed, and
+    the rest of a file whose first bytes are not a supported image is
+    discarded instead of written.
+
+    Attributes:
+        size: Number of bytes received.
+        image_format: Format recognised by sniff_image_format(), once known.
+    """
+
+    def __init__(self, directory, max_size):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=directory)
+        self.file = os.fdopen(fd, 'w+b')
+        self.max_size = max_size
+        self.size = 0
+        self.head = b''
+        self.sniffed = False
+        self.image_format = None
+        self.digest = hashlib.sha256()
+
+    def sniff(self):
+        """Recognises the format of the upload from its head."""
+        self.sniffed = True
+        self.image_format = sniff_image_format(self.head)
+
+    def write(self, data):
+        """Receives the next chunk of the upload from the form parser."""
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise file_too_large(self.max_size)
+        if not self.sniffed:
+            self.head += data[:SNIFF_SIZE - len(self.head)]
+            if len(self.head) >= SNIFF_SIZE:
+                self.sniff()
+        if self.sniffed and self.image_format is None:
+            return
+        self.digest.update(data)
+        self.file.write(data)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        # The parser rewinds the file once it was received in full
+        if not self.sniffed:
+            self.sniff()
+        return self.file.seek(offset, whence)
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def readline(self, size=-1):
+        return self.file.readline(size)
+
+    def tell(self):
+        return self.file.tell()
+
+    def store(self):
+        """Moves the upload to its content-addressed filename.
+
+        If a file with the same content is already stored it is kept as it
+        is and the upload is discarded.
+
+        Returns:
+            Filename of the image in IMAGE_DIRECTORY.
+
+        Raises:
+            ValueError: The upload is not a supported image.
+        """
+        if self.image_format is None:
+            raise ValueError('The upload is not a supported image.')
+        self.file.close()
+        filename = content_filename(
+            self.digest.hexdigest(), EXTENSIONS[self.image_format]
+        )
+        path = image_path(filename)
+        if not os.path.isfile(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # mkstemp() creates files only readable by their owner
+            os.chmod(self.path, 0o644)
+            move_file(self.path, path)
+            self.path = None
+        self.close()
+        return filename
+
+    def close(self):
+        """Closes the upload, removing its temporary file unless stored."""
+        self.file.close()
+        if self.path is not None:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.path = None
+
+
+class UploadRequest(Request):
+    """Request whose uploaded files are received by UploadStream.
+
+    The size of the whole request is limited by MAX_CONTENT_LENGTH, checked
+    by Flask before the body is read, and each file by IMAGE_MAX_SIZE.
+    Temporary files which were not stored are removed when the request is
+    closed, including those of an upload aborted midway.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_streams = []
+
+    def close(self):
+        for stream in self.upload_streams:
+            stream.close()
+        super().close()
+
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        max_size = current_app.config.get('IMAGE_MAX_SIZE', 16 * 1024 * 1024)
+        if content_length and content_length > max_size:
+            raise file_too_large(max_size)
+        stream = UploadStream(upload_directory(), max_size)
+        self.upload_streams.append(stream)
+        return stream
@@ -1,34 +1,41 @@
 import os
-import secrets
-from flask import url_for, current_app
+from flask import url_for
 from flask_mail import Message
 from usctimeline import mail
 from usctimeline.models import Image
+from usctimeline.images import delete_variant_files, image_path
+from usctimeline.jobs import PROCESS_IMAGE, enqueue
 
 
 def save_img_to_file_system(img):
-    """Saves image to filesystem.
+    """Saves image to filesystem, as uploaded, named after its content.
+
+    The upload was already written and hashed while the request was read
+    (see uploads.py), so saving it only renames its temporary file.
+    Uploading a file which is already stored returns its existing Image, so
+    events showing the same picture share one file and one row. The size
+    and resized variants of new images are left to a background job run by
+    worker.py (see jobs.py), so uploads do not wait for Pillow.
 
     Args:
-        img: Image file
+        img: Uploaded image file, of a supported upload_image_format()
 
     Returns:
-        New instance of Image
+        Instance of Image, new ones with their queued Job
     """
-    random_hex = secrets.token_hex(8)
-    _, file_ext = os.path.splitext(img.filename)
-    filename = random_hex + file_ext
-    directory = 'static/images/event'
-    filepath = os.path.join(current_app.root_path, directory, filename)
-    img.save(filepath)
-
-    return Image(filename=filename)
+    filename = img.stream.store()
+    image = Image.query.filter_by(filename=filename).first()
+    if image is None:
+        image = Image(filename=filename)
+        enqueue(PROCESS_IMAGE, image)
+    return image
 
 
 def delete_img_from_file_system(img):
-    filename = img.filename
-    if os.path.isfile('./usctimeline/static/images/event/' + filename):
-        os.remove('./usctimeline/static/images/event/' + filename)
+    delete_variant_files(img)
+    path = image_path(img.filename)
+    if os.path.isfile(path):
+        os.remove(path)
         return True
     else:
         return False
@@ -0,0 +1,174 @@
+import hashlib
+from datetime import datetime
+from functools import wraps
+from flask import make_response, request, session
+from flask_login import current_user
+from sqlalchemy import event, inspect
+from usctimeline import db
+from usctimeline.models import DataVersion, Event, Image, Tag, Category
+
+ALL = 'all'
+REFERENCE = 'reference'
+
+
+def event_key(event_id):
+    """Returns the DataVersion key of the Event with <event_id>."""
+    return f'event:{event_id}'
+
+
+def year_key(year):
+    """Returns the DataVersion key of the events dated in <year>."""
+    return f'year:{year}'
+
+
+def changed_keys(obj):
+    """Returns the DataVersion keys covering <obj>.
+
+    Every write to Event, Tag, Category or Image bumps 'all'. Writes to Tag
+    or Category also bump 'reference', since their names appear on many
+    pages. Writes to an Event, or to an Image attached to it, bump
+    'event:<id>'. Writes to an Event also bump 'year:<year>' of its date,
+    and of its previous date when it moved.
+
+    Args:
+        obj: Instance being inserted, updated or deleted.
+
+    Returns:
+        Set of DataVersion keys.
+    """
+    if isinstance(obj, Event):
+        dates = [obj.date] + list(inspect(obj).attrs.date.history.deleted)
+        return {ALL, event_key(obj.id)} | {year_key(d.year) for d in dates if d}
+    if isinstance(obj, Image):
+        return {ALL} | {event_key(e.id) for e in obj.events}
+    if isinstance(obj, (Tag, Category)):
+        return {ALL, REFERENCE}
+    return set()
+
+
+def bump_versions(connection, keys):
+    """Increments the DataVersion counters of <keys>.
+
+    Args:
+        connection: Connection of the transaction performing the write.
+        keys: Iterable of DataVersion keys.
+
+    Returns:
+        None
+    """
+    table = DataVersion.__table__
+    modified = datetime.utcnow().replace(microsecond=0)
+    for key in keys:
+        result = connection.execute(
+            table.update()
+            .where(table.c.key == key)
+            .values(version=table.c.version + 1, modified=modified)
+        )
+        if result.rowcount == 0:
+            connection.execute(
+                table.insert().values(key=key, version=1, modified=modified)
+            )
+
+
+@event.listens_for(db.session, 'after_flush')
+def bump_flushed_versions(session, flush_context):
+    """Bumps the DataVersion counters touched by the flushed changes."""
+    keys = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        keys.update(changed_keys(obj))
+    if keys:
+        bump_versions(session.connection(), sorted(keys))
+
+
+def get_versions(*keys):
+    """Reads the current DataVersion counters in a single query.
+
+    Args:
+        keys: DataVersion keys to read.
+
+    Returns:
+        Dictionary mapping each key to a (version, modified) tuple. Keys that
+        were never written map to (0, None).
+    """
+    versions = {key: (0, None) for key in keys}
+    rows = db.session.query(
+        DataVersion.key, DataVersion.version, DataVersion.modified
+    ).filter(DataVersion.key.in_(keys))
+    for key, version, modified in rows:
+        versions[key] = (version, modified)
+    return versions
+
+
+def make_etag(*parts):
+    """Returns an opaque entity tag built from <parts>."""
+    value = '|'.join(str(part) for part in parts)
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+def is_not_modified(etag, last_modified):
+    """Tests the request's conditional headers against the validators.
+
+    If-None-Match takes precedence over If-Modified-Since (RFC 7232).
+
+    Args:
+        etag: Strong entity tag of the current representation.
+        last_modified: Modification time of the current representation or
+            None if it should not be compared.
+
+    Returns:
+        True if the client's copy is still current.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+
+def conditional(validators, vary=()):
+    """Decorator adding conditional GET support to a route.
+
+    Emits strong ETag and Last-Modified headers and answers matching
+    If-None-Match / If-Modified-Since requests with a 304 before the route
+    runs. Logged-in users and requests with pending flash messages are
+    served normally, since their pages are personalised.
+
+    Args:
+        validators:
+            Function called with the route's arguments. Returns an
+            (etag, last_modified) tuple describing the current representation,
+            or None to skip conditional handling for this request.
+            last_modified may be None when the page varies per visitor.
+        vary:
+            Request headers, besides Cookie, the representation depends on.
+
+    Returns:
+        The decorated route.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if (request.method not in ('GET', 'HEAD')
+                    or current_user.is_authenticated
+                    or session.get('_flashes')):
+                return view(*args, **kwargs)
+            current = validators(*args, **kwargs)
+            if current is None:
+                return view(*args, **kwargs)
+            etag, last_modified = current
+            if is_not_modified(etag, last_modified):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+            for header in vary:
+                response.vary.add(header)
+            return response
+        return wrapper
+    return decorator
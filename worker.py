@@ -0,0 +1,51 @@
+"""Script running the background jobs queued by the site.
+
+Uploaded event images are saved as they are; their size and resized
+variants are produced by this worker (see usctimeline/jobs.py). Jobs are
+stored in the database, so no other service is needed, and several workers
+can run side by side.
+
+How to execute this script:
+`python worker.py`
+
+Add `--once` to run the queued jobs and exit, e.g. from cron. The worker
+stops after its current job on SIGINT or SIGTERM.
+"""
+
+import signal
+import argparse
+import threading
+from usctimeline import create_app
+from usctimeline.jobs import run_worker
+
+
+def main():
+    """Parses the command line arguments, then runs jobs until stopped.
+
+    Returns:
+        None
+    """
+    parser = argparse.ArgumentParser(description='Run queued background jobs.')
+    parser.add_argument(
+        '--once',
+        action='store_true',
+        help='Exit once the queue is empty.'
+    )
+    parser.add_argument(
+        '--poll-interval',
+        type=float,
+        help='Seconds to wait for new jobs when the queue is empty '
+             '(default JOB_POLL_INTERVAL).'
+    )
+    args = parser.parse_args()
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    count = run_worker(stop, args.once, args.poll_interval)
+    print(f'Ran {count} job(s).')
+
+
+if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        main()